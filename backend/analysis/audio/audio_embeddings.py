@@ -1,20 +1,136 @@
-import io
+from functools import lru_cache
+
 import librosa
 import numpy as np
 
-# def embedding_from_bytes(audio_bytes, sr=48000):
-#     audio_buffer = io.BytesIO(audio_bytes)
-#     y, sr = librosa.load(audio_buffer, sr=sr, mono=False)
 
-#     # Ensure stereo shape [2, n_samples]
-#     if y.ndim == 1:
-#         y = np.vstack([y, y])
+"""
+
+Lightweight CPU audio embeddings for similarity search
+
+No GPU and no downloaded weights: the embedding is built from log-mel
+statistics of the shared power spectrogram (per-band mean, spread and
+frame-to-frame movement), level-normalized and mapped through a fixed, seeded
+orthogonal projection. It takes a few milliseconds on top of the spectrogram
+the pipeline already computes, and cosine similarity between embeddings tracks
+similarity of tonal shape and spectral motion.
+
+The mel bands span EMBEDDING_FMIN-EMBEDDING_FMAX at every sample rate, so a
+32 kHz upload has the same band edges as a 44.1 or 48 kHz one and their
+embeddings are comparable. Bands above a lower-rate track's Nyquist hold no
+content; they are set to a fixed floor under the track's level instead.
+
+"""
+
+N_MELS = 64
+EMBEDDING_SIZE = 128
+EMBEDDING_VERSION = 2 # bump when the recipe changes; stored embeddings must then be recomputed
+PROJECTION_SEED = 20240601
+EMBEDDING_FMIN = 20.0
+EMBEDDING_FMAX = 16000.0 # below the Nyquist of every rate from 32 kHz up
+EMPTY_BAND_DB = -60.0 # level of bands above Nyquist, relative to the track's mean band level
+
+
+@lru_cache(maxsize=8)
+def _mel_filterbank(sr: int, n_fft: int, n_mels: int = N_MELS):
+    """
+    Returns:
+        (mel filterbank over EMBEDDING_FMIN-EMBEDDING_FMAX, mask of the bands below Nyquist)
+    """
+    # Same band edges at every rate: compute them once, independent of sr
+    mel_edges = librosa.mel_frequencies(n_mels + 2, fmin=EMBEDDING_FMIN, fmax=EMBEDDING_FMAX)
+    fft_freqs = librosa.fft_frequencies(sr=sr, n_fft=n_fft)
+    lower, center, upper = mel_edges[:-2, None], mel_edges[1:-1, None], mel_edges[2:, None]
+    weights = np.maximum(0, np.minimum((fft_freqs - lower) / (center - lower), (upper - fft_freqs) / (upper - center)))
+    weights *= 2.0 / (upper - lower) # Slaney area normalization, as librosa.filters.mel
+    return weights.astype(np.float32), upper[:, 0] <= sr / 2
+
+
+@lru_cache(maxsize=1)
+def _projection(n_in: int, n_out: int = EMBEDDING_SIZE):
+    # Fixed orthonormal random projection: same seed -> same embedding space on every machine
+    rng = np.random.default_rng(PROJECTION_SEED)
+    q, _ = np.linalg.qr(rng.standard_normal((n_in, n_out)))
+    return q.astype(np.float32)
+
+
+def compute_embedding(S_power, sr: int, n_fft: int):
+    """
+    Compute a track embedding from a power spectrogram.
+
+    Args:
+        S_power: power spectrogram, shape (1 + n_fft // 2, frames)
+        sr: sample rate of the spectrogram
+        n_fft: FFT size used for the spectrogram
+
+    Returns:
+        L2-normalized float32 embedding of length EMBEDDING_SIZE
+    """
+    filterbank, in_band = _mel_filterbank(sr, n_fft)
+    mel = filterbank @ S_power
+    log_mel = 10 * np.log10(mel + 1e-10)
+
+    if log_mel.shape[1] == 0:
+        return np.zeros(EMBEDDING_SIZE, dtype=np.float32)
+
+    # Remove the overall level so the embedding describes shape, not gain
+    log_mel -= log_mel[in_band].mean()
+    log_mel[~in_band] = EMPTY_BAND_DB
+
+    mean = log_mel.mean(axis=1)
+    std = log_mel.std(axis=1)
+    movement = np.abs(np.diff(log_mel, axis=1)).mean(axis=1) if log_mel.shape[1] > 1 else np.zeros(N_MELS)
+
+    # dB-scale statistics: bring them to roughly unit range before projecting
+    stats = np.concatenate([mean / 20.0, std / 10.0, movement / 5.0]).astype(np.float32)
+
+    embedding = stats @ _projection(stats.size)
+    norm = np.linalg.norm(embedding)
+    return embedding / norm if norm > 0 else embedding
+
+
+class EmbeddingIndex:
+    """
+    Brute-force cosine similarity over an (n, EMBEDDING_SIZE) float32 matrix.
+
+    One matrix-vector product per query; at tens of thousands of tracks this is
+    well under a millisecond, so no approximate index is needed.
+    """
+
+    def __init__(self, ids=None, matrix=None):
+        self.ids = list(ids) if ids is not None else []
+        self.matrix = matrix.astype(np.float32) if matrix is not None else np.zeros((0, EMBEDDING_SIZE), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def upsert(self, item_id: str, embedding):
+        embedding = np.asarray(embedding, dtype=np.float32)
+        if item_id in self.ids:
+            self.matrix[self.ids.index(item_id)] = embedding
+        else:
+            self.ids.append(item_id)
+            self.matrix = np.vstack([self.matrix, embedding[None, :]])
+
+    def search(self, embedding, k: int = 5, exclude: set = None):
+        """
+        Args:
+            embedding: L2-normalized query embedding
+            k: number of results
+            exclude: ids to leave out (e.g. the query itself)
 
-#     # OpenL3 embedding (music, content type 'music')
-#     emb, ts = openl3.get_audio_embedding(
-#         y.T, sr, content_type='music', input_repr='mel256', embedding_size=512
-#     )
+        Returns:
+            List of (id, cosine similarity), most similar first
+        """
+        if not self.ids:
+            return []
+        similarities = self.matrix @ np.asarray(embedding, dtype=np.float32)
+        if exclude:
+            for i, item_id in enumerate(self.ids):
+                if item_id in exclude:
+                    similarities[i] = -np.inf
 
-#     # Mean embedding for full track
-#     emb_mean = emb.mean(axis=0)
-#     return {"embedding_music": emb_mean.tolist()}
+        k = min(k, len(self.ids))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        return [(self.ids[i], float(similarities[i])) for i in top if np.isfinite(similarities[i])]
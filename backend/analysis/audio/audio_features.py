@@ -2,7 +2,8 @@ import librosa
 import numpy as np
 import pyloudnorm as pyln
 import pandas as pd
-from scipy.signal import resample_poly
+from scipy.signal import resample_poly, lfilter, lfilter_zi
+import scipy.fft
 import io
 
 
@@ -171,6 +172,147 @@ def get_loudness_features(y_stereo, sr):
     }
 
 
+_K_WEIGHTING_CACHE = {}
+
+def get_k_weighting_filters(sr):
+    """
+    BS.1770 K-weighting filters (high shelf, then high pass) for a sample rate.
+    Same coefficients pyloudnorm uses in get_loudness_features, for code that
+    filters audio incrementally (chunked or streaming).
+
+    Arguments:
+        sr : sample rate
+
+    Returns:
+        List of (b, a) coefficient pairs, in the order they must be applied
+    """
+    if sr not in _K_WEIGHTING_CACHE:
+        meter = pyln.Meter(sr)
+        _K_WEIGHTING_CACHE[sr] = [(f.b, f.a) for f in meter._filters.values()]
+    return _K_WEIGHTING_CACHE[sr]
+
+
+def gated_loudness(block_power):
+    """
+    BS.1770 gated loudness from 400 ms block powers.
+
+    Arguments:
+        block_power : per-block sum over channels of the K-weighted mean square
+
+    Returns:
+        Loudness in LUFS (-inf when every block is gated out)
+    """
+    block_power = np.asarray(block_power, dtype=np.float64)
+    if block_power.size == 0:
+        return float("-inf")
+
+    with np.errstate(divide="ignore"):
+        block_loudness = -0.691 + 10 * np.log10(block_power)
+
+    # Absolute gate (-70 LUFS), then relative gate (-10 LU below the absolutely gated mean)
+    above_abs = block_loudness >= -70.0
+    if not np.any(above_abs):
+        return float("-inf")
+    relative_gate = -0.691 + 10 * np.log10(np.mean(block_power[above_abs])) - 10.0
+    gated = above_abs & (block_loudness > relative_gate)
+    if not np.any(gated):
+        return float("-inf")
+    return float(-0.691 + 10 * np.log10(np.mean(block_power[gated])))
+
+
+def get_loudness_features_chunked(y_stereo, sr, chunk_s=30):
+    """
+    Low-memory variant of get_loudness_features: same metrics, computed chunk by
+    chunk. K-weighting filter state is carried across chunks and true-peak
+    oversampling overlaps them, so no full-length float64 copy is ever made.
+
+    Arguments:
+        y_stereo : stereo audio
+        sr : sample rate
+        chunk_s : chunk length in seconds (rounded to whole 400 ms blocks)
+
+    Returns:
+        Dictionary of loudness features
+    """
+    # Ensure stereo
+    if y_stereo.ndim == 1:
+        y_stereo = np.vstack([y_stereo, y_stereo])
+    n_samples = y_stereo.shape[1]
+
+    block_size = int(sr * 0.4)
+    sub_block = block_size // 4 # 100 ms gating step
+    chunk_size = block_size * max(1, int(round(chunk_s / 0.4)))
+    section_len = int(sr * 30)
+    margin = 64 # true-peak oversampling context either side of a chunk
+
+    filters = get_k_weighting_filters(sr)
+    filter_state = [[lfilter_zi(b, a) * 0.0 for b, a in filters] for _ in range(y_stereo.shape[0])]
+
+    k_power, block_rms, section_energy = [], [], np.zeros(n_samples // section_len + 1)
+    mono_energy, peak, true_peak = 0.0, 0.0, 0.0
+
+    for start in range(0, n_samples, chunk_size):
+        chunk = y_stereo[:, start:start + chunk_size]
+        mono = (chunk[0] + chunk[1]) / 2
+        n_sub = len(mono) // sub_block
+
+        # K-weighted energy per 100 ms step, summed over channels
+        chunk_power = np.zeros(n_sub)
+        for ch, channel in enumerate(chunk):
+            weighted = channel.astype(np.float64)
+            for i, (b, a) in enumerate(filters):
+                weighted, filter_state[ch][i] = lfilter(b, a, weighted, zi=filter_state[ch][i])
+            chunk_power += np.mean(weighted[:n_sub * sub_block].reshape(n_sub, sub_block) ** 2, axis=1)
+        k_power.append(chunk_power)
+
+        # RMS, 400 ms block RMS (chunks hold whole blocks) and 30 s loudness evolution
+        mono_energy += float(np.sum(mono.astype(np.float64) ** 2))
+        n_blocks = len(mono) // block_size
+        if n_blocks > 0:
+            block_rms.append(np.sqrt(np.mean(mono[:n_blocks * block_size].reshape(n_blocks, block_size) ** 2, axis=1)))
+        section_idx = (start + np.arange(len(mono))) // section_len
+        section_energy[:section_idx[-1] + 1] += np.bincount(section_idx, weights=mono ** 2, minlength=section_idx[-1] + 1)
+
+        # Peak, and 2x true peak with overlap so chunk edges see the same signal as one pass would
+        peak = max(peak, float(np.max(np.abs(mono))))
+        lo, hi = max(0, start - margin), min(n_samples, start + chunk_size + margin)
+        context = (y_stereo[0, lo:hi] + y_stereo[1, lo:hi]) / 2
+        y_os = resample_poly(context, 2, 1)[2 * (start - lo):2 * (start - lo + len(mono))]
+        true_peak = max(true_peak, float(np.max(np.abs(y_os))))
+
+    # Integrated LUFS: 400 ms gating blocks with 75 % overlap = 4 consecutive 100 ms steps
+    k_power = np.concatenate(k_power)
+    loudness_lufs = gated_loudness(np.convolve(k_power, np.ones(4) / 4, mode="valid")) if len(k_power) >= 4 else float("-inf")
+
+    rms = np.sqrt(mono_energy / max(1, n_samples))
+    rms_db = 20 * np.log10(rms + 1e-12)
+
+    if block_rms:
+        block_rms = np.concatenate(block_rms)
+        dynamic_range_db = 20 * np.log10(np.max(block_rms) / (np.min(block_rms) + 1e-12))
+    else:
+        dynamic_range_db = 0.0
+
+    peak_db = 20 * np.log10(peak + 1e-12)
+    true_peak_db = 20 * np.log10(true_peak + 1e-12)
+    crest_factor_db = 20 * np.log10((peak / (rms + 1e-12)) + 1e-12)
+
+    section_lengths = np.minimum(section_len, n_samples - np.arange(len(section_energy)) * section_len)
+    loudness_evolution = [
+        float(np.sqrt(energy / length))
+        for energy, length in zip(section_energy, section_lengths) if length > 0
+    ]
+
+    return {
+        "loudness_lufs": float(loudness_lufs),
+        "rms_db": float(rms_db),
+        "dynamic_range_db": float(dynamic_range_db),
+        "peak_db": float(peak_db),
+        "true_peak_db": float(true_peak_db),
+        "crest_factor_db": float(crest_factor_db),
+        "loudness_evolution": loudness_evolution,
+    }
+
 def get_transient_features(y, sr, max_duration = None, onset_env=None):
     """
     Fast transient analysis for audio bytes.
@@ -344,7 +486,74 @@ def get_frequency_spectrum_energy(y, sr):
     }
 
 
-def get_stereo_imaging_features(y, sr, bands=None):
+
+def get_frequency_spectrum_energy_low_memory(y, sr, block_bins=1 << 20):
+    """
+    Low-memory variant of get_frequency_spectrum_energy with the same results:
+    a float32 FFT (half the size of the float64 one), then band energies and
+    the spectral-tilt regression accumulated over blocks of bins, so no
+    full-length magnitude, frequency or log-frequency arrays are built.
+
+    Args:
+        y : mono audio
+        sr: sample rate
+        block_bins: bins processed per block
+
+    Returns:
+        Dictionary with normalized energy bands and spectral tilt.
+    """
+
+    bands = {
+        "Sub": (20, 60),
+        "Bass": (61, 200),
+        "Low_mids": (201, 600),
+        "Mids": (601, 3000),
+        "High_mids": (3001, 8000),
+        "Air": (8001, min(20000, sr//2))
+    }
+
+    if len(y) == 0:
+        return {"energy_bands": dict.fromkeys(bands, 0.0), "spectral_tilt": 0.0}
+
+    fft_complex = scipy.fft.rfft(np.asarray(y, dtype=np.float32))
+    bin_hz = sr / len(y)
+
+    energy_bands = dict.fromkeys(bands, 0.0)
+    # Normal equations of the degree-1 least-squares fit (same fit as np.polyfit)
+    sum_x = sum_xx = sum_y = sum_xy = 0.0
+
+    for start in range(0, len(fft_complex), block_bins):
+        magnitudes = np.abs(fft_complex[start:start + block_bins]).astype(np.float64)
+        frequencies = (start + np.arange(len(magnitudes))) * bin_hz
+
+        power = magnitudes ** 2
+        for name, (f_low, f_high) in bands.items():
+            f_high = min(f_high, sr/2)
+            energy_bands[name] += float(np.sum(power[(frequencies >= f_low) & (frequencies <= f_high)]))
+
+        frequencies[frequencies == 0] = 1
+        log_freqs = np.log10(frequencies)
+        safe_mags = magnitudes + 1e-12
+        sum_x += float(np.sum(log_freqs))
+        sum_xx += float(np.sum(log_freqs ** 2))
+        sum_y += float(np.sum(safe_mags))
+        sum_xy += float(np.sum(log_freqs * safe_mags))
+
+    # Normalize energy so sum = 1
+    total_energy = sum(energy_bands.values()) + 1e-12
+    for k in energy_bands:
+        energy_bands[k] /= total_energy
+
+    n_bins = len(fft_complex)
+    denom = n_bins * sum_xx - sum_x ** 2
+    spectral_tilt = (n_bins * sum_xy - sum_x * sum_y) / denom if denom > 0 else 0.0
+
+    return {
+        "energy_bands": energy_bands,
+        "spectral_tilt": float(spectral_tilt)
+    }
+
+def get_stereo_imaging_features(y, sr, bands=None, chunk_size=None):
     """
     Analyze stereo imaging of an audio track with perceptual band weighting.
 
@@ -352,6 +561,7 @@ def get_stereo_imaging_features(y, sr, bands=None):
         y: stereo or mono audio array
         sr: sample rate
         bands: dictionary of frequency bands (optional)
+        chunk_size: process this many samples at a time (optional, low-memory mode)
         
     Returns:
         Dictionary with stereo imaging metrics, including a perceptual
@@ -412,26 +622,10 @@ def get_stereo_imaging_features(y, sr, bands=None):
         y = np.vstack([y, y])
     elif y.shape[0] != 2:
         y = y.T
-    left, right = y[0].astype(np.float64), y[1].astype(np.float64)
-
-    # --- Mid/Side signals ---
-    mid = (left + right) / 2
-    side = (left - right) / 2
-
-    mid_energy = float(np.sum(mid**2))
-    side_energy = float(np.sum(side**2))
-    ms_center_fraction = mid_energy / (mid_energy + side_energy + 1e-12)
-    ms_side_fraction = side_energy / (mid_energy + side_energy + 1e-12)
+    n_samples = y.shape[1]
 
-    # --- Global correlation & LR balance ---
-    rms_L, rms_R = np.sqrt(np.mean(left**2)), np.sqrt(np.mean(right**2))
-    lr_balance = (rms_L - rms_R) / max(rms_L + rms_R, 1e-12)
-    correlation = float(np.corrcoef(left, right)[0, 1]) if left.std() > 1e-12 and right.std() > 1e-12 else 1.0
-
-    # --- STFT ---
+    # --- STFT setup ---
     n_fft, hop_length = 1024, 512
-    S_left = librosa.stft(left, n_fft=n_fft, hop_length=hop_length)
-    S_right = librosa.stft(right, n_fft=n_fft, hop_length=hop_length)
     freqs = librosa.fft_frequencies(sr=sr, n_fft=n_fft)
 
     if bands is None:
@@ -443,27 +637,70 @@ def get_stereo_imaging_features(y, sr, bands=None):
             "High_mids": (3001, 8000),
             "Air": (8001, min(sr // 2, 20000))
         }
+    band_masks = {name: (freqs >= f_low) & (freqs <= f_high) for name, (f_low, f_high) in bands.items()}
+
+    # Whole track at once, or hop-aligned chunks (low-memory mode)
+    chunk_size = n_samples if not chunk_size else max(hop_length, int(chunk_size) // hop_length * hop_length)
+
+    # --- Accumulate per chunk ---
+    mid_energy = side_energy = 0.0
+    sum_l = sum_r = sum_l2 = sum_r2 = sum_lr = 0.0
+    band_mid_energy = dict.fromkeys(bands, 0.0)
+    band_side_energy = dict.fromkeys(bands, 0.0)
+    frame_widths = []
+
+    for start in range(0, n_samples, chunk_size):
+        left, right = y[0, start:start + chunk_size].astype(np.float64), y[1, start:start + chunk_size].astype(np.float64)
+
+        # Mid/Side signals
+        mid = (left + right) / 2
+        side = (left - right) / 2
+        mid_energy += float(np.sum(mid**2))
+        side_energy += float(np.sum(side**2))
+        del mid, side
+
+        # Running sums for correlation and LR balance
+        sum_l += float(np.sum(left))
+        sum_r += float(np.sum(right))
+        sum_l2 += float(np.sum(left**2))
+        sum_r2 += float(np.sum(right**2))
+        sum_lr += float(np.sum(left * right))
+
+        S_left = librosa.stft(left, n_fft=n_fft, hop_length=hop_length)
+        S_right = librosa.stft(right, n_fft=n_fft, hop_length=hop_length)
+        P_mid = np.abs((S_left + S_right) / 2)**2
+        P_side = np.abs((S_left - S_right) / 2)**2
+        del S_left, S_right
+
+        # Per-band stereo energy
+        for name, mask in band_masks.items():
+            if np.any(mask):
+                band_mid_energy[name] += float(np.sum(P_mid[mask, :]))
+                band_side_energy[name] += float(np.sum(P_side[mask, :]))
+
+        # Frame-wise width
+        frame_mid_rms = np.sqrt(np.mean(P_mid, axis=0))
+        frame_side_rms = np.sqrt(np.mean(P_side, axis=0))
+        frame_widths.append(frame_side_rms / (frame_mid_rms + frame_side_rms + 1e-12))
 
-    # --- Per-band stereo width ---
-    S_mid = (S_left + S_right) / 2
-    S_side = (S_left - S_right) / 2
-    band_widths = {}
+    ms_center_fraction = mid_energy / (mid_energy + side_energy + 1e-12)
+    ms_side_fraction = side_energy / (mid_energy + side_energy + 1e-12)
 
-    for name, (f_low, f_high) in bands.items():
-        mask = (freqs >= f_low) & (freqs <= f_high)
-        if not np.any(mask):
-            band_widths[name] = 0.0
-            continue
+    # --- Global correlation & LR balance ---
+    rms_L, rms_R = np.sqrt(sum_l2 / n_samples), np.sqrt(sum_r2 / n_samples)
+    lr_balance = (rms_L - rms_R) / max(rms_L + rms_R, 1e-12)
+    var_L = sum_l2 / n_samples - (sum_l / n_samples)**2
+    var_R = sum_r2 / n_samples - (sum_r / n_samples)**2
+    cov_LR = sum_lr / n_samples - (sum_l / n_samples) * (sum_r / n_samples)
+    correlation = float(cov_LR / np.sqrt(var_L * var_R)) if var_L > 1e-24 and var_R > 1e-24 else 1.0
 
-        band_mid_energy = float(np.sum(np.abs(S_mid[mask, :])**2))
-        band_side_energy = float(np.sum(np.abs(S_side[mask, :])**2))
-        denom = band_mid_energy + band_side_energy
-        band_widths[name] = band_side_energy / denom if denom > 1e-12 else 0.0
+    # --- Per-band stereo width ---
+    band_widths = {}
+    for name in bands:
+        denom = band_mid_energy[name] + band_side_energy[name]
+        band_widths[name] = band_side_energy[name] / denom if denom > 1e-12 else 0.0
 
-    # --- Frame-wise width ---
-    frame_mid_rms = np.sqrt(np.mean(np.abs(S_mid)**2, axis=0))
-    frame_side_rms = np.sqrt(np.mean(np.abs(S_side)**2, axis=0))
-    frame_width = frame_side_rms / (frame_mid_rms + frame_side_rms + 1e-12)
+    frame_width = np.concatenate(frame_widths)
     mean_frame_width, std_frame_width = float(np.mean(frame_width)), float(np.std(frame_width))
 
     # --- Compute stereo width score & label ---
@@ -0,0 +1,318 @@
+import struct
+
+
+"""
+
+Fast header probe for uploaded audio
+
+Identifies the container from its magic bytes (never from the client MIME
+type) and reads duration, sample rate, channel count and bit depth from the
+header alone, without decoding any audio. Runs in microseconds, so cost
+estimation, early rejection and strategy selection can all use it.
+
+"""
+
+# Container format -> MIME type understood by convert_to_wav_in_memory
+FORMAT_TO_MIME = {
+    "wav": "audio/wav",
+    "flac": "audio/flac",
+    "ogg": "audio/ogg",
+    "mp3": "audio/mpeg",
+}
+
+# Only the head (and for OGG, the tail) of the file is inspected; WAV chunk headers are walked wherever they are
+PROBE_HEAD_BYTES = 64 * 1024
+PROBE_TAIL_BYTES = 64 * 1024
+
+# Typical FLAC size relative to the PCM it encodes, for streams whose STREAMINFO has no length
+FLAC_COMPRESSION_RATIO = 0.6
+
+
+class ProbeError(ValueError):
+    pass
+
+
+def _probe_result(fmt, sample_rate, channels, bit_depth, duration_s):
+    return {
+        "format": fmt,
+        "mime_type": FORMAT_TO_MIME[fmt],
+        "sample_rate": int(sample_rate),
+        "channels": int(channels),
+        "bit_depth": int(bit_depth) if bit_depth else None,
+        "duration_s": float(duration_s),
+    }
+
+
+# --- WAV ---
+
+def _probe_wav(data: bytes, total_size: int):
+    """
+    RIFF/RF64 WAVE: walk the chunks until both 'fmt ' and 'data' are found.
+    Walks the whole file, since metadata chunks (LIST, bext, iXML) can be
+    larger than the probe head; only the 8-byte chunk headers are read.
+    """
+    is_rf64 = data[:4] == b"RF64"
+    data_size_64 = None
+    fmt = None
+    data_size = None
+
+    pos = 12
+    while pos + 8 <= len(data):
+        chunk_id = data[pos:pos + 4]
+        chunk_size = struct.unpack_from("<I", data, pos + 4)[0]
+        body = pos + 8
+
+        if chunk_id == b"ds64" and is_rf64:
+            data_size_64 = struct.unpack_from("<Q", data, body + 8)[0]
+        elif chunk_id == b"fmt ":
+            fmt = struct.unpack_from("<HHIIHH", data, body)
+        elif chunk_id == b"data":
+            data_size = data_size_64 if (is_rf64 and chunk_size == 0xFFFFFFFF) else chunk_size
+            break
+
+        pos = body + chunk_size + (chunk_size & 1) # chunks are word aligned
+
+    if fmt is None or data_size is None:
+        raise ProbeError("WAV header without fmt/data chunk")
+
+    _, channels, sample_rate, byte_rate, _, bit_depth = fmt
+    if channels == 0 or sample_rate == 0 or byte_rate == 0:
+        raise ProbeError("Invalid WAV fmt chunk")
+
+    # Truncated uploads (or streaming writers that never patched the size): trust the file length
+    data_size = min(data_size, max(0, total_size - (pos + 8)))
+    return _probe_result("wav", sample_rate, channels, bit_depth, data_size / byte_rate)
+
+
+# --- FLAC ---
+
+def _probe_flac(data: bytes, total_size: int):
+    """
+    FLAC: the mandatory STREAMINFO block right after 'fLaC' has everything,
+    except the length of streams written without one (total samples 0).
+    """
+    block = data[8:8 + 18]
+    if len(block) < 18:
+        raise ProbeError("Truncated FLAC STREAMINFO")
+
+    # 20 bits sample rate | 3 bits channels-1 | 5 bits bps-1 | 36 bits total samples
+    packed = int.from_bytes(block[10:18], "big")
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    bit_depth = ((packed >> 36) & 0x1F) + 1
+    total_samples = packed & 0xFFFFFFFFF
+
+    if sample_rate == 0:
+        raise ProbeError("Invalid FLAC sample rate")
+    if total_samples:
+        duration_s = total_samples / sample_rate
+    else:
+        # Unknown length: estimate from the file size at a typical compression ratio
+        duration_s = total_size * 8 / (sample_rate * channels * bit_depth * FLAC_COMPRESSION_RATIO)
+    return _probe_result("flac", sample_rate, channels, bit_depth, duration_s)
+
+
+# --- OGG ---
+
+def _last_granule_position(data: bytes):
+    """
+    Granule position of the last page = total samples (Vorbis) or 48 kHz samples (Opus).
+    """
+    tail = data[-PROBE_TAIL_BYTES:]
+    idx = tail.rfind(b"OggS")
+    while idx >= 0:
+        if idx + 14 <= len(tail):
+            granule = struct.unpack_from("<q", tail, idx + 6)[0]
+            if granule >= 0:
+                return granule
+        idx = tail.rfind(b"OggS", 0, idx)
+    return 0
+
+
+def _probe_ogg(data: bytes):
+    """
+    OGG: codec header in the first packet, length from the last page's granule position.
+    """
+    # First page: 27-byte header + segment table, then the first packet
+    n_segments = data[26]
+    packet = data[27 + n_segments:27 + n_segments + 64]
+    granule = _last_granule_position(data)
+
+    if packet[:7] == b"\x01vorbis":
+        channels = packet[11]
+        sample_rate = struct.unpack_from("<I", packet, 12)[0]
+        if sample_rate == 0:
+            raise ProbeError("Invalid Vorbis sample rate")
+        return _probe_result("ogg", sample_rate, channels, None, granule / sample_rate)
+
+    if packet[:8] == b"OpusHead":
+        channels = packet[9]
+        pre_skip = struct.unpack_from("<H", packet, 10)[0]
+        # Opus always decodes at 48 kHz; the granule position counts 48 kHz samples
+        return _probe_result("ogg", 48000, channels, None, max(0, granule - pre_skip) / 48000)
+
+    if packet[:5] == b"\x7fFLAC":
+        result = {**_probe_flac(packet[9:], len(data)), "format": "ogg", "mime_type": FORMAT_TO_MIME["ogg"]}
+        if granule:
+            # FLAC granule positions count samples: exact even when STREAMINFO has no length
+            result["duration_s"] = granule / result["sample_rate"]
+        return result
+
+    raise ProbeError("Unsupported OGG codec")
+
+
+# --- MP3 ---
+
+MPEG_BITRATES = {
+    # (version, layer) -> kbps table for bitrate index 1..14
+    (1, 3): [32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 3): [8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MPEG_SAMPLE_RATES = {
+    1: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    2.5: [11025, 12000, 8000],
+}
+
+
+def _skip_id3v2(data: bytes):
+    if data[:3] != b"ID3" or len(data) < 10:
+        return 0
+    size = 0
+    for b in data[6:10]:
+        size = (size << 7) | (b & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _parse_mp3_frame_header(data: bytes, pos: int):
+    if pos + 4 > len(data):
+        return None
+    header = struct.unpack_from(">I", data, pos)[0]
+    if (header >> 21) & 0x7FF != 0x7FF:
+        return None
+
+    version_bits = (header >> 19) & 0x3
+    layer_bits = (header >> 17) & 0x3
+    bitrate_index = (header >> 12) & 0xF
+    rate_index = (header >> 10) & 0x3
+    padding = (header >> 9) & 0x1
+    channel_mode = (header >> 6) & 0x3
+
+    version = {3: 1, 2: 2, 0: 2.5}.get(version_bits)
+    if version is None or layer_bits != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None # only MPEG Layer III with a fixed bitrate index
+
+    bitrate = MPEG_BITRATES[(1 if version == 1 else 2, 3)][bitrate_index - 1] * 1000
+    sample_rate = MPEG_SAMPLE_RATES[version][rate_index]
+    samples_per_frame = 1152 if version == 1 else 576
+    frame_length = samples_per_frame // 8 * bitrate // sample_rate + padding
+
+    return {
+        "version": version,
+        "bitrate": bitrate,
+        "sample_rate": sample_rate,
+        "channels": 1 if channel_mode == 3 else 2,
+        "samples_per_frame": samples_per_frame,
+        "frame_length": frame_length,
+    }
+
+
+def _probe_mp3(data: bytes, total_size: int):
+    """
+    MP3: first valid frame header, then Xing/Info or VBRI frame count if present,
+    otherwise a constant-bitrate estimate from the file size.
+    """
+    # Find the first frame whose successor also parses (avoids false syncs)
+    pos = 0
+    frame = None
+    while pos < len(data) - 4:
+        if data[pos] == 0xFF:
+            frame = _parse_mp3_frame_header(data, pos)
+            if frame and _parse_mp3_frame_header(data, pos + frame["frame_length"]):
+                break
+            frame = None
+        pos += 1
+    if frame is None:
+        raise ProbeError("No MPEG audio frame found")
+
+    # Xing/Info header sits after the side information of the first frame
+    side_info = (32 if frame["channels"] == 2 else 17) if frame["version"] == 1 else (17 if frame["channels"] == 2 else 9)
+    n_frames = None
+    xing = pos + 4 + side_info
+    if data[xing:xing + 4] in (b"Xing", b"Info"):
+        flags = struct.unpack_from(">I", data, xing + 4)[0]
+        if flags & 0x1:
+            n_frames = struct.unpack_from(">I", data, xing + 8)[0]
+    elif data[pos + 36:pos + 40] == b"VBRI":
+        n_frames = struct.unpack_from(">I", data, pos + 36 + 14)[0]
+
+    if n_frames:
+        duration_s = n_frames * frame["samples_per_frame"] / frame["sample_rate"]
+    else:
+        # Constant bitrate: everything after the first frame is audio
+        duration_s = (total_size - pos) * 8 / frame["bitrate"]
+
+    return _probe_result("mp3", frame["sample_rate"], frame["channels"], None, duration_s)
+
+
+# --- ENTRY POINT ---
+
+def sniff_format(data: bytes):
+    """
+    Identify the container from magic bytes.
+
+    Args:
+        data: file head, with any ID3v2 tag already skipped
+
+    Returns:
+        "wav", "flac", "ogg", "mp3" or None
+    """
+    if data[:4] in (b"RIFF", b"RF64") and data[8:12] == b"WAVE":
+        return "wav"
+    if data[:4] == b"fLaC":
+        return "flac"
+    if data[:4] == b"OggS":
+        return "ogg"
+    if len(data) > 1 and data[0] == 0xFF and (data[1] & 0xE0) == 0xE0:
+        return "mp3"
+    return None
+
+
+def probe_audio(audio_bytes: bytes):
+    """
+    Read format, duration, sample rate, channels and bit depth from the header.
+
+    Args:
+        audio_bytes: raw audio file bytes (no audio data is decoded)
+
+    Returns:
+        Dictionary with format, mime_type, sample_rate, channels, bit_depth, duration_s
+
+    Raises:
+        ProbeError: unknown container or malformed header
+    """
+    # ID3v2 tags (often with embedded artwork) can precede MP3 and FLAC streams
+    offset = _skip_id3v2(audio_bytes)
+    head = audio_bytes[offset:offset + PROBE_HEAD_BYTES]
+    fmt = sniff_format(head)
+    if fmt is None and offset:
+        fmt = "mp3" # tagged MP3 with padding before the first frame
+
+    try:
+        if fmt == "wav":
+            # Zero-copy view: the data chunk can sit behind more metadata than the probe head holds
+            return _probe_wav(memoryview(audio_bytes)[offset:], len(audio_bytes) - offset)
+        if fmt == "flac":
+            return _probe_flac(head, len(audio_bytes) - offset)
+        if fmt == "ogg":
+            # The tail is needed for the last granule position
+            return _probe_ogg(audio_bytes)
+        if fmt == "mp3":
+            return _probe_mp3(head, len(audio_bytes) - offset)
+    except (struct.error, IndexError, ValueError) as e:
+        if isinstance(e, ProbeError):
+            raise
+        raise ProbeError(f"Malformed {fmt} header: {e}")
+
+    raise ProbeError("Unsupported audio format. Please upload WAV, MP3, OGG, or FLAC.")
@@ -0,0 +1,326 @@
+import hashlib
+
+import librosa
+import numpy as np
+from scipy.signal import lfilter, resample_poly
+
+from analysis.audio.audio_features import get_k_weighting_filters, gated_loudness
+from analysis.audio.sample_rate_policy import resample
+
+
+"""
+
+Chunk-level partial aggregates for incremental re-analysis
+
+Decoded PCM is split into fixed 10 s chunks on a grid of 100 ms sub-blocks.
+Each chunk is hashed and reduced to mergeable partial aggregates (sums,
+maxima, per-sub-block energies, a summed power spectrum, onset strength). A
+revised mix only needs aggregates for chunks whose hash changed; the rest come
+from the cache, and merging gives the track-level metrics.
+
+Filters must not restart at every chunk edge. The K-weighting filters run
+over a pre-roll of PREROLL_S from the previous chunk first (their state decays
+long before that, so LUFS matches the whole-track get_loudness_features), and
+the 2x true-peak resampler sees TRUE_PEAK_CONTEXT samples on either side.
+
+Onsets are not detected per chunk: the pre-roll and a post-roll of POSTROLL_S
+overlap the neighbouring chunks, so peaks near a seam would be found twice or
+lost to per-chunk thresholds. Each chunk instead keeps the onset-strength
+frames it owns on the track's global frame grid (computed with the overlap as
+context), and the merge concatenates them and picks peaks once over the whole
+track, like librosa.onset.onset_detect on the full signal.
+
+The context is hashed with the chunk, so an edit near a chunk edge also
+recomputes the neighbouring chunk. tools/validate_fast_modes.py, case
+revision_chunks, checks every merged metric against the whole-track functions.
+
+Chunking is on a fixed time grid, so an edit that shifts the timeline (inserted
+or removed audio) changes every chunk after it. Lossy formats may also decode
+slightly differently between exports; lossless uploads hash reliably.
+
+"""
+
+AGGREGATE_VERSION = 3 # part of every chunk hash: bump when the aggregate recipe changes
+
+SUB_BLOCK_S = 0.1
+SUB_BLOCKS_PER_CHUNK = 100 # 10 s chunks
+SPECTRUM_N_FFT = 4096
+ONSET_SR = 22050
+ONSET_HOP = 512 # librosa's default hop, as in the whole-track onset detection
+PREROLL_S = 0.5 # K-weighting warm-up and onset-strength context from the previous chunk
+POSTROLL_S = 0.25 # onset-strength context from the next chunk (STFT window, lag and resampler)
+TRUE_PEAK_CONTEXT = 32 # samples either side for the 2x resampler (its filter reaches 10)
+
+BANDS = {
+    "Sub": (20, 60),
+    "Bass": (61, 200),
+    "Low_mids": (201, 600),
+    "Mids": (601, 3000),
+    "High_mids": (3001, 8000),
+    "Air": (8001, 20000),
+}
+
+
+def chunk_length(sr: int):
+    """
+    Samples per chunk; always a whole number of 100 ms sub-blocks.
+    """
+    return SUB_BLOCKS_PER_CHUNK * int(round(sr * SUB_BLOCK_S))
+
+
+def split_chunks(y_stereo, sr: int):
+    """
+    Returns:
+        List of (start_sample, chunk, preroll, postroll), all shaped (2, samples):
+        preroll is the end of the previous chunk, postroll the start of the next
+        (empty at the track edges)
+    """
+    length = chunk_length(sr)
+    preroll = int(round(PREROLL_S * sr))
+    postroll = max(TRUE_PEAK_CONTEXT, int(round(POSTROLL_S * sr)))
+    return [
+        (
+            start,
+            y_stereo[:, start:start + length],
+            y_stereo[:, max(0, start - preroll):start],
+            y_stereo[:, start + length:start + length + postroll],
+        )
+        for start in range(0, y_stereo.shape[1], length)
+    ]
+
+
+def chunk_hash(chunk, sr: int, preroll=None, postroll=None, start: int = 0):
+    h = hashlib.blake2b(digest_size=16)
+    # Where the onset frame grid falls in the chunk also changes the aggregate (identical
+    # chunks at other positions, such as silence, get their own entry)
+    grid_phase = int(round(start * ONSET_SR / sr)) % ONSET_HOP
+    h.update(f"{AGGREGATE_VERSION}:{sr}:{grid_phase}:{chunk.shape}:{chunk.dtype.str}".encode())
+    h.update(np.ascontiguousarray(chunk).tobytes())
+    # The context changes the aggregate, so it is part of the key
+    for context in (preroll, postroll):
+        shape = None if context is None else context.shape
+        h.update(f":{shape}".encode())
+        if context is not None:
+            h.update(np.ascontiguousarray(context).tobytes())
+    return h.hexdigest()
+
+
+# --- PER-CHUNK AGGREGATES ---
+
+def _sub_block_mean_square(x, sub_block: int):
+    n_sub = len(x) // sub_block
+    if n_sub == 0:
+        return np.zeros(0, dtype=np.float64)
+    return np.mean(x[:n_sub * sub_block].reshape(n_sub, sub_block).astype(np.float64) ** 2, axis=1)
+
+
+def _onset_strength(chunk_mono, preroll_mono, postroll_mono, start: int, sr: int):
+    """
+    Onset-strength frames of the track's global ONSET_HOP grid that fall inside the chunk.
+
+    Args:
+        chunk_mono, preroll_mono, postroll_mono: mono audio at sr
+        start: first sample of the chunk in the track, at sr
+
+    Returns:
+        float32 array, one value per owned frame
+    """
+    context = np.concatenate([preroll_mono, chunk_mono, postroll_mono]).astype(np.float32)
+    y_onset = resample(context, sr, ONSET_SR) if sr != ONSET_SR else context
+
+    # Chunk span and context start in ONSET_SR samples of the whole track
+    chunk_start = int(round(start * ONSET_SR / sr))
+    chunk_end = int(round((start + len(chunk_mono)) * ONSET_SR / sr))
+    context_start = chunk_start - int(round(len(preroll_mono) * ONSET_SR / sr))
+
+    # Drop the few samples that put the context start off the global frame grid
+    offset = -context_start % ONSET_HOP
+    y_onset = y_onset[offset:]
+    first_frame = (context_start + offset) // ONSET_HOP
+    if len(y_onset) < 2048:
+        return np.zeros(0, dtype=np.float32)
+    envelope = librosa.onset.onset_strength(y=y_onset, sr=ONSET_SR, hop_length=ONSET_HOP)
+
+    # Frames whose centre is in [chunk_start, chunk_end): every frame belongs to exactly one chunk
+    own_first = -(-chunk_start // ONSET_HOP) - first_frame
+    own_last = -(-chunk_end // ONSET_HOP) - first_frame
+    return envelope[own_first:own_last].astype(np.float32)
+
+
+def detect_onsets(onset_envelope):
+    """
+    Onset times (s) picked from an onset-strength envelope on the ONSET_HOP grid.
+    """
+    if len(onset_envelope) == 0:
+        return np.zeros(0)
+    return librosa.onset.onset_detect(onset_envelope=np.asarray(onset_envelope, dtype=np.float32), sr=ONSET_SR, hop_length=ONSET_HOP, units="time")
+
+
+def compute_chunk_aggregate(chunk, sr: int, preroll=None, postroll=None, start: int = 0):
+    """
+    Reduce one stereo chunk to mergeable partial aggregates.
+
+    Args:
+        chunk: stereo audio, shape (2, samples), native rate
+        sr: sample rate
+        preroll: audio just before the chunk, (2, samples) (optional, see split_chunks)
+        postroll: audio just after the chunk, (2, samples) (optional)
+        start: first sample of the chunk in the track (places its onset frames on the track's grid)
+
+    Returns:
+        Dictionary of numpy scalars/arrays (see merge_chunk_aggregates)
+    """
+    preroll = np.zeros((2, 0), dtype=chunk.dtype) if preroll is None else preroll
+    postroll = np.zeros((2, 0), dtype=chunk.dtype) if postroll is None else postroll
+    n_pre = preroll.shape[1]
+
+    left, right = chunk[0].astype(np.float64), chunk[1].astype(np.float64)
+    mono = (left + right) / 2
+    side = (left - right) / 2
+    sub_block = int(round(sr * SUB_BLOCK_S))
+
+    # K-weighted energy per 100 ms sub-block, summed over channels (BS.1770 channel gain 1 for L/R);
+    # the filters warm up on the pre-roll, which is then dropped
+    k_power = np.zeros(len(mono) // sub_block)
+    for channel in (0, 1):
+        weighted = np.concatenate([preroll[channel], chunk[channel]]).astype(np.float64)
+        for b, a in get_k_weighting_filters(sr):
+            weighted = lfilter(b, a, weighted)
+        k_power += _sub_block_mean_square(weighted[n_pre:], sub_block)
+
+    # 2x oversampled peak, with neighbouring samples so the resampler has no edge here
+    pre_context = preroll[:, preroll.shape[1] - min(n_pre, TRUE_PEAK_CONTEXT):]
+    context_mono = np.concatenate([
+        np.mean(pre_context, axis=0, dtype=np.float64), mono, np.mean(postroll[:, :TRUE_PEAK_CONTEXT], axis=0, dtype=np.float64)
+    ])
+    n_context = pre_context.shape[1]
+    oversampled = resample_poly(context_mono, 2, 1)[2 * n_context:2 * (n_context + len(mono))]
+
+    # Summed windowed power spectrum (Welch-style, non-overlapping segments)
+    n_segments = len(mono) // SPECTRUM_N_FFT
+    if n_segments > 0:
+        segments = mono[:n_segments * SPECTRUM_N_FFT].reshape(n_segments, SPECTRUM_N_FFT) * np.hanning(SPECTRUM_N_FFT)
+        spectrum = np.sum(np.abs(np.fft.rfft(segments, axis=1)) ** 2, axis=0)
+    else:
+        spectrum = np.zeros(SPECTRUM_N_FFT // 2 + 1)
+
+    # Onset strength on the low-rate mono signal, with the neighbouring audio as context
+    onset_env = _onset_strength(
+        mono, np.mean(preroll, axis=0, dtype=np.float64), np.mean(postroll, axis=0, dtype=np.float64), start, sr
+    )
+
+    return {
+        "n_samples": np.int64(len(mono)),
+        "sum_l": np.sum(left), "sum_r": np.sum(right),
+        "sum_l2": np.sum(left ** 2), "sum_r2": np.sum(right ** 2), "sum_lr": np.sum(left * right),
+        "sum_mid2": np.sum(mono ** 2), "sum_side2": np.sum(side ** 2),
+        "peak": np.max(np.abs(mono)) if len(mono) else 0.0,
+        "true_peak": np.max(np.abs(oversampled)) if len(mono) else 0.0,
+        "mono_ms": _sub_block_mean_square(mono, sub_block),
+        "k_power": k_power,
+        "spectrum": spectrum.astype(np.float32),
+        "n_segments": np.int64(n_segments),
+        "onset_env": onset_env,
+    }
+
+
+# --- MERGE ---
+
+def merge_chunk_aggregates(aggregates, sr: int):
+    """
+    Merge per-chunk aggregates into track-level metrics.
+
+    Args:
+        aggregates: chunk aggregates in time order
+        sr: sample rate
+
+    Returns:
+        Dictionary of loudness, spectral, stereo and transient metrics
+    """
+    n = sum(int(a["n_samples"]) for a in aggregates)
+    if n == 0:
+        return None
+    total = lambda key: float(sum(float(a[key]) for a in aggregates))
+
+
+    # --- LOUDNESS ---
+
+    rms = np.sqrt(total("sum_mid2") / n)
+    peak = max(float(a["peak"]) for a in aggregates)
+    true_peak = max(float(a["true_peak"]) for a in aggregates)
+
+    mono_ms = np.concatenate([a["mono_ms"] for a in aggregates])
+    n_blocks = len(mono_ms) // 4 # 400 ms blocks
+    if n_blocks > 0:
+        block_rms = np.sqrt(mono_ms[:n_blocks * 4].reshape(n_blocks, 4).mean(axis=1))
+        dynamic_range_db = 20 * np.log10(np.max(block_rms) / (np.min(block_rms) + 1e-12))
+    else:
+        dynamic_range_db = 0.0
+
+    # 400 ms gating blocks with 75 % overlap = 4 consecutive 100 ms sub-blocks
+    k_power = np.concatenate([a["k_power"] for a in aggregates])
+    if len(k_power) >= 4:
+        k_blocks = np.convolve(k_power, np.ones(4) / 4, mode="valid")
+        loudness_lufs = gated_loudness(k_blocks)
+    else:
+        loudness_lufs = float("-inf")
+
+
+    # --- SPECTRUM ---
+
+    spectrum = np.sum([a["spectrum"].astype(np.float64) for a in aggregates], axis=0)
+    freqs = np.fft.rfftfreq(SPECTRUM_N_FFT, 1.0 / sr)
+    energy_bands = {
+        name: float(np.sum(spectrum[(freqs >= lo) & (freqs <= min(hi, sr / 2))]))
+        for name, (lo, hi) in BANDS.items()
+    }
+    band_total = sum(energy_bands.values()) + 1e-12
+    energy_bands = {name: e / band_total for name, e in energy_bands.items()}
+
+
+    # --- STEREO ---
+
+    sum_l2, sum_r2 = total("sum_l2"), total("sum_r2")
+    mean_l, mean_r = total("sum_l") / n, total("sum_r") / n
+    var_l = sum_l2 / n - mean_l ** 2
+    var_r = sum_r2 / n - mean_r ** 2
+    cov = total("sum_lr") / n - mean_l * mean_r
+    correlation = cov / np.sqrt(var_l * var_r) if var_l > 1e-24 and var_r > 1e-24 else 1.0
+    rms_l, rms_r = np.sqrt(sum_l2 / n), np.sqrt(sum_r2 / n)
+    mid_energy, side_energy = total("sum_mid2"), total("sum_side2")
+
+
+    # --- TRANSIENTS ---
+
+    # Peaks picked once over the whole track, so none is counted at two chunk seams
+    n_onsets = len(detect_onsets(np.concatenate([a["onset_env"] for a in aggregates])))
+    duration_s = n / sr
+
+    return {
+        "duration_s": duration_s,
+        "loudness_lufs": float(loudness_lufs),
+        "rms_db": float(20 * np.log10(rms + 1e-12)),
+        "peak_db": float(20 * np.log10(peak + 1e-12)),
+        "true_peak_db": float(20 * np.log10(true_peak + 1e-12)),
+        "crest_factor_db": float(20 * np.log10(peak / (rms + 1e-12) + 1e-12)),
+        "dynamic_range_db": float(dynamic_range_db),
+        "energy_bands": energy_bands,
+        "correlation": float(correlation),
+        "ms_side_fraction": float(side_energy / (mid_energy + side_energy + 1e-12)),
+        "lr_balance": float((rms_l - rms_r) / max(rms_l + rms_r, 1e-12)),
+        "transient_density": float(n_onsets / duration_s) if duration_s > 1e-6 else 0.0,
+    }
+
+
+def chunk_summary(aggregate, sr: int):
+    """
+    Small per-chunk metrics kept in the track manifest for revision diffs.
+    """
+    n = max(1, int(aggregate["n_samples"]))
+    mid, side = float(aggregate["sum_mid2"]), float(aggregate["sum_side2"])
+    return {
+        "rms_db": round(float(10 * np.log10(mid / n + 1e-24)), 2),
+        "peak_db": round(float(20 * np.log10(float(aggregate["peak"]) + 1e-12)), 2),
+        "side_fraction": round(side / (mid + side + 1e-12), 4),
+        "onsets": int(len(detect_onsets(aggregate["onset_env"]))), # thresholds of this chunk alone
+    }
@@ -0,0 +1,125 @@
+from functools import lru_cache
+
+import numpy as np
+from scipy import sparse
+
+
+"""
+
+Fractional-octave spectrum (1/3 and 1/6 octave) from the shared power spectrogram
+
+Each resolution is one sparse (bands x bins) matrix per (sr, n_fft, fraction),
+built once and cached. A bin's weight in a band is the fraction of the bin's
+width that falls inside the band, so band values are band powers (pink noise
+reads flat) and bands narrower than a bin, at the low end, interpolate
+between neighbouring bins instead of coming out empty. With the shared
+2048-point spectrogram (21.5 Hz bins at 44.1 kHz) bands below about 100 Hz
+are therefore smoothed across their neighbours.
+
+Applying a filterbank is a single sparse @ dense multiply over all frames.
+Returned curves are in dB relative to the track's mean total power, so tracks
+mastered at different levels can be compared directly:
+
+    mean_db                     power averaged over time
+    p10_db / p50_db / p90_db    per-frame percentiles (quiet / typical / loud passages)
+
+tilt_db_per_octave() fits a line through a mean_db curve against log2 frequency
+over a fixed range, so the slope reads the same at every sample rate.
+
+"""
+
+OCTAVE_FRACTIONS = {"third_octave": 3, "sixth_octave": 6}
+OCTAVE_PERCENTILES = [10, 50, 90]
+F_MIN = 20.0
+F_MAX = 20000.0
+F_REFERENCE = 1000.0 # band centres are F_REFERENCE * 2^(k / fraction)
+DB_FLOOR = -120.0
+TILT_MIN_HZ = 50.0
+TILT_MAX_HZ = 16000.0
+TILT_VALID_FLOOR_DB = -90.0 # bands this far below the mean power are noise, not balance
+TILT_MIN_BANDS = 6
+
+
+@lru_cache(maxsize=16)
+def _octave_filterbank(sr: int, n_fft: int, fraction: int):
+    """
+    Returns:
+        (float32 CSR matrix of shape (bands, 1 + n_fft // 2), band centre frequencies)
+    """
+    # Centres from just below F_MIN up to F_MAX; the top band must end below Nyquist
+    half_band = 2 ** (1 / (2 * fraction))
+    f_max = min(F_MAX * half_band, sr / 2) / half_band
+    k = np.arange(np.ceil(fraction * np.log2(F_MIN / half_band / F_REFERENCE)), np.floor(fraction * np.log2(f_max / F_REFERENCE)) + 1)
+    centers = F_REFERENCE * 2 ** (k / fraction)
+    lows, highs = centers / half_band, centers * half_band
+
+    bin_width = sr / n_fft
+    bin_freqs = np.arange(1 + n_fft // 2) * bin_width
+    bin_lows, bin_highs = bin_freqs - bin_width / 2, bin_freqs + bin_width / 2
+
+    # Overlap of every bin with every band, as a fraction of the bin width
+    overlap = np.minimum(highs[:, None], bin_highs[None, :]) - np.maximum(lows[:, None], bin_lows[None, :])
+    weights = np.clip(overlap / bin_width, 0.0, None).astype(np.float32)
+    return sparse.csr_matrix(weights), centers
+
+
+def get_octave_spectrum(S_power, sr: int, n_fft: int):
+    """
+    1/3 and 1/6 octave spectrum curves of a power spectrogram.
+
+    Args:
+        S_power: power spectrogram, shape (1 + n_fft // 2, frames)
+        sr: sample rate of the spectrogram
+        n_fft: FFT size used for the spectrogram
+
+    Returns:
+        Dictionary with one entry per resolution: centre frequencies and the
+        mean / percentile curves in dB relative to the mean total power
+    """
+    if S_power.shape[1] == 0:
+        raise ValueError("Empty spectrogram")
+
+    frame_power = S_power.sum(axis=0, dtype=np.float64)
+    total = float(frame_power.mean())
+    if total <= 0:
+        raise ValueError("Silent audio")
+
+    result = {"reference": "dB relative to the mean total power", "percentiles": OCTAVE_PERCENTILES}
+    for name, fraction in OCTAVE_FRACTIONS.items():
+        filterbank, centers = _octave_filterbank(sr, n_fft, fraction)
+        bands = filterbank @ S_power # (bands, frames) float32
+
+        mean_db = 10 * np.log10(bands.mean(axis=1, dtype=np.float64) / total + 1e-30)
+        frame_db = 10 * np.log10(bands / np.float32(total) + np.float32(1e-30))
+        percentiles_db = np.percentile(frame_db, OCTAVE_PERCENTILES, axis=1)
+
+        curves = {"center_hz": np.round(centers, 1).tolist(), "mean_db": _curve(mean_db)}
+        for p, curve in zip(OCTAVE_PERCENTILES, percentiles_db):
+            curves[f"p{p}_db"] = _curve(curve)
+        result[name] = curves
+    return result
+
+
+def _curve(values_db):
+    # 0.1 dB steps: far below what an EQ decision needs, and keeps the JSON small
+    return np.round(np.maximum(np.asarray(values_db, dtype=np.float64), DB_FLOOR), 1).tolist()
+
+
+def tilt_db_per_octave(center_hz, mean_db):
+    """
+    Spectral tilt of a fractional-octave curve.
+
+    Args:
+        center_hz: band centre frequencies
+        mean_db: band levels in dB (a mean_db curve, or the difference of two)
+
+    Returns:
+        Least-squares slope in dB per octave over TILT_MIN_HZ-TILT_MAX_HZ
+        (negative = darker), or None with fewer than TILT_MIN_BANDS bands
+    """
+    centers = np.asarray(center_hz, dtype=np.float64)
+    levels = np.asarray(mean_db, dtype=np.float64)
+    used = (centers >= TILT_MIN_HZ) & (centers <= TILT_MAX_HZ)
+    if used.sum() < TILT_MIN_BANDS:
+        return None
+    return round(float(np.polyfit(np.log2(centers[used]), levels[used], 1)[0]), 2) + 0.0
@@ -0,0 +1,192 @@
+import numpy as np
+from scipy.signal import firwin, lfilter, lfilter_zi
+
+from analysis.audio.audio_features import get_k_weighting_filters
+
+
+"""
+
+Real-time metering for streamed PCM
+
+A RealtimeMeter consumes arbitrary-sized chunks of audio and keeps per-100 ms
+sub-block aggregates in ring buffers. Filters carry their state between
+chunks, so the result does not depend on how the stream is cut up.
+
+    momentary LUFS      BS.1770 K-weighting, last 400 ms, ungated
+    short-term LUFS     same, last 3 s
+    true peak           2x oversampled mono downmix (as get_loudness_features)
+    band energies       same bands and normalization as get_frequency_spectrum_energy, last 3 s
+    correlation         Pearson L/R correlation (as get_stereo_imaging_features), last 3 s
+
+One reading is produced per completed sub-block, i.e. 10 per second of audio.
+Everything is vectorized over the sub-blocks in a chunk, so a 100 ms chunk
+costs about a millisecond.
+
+"""
+
+SUB_BLOCK_S = 0.1
+MOMENTARY_BLOCKS = 4 # 400 ms
+SHORT_TERM_BLOCKS = 30 # 3 s
+OVERSAMPLE_TAPS = 48
+
+BANDS = {
+    "Sub": (20, 60),
+    "Bass": (61, 200),
+    "Low_mids": (201, 600),
+    "Mids": (601, 3000),
+    "High_mids": (3001, 8000),
+    "Air": (8001, 20000),
+}
+
+
+def _power_to_lufs(mean_power):
+    return float(-0.691 + 10 * np.log10(mean_power)) if mean_power > 0 else float("-inf")
+
+
+class RealtimeMeter:
+
+    def __init__(self, sr: int, channels: int = 2):
+        if channels not in (1, 2):
+            raise ValueError("Only mono and stereo streams can be metered")
+
+        self.sr = sr
+        self.channels = channels
+        self.sub_block = int(round(sr * SUB_BLOCK_S))
+        self.samples_seen = 0
+
+        # Stateful filters: K-weighting per channel, 2x interpolation filter for true peak
+        self._k_filters = get_k_weighting_filters(sr)
+        self._k_state = [[lfilter_zi(b, a) * 0.0 for b, a in self._k_filters] for _ in range(2)]
+        self._os_filter = firwin(OVERSAMPLE_TAPS, 0.5) * 2
+        self._os_state = np.zeros(OVERSAMPLE_TAPS - 1)
+
+        # Samples of the current, incomplete sub-block
+        self._pending = np.zeros((2, 0))
+        self._pending_k = np.zeros((2, 0))
+        self._pending_os = np.zeros(0)
+
+        # Band masks for one sub-block FFT
+        freqs = np.fft.rfftfreq(self.sub_block, 1.0 / sr)
+        self._band_masks = np.stack([(freqs >= lo) & (freqs <= min(hi, sr / 2)) for lo, hi in BANDS.values()]).astype(np.float64)
+        self._window = np.hanning(self.sub_block)
+
+        # Ring buffers, one row per sub-block
+        self._ring_k = np.zeros(SHORT_TERM_BLOCKS)
+        self._ring_peak = np.zeros(SHORT_TERM_BLOCKS)
+        self._ring_bands = np.zeros((SHORT_TERM_BLOCKS, len(BANDS)))
+        self._ring_sums = np.zeros((SHORT_TERM_BLOCKS, 5)) # sum_l, sum_r, sum_l2, sum_r2, sum_lr
+        self._blocks = 0
+        self._max_true_peak = 0.0
+
+
+    # --- INPUT ---
+
+    def push(self, samples):
+        """
+        Feed a chunk of audio.
+
+        Args:
+            samples: float array, shape (channels, n) or (n,) for mono
+
+        Returns:
+            Latest reading (dict) if at least one sub-block completed, else None
+        """
+        samples = np.atleast_2d(np.asarray(samples, dtype=np.float64))
+        if samples.shape[0] != self.channels:
+            raise ValueError(f"Expected {self.channels} channel(s), got {samples.shape[0]}")
+        if samples.shape[1] == 0:
+            return None
+        if self.channels == 1:
+            samples = np.vstack([samples, samples])
+
+        # Filter the new samples only; state carries the history
+        weighted = np.empty_like(samples)
+        for ch in range(2):
+            x = samples[ch]
+            for i, (b, a) in enumerate(self._k_filters):
+                x, self._k_state[ch][i] = lfilter(b, a, x, zi=self._k_state[ch][i])
+            weighted[ch] = x
+
+        mono = samples.mean(axis=0)
+        stuffed = np.zeros(2 * len(mono))
+        stuffed[::2] = mono
+        oversampled, self._os_state = lfilter(self._os_filter, [1.0], stuffed, zi=self._os_state)
+
+        self.samples_seen += samples.shape[1]
+        raw = np.concatenate([self._pending, samples], axis=1)
+        weighted = np.concatenate([self._pending_k, weighted], axis=1)
+        oversampled = np.concatenate([self._pending_os, oversampled])
+
+        n_blocks = raw.shape[1] // self.sub_block
+        used = n_blocks * self.sub_block
+        self._pending, self._pending_k, self._pending_os = raw[:, used:], weighted[:, used:], oversampled[2 * used:]
+        if n_blocks == 0:
+            return None
+
+        self._add_blocks(
+            raw[:, :used].reshape(2, n_blocks, self.sub_block),
+            weighted[:, :used].reshape(2, n_blocks, self.sub_block),
+            oversampled[:2 * used].reshape(n_blocks, 2 * self.sub_block)
+        )
+        return self.reading()
+
+    def _add_blocks(self, raw, weighted, oversampled):
+        left, right = raw[0], raw[1]
+
+        k_power = np.mean(weighted ** 2, axis=2).sum(axis=0) # channel gain 1 for L/R
+        peaks = np.max(np.abs(oversampled), axis=1)
+        spectra = np.abs(np.fft.rfft((left + right) / 2 * self._window, axis=1)) ** 2
+        bands = spectra @ self._band_masks.T
+        sums = np.stack([
+            left.sum(axis=1), right.sum(axis=1),
+            (left ** 2).sum(axis=1), (right ** 2).sum(axis=1), (left * right).sum(axis=1)
+        ], axis=1)
+
+        # Only the last SHORT_TERM_BLOCKS can matter
+        self._max_true_peak = max(self._max_true_peak, float(np.max(peaks)))
+        skipped = max(0, len(k_power) - SHORT_TERM_BLOCKS)
+        k_power, peaks, bands, sums = k_power[skipped:], peaks[skipped:], bands[skipped:], sums[skipped:]
+        slots = (self._blocks + skipped + np.arange(len(k_power))) % SHORT_TERM_BLOCKS
+        self._ring_k[slots] = k_power
+        self._ring_peak[slots] = peaks
+        self._ring_bands[slots] = bands
+        self._ring_sums[slots] = sums
+
+        self._blocks += raw.shape[1]
+
+
+    # --- OUTPUT ---
+
+    def _last(self, ring, count: int):
+        count = min(count, self._blocks, SHORT_TERM_BLOCKS)
+        slots = (self._blocks - 1 - np.arange(count)) % SHORT_TERM_BLOCKS
+        return ring[slots]
+
+    def reading(self):
+        """
+        Returns:
+            Dictionary of the current meter values
+        """
+        if self._blocks == 0:
+            return None
+
+        short_sums = self._last(self._ring_sums, SHORT_TERM_BLOCKS).sum(axis=0)
+        n = min(self._blocks, SHORT_TERM_BLOCKS) * self.sub_block
+        mean_l, mean_r = short_sums[0] / n, short_sums[1] / n
+        var_l = short_sums[2] / n - mean_l ** 2
+        var_r = short_sums[3] / n - mean_r ** 2
+        cov = short_sums[4] / n - mean_l * mean_r
+        correlation = cov / np.sqrt(var_l * var_r) if var_l > 1e-24 and var_r > 1e-24 else 1.0
+
+        band_energy = self._last(self._ring_bands, SHORT_TERM_BLOCKS).sum(axis=0)
+        band_total = float(band_energy.sum()) + 1e-12
+
+        return {
+            "time_s": round(self._blocks * SUB_BLOCK_S, 2),
+            "momentary_lufs": _power_to_lufs(np.mean(self._last(self._ring_k, MOMENTARY_BLOCKS))),
+            "short_term_lufs": _power_to_lufs(np.mean(self._last(self._ring_k, SHORT_TERM_BLOCKS))),
+            "true_peak_db": float(20 * np.log10(np.max(self._last(self._ring_peak, SHORT_TERM_BLOCKS)) + 1e-12)),
+            "max_true_peak_db": float(20 * np.log10(self._max_true_peak + 1e-12)),
+            "energy_bands": {name: float(e / band_total) for name, e in zip(BANDS, band_energy)},
+            "correlation": float(np.clip(correlation, -1.0, 1.0)),
+        }
@@ -0,0 +1,156 @@
+import os
+from math import gcd
+
+import librosa
+import numpy as np
+from scipy.signal import resample_poly
+
+
+"""
+
+Internal analysis sample-rate policy
+
+True peak, loudness and the full-band spectrum (band energies and spectral
+tilt, a fit over every bin up to Nyquist) are measured at the native rate, so
+the policy does not change them. Every other stage (octave spectrum, stereo,
+tempo, transients, sections) reports nothing above 20 kHz, so it runs on a
+signal resampled once to 44.1/48 kHz, or lower where the stage allows. A 96
+or 192 kHz upload then costs about the same as a 48 kHz one for those stages.
+
+Resampled buffers (and the mono power spectrogram) are cached in
+AnalysisSignals, so each is computed once per track and shared by all stages.
+
+"""
+
+# "auto" = 48 kHz for 48k-family uploads, 44.1 kHz otherwise; or a fixed rate in Hz
+ANALYSIS_SAMPLE_RATE = os.getenv("ANALYSIS_SAMPLE_RATE", "auto")
+
+# Stages that are fine below the analysis rate (librosa's own default for beat/onset work)
+STAGE_SAMPLE_RATES = {
+    "tempo": int(os.getenv("TEMPO_SAMPLE_RATE", 22050)),
+    "transient": int(os.getenv("TRANSIENT_SAMPLE_RATE", 22050)),
+}
+
+# Shared mono power spectrogram (analysis rate)
+SPECTROGRAM_N_FFT = 2048
+SPECTROGRAM_HOP_LENGTH = 512
+
+
+def get_analysis_sample_rate(native_sr: int, policy: str = None):
+    """
+    Pick the shared analysis rate for a track. Never upsamples.
+
+    Args:
+        native_sr: sample rate of the decoded upload
+        policy: "auto" or a rate in Hz (defaults to ANALYSIS_SAMPLE_RATE)
+
+    Returns:
+        Analysis sample rate in Hz
+    """
+    policy = policy or ANALYSIS_SAMPLE_RATE
+    if policy == "auto":
+        target = 48000 if native_sr % 48000 == 0 else 44100
+    else:
+        target = int(policy)
+    return min(native_sr, target)
+
+
+def get_stage_sample_rate(stage: str, native_sr: int):
+    """
+    Sample rate a given stage runs at: its own lower rate if it has one, else the analysis rate.
+    """
+    analysis_sr = get_analysis_sample_rate(native_sr)
+    return min(analysis_sr, STAGE_SAMPLE_RATES.get(stage, analysis_sr))
+
+
+def resample(y, orig_sr: int, target_sr: int):
+    """
+    Polyphase FIR resampling along the last axis (scipy's resample_poly, Kaiser window).
+
+    Args:
+        y: audio array, (samples,) or (channels, samples)
+        orig_sr: input sample rate
+        target_sr: output sample rate
+
+    Returns:
+        float32 array at target_sr
+    """
+    if orig_sr == target_sr:
+        return y
+    g = gcd(int(orig_sr), int(target_sr))
+    up, down = int(target_sr) // g, int(orig_sr) // g
+    return resample_poly(y, up, down, axis=-1).astype(np.float32, copy=False)
+
+
+class AnalysisSignals:
+    """
+    Decoded track plus lazily resampled stereo/mono versions, cached per rate.
+
+    Stereo rates are derived from the closest higher rate already in the cache,
+    and sub-analysis-rate mono signals from the analysis-rate downmix, so the
+    full-rate signal is filtered only once.
+
+    stage_rates overrides STAGE_SAMPLE_RATES (e.g. decimated rates in low-memory
+    mode); spectrogram_chunk_s computes the power spectrogram block by block
+    instead of through one full complex STFT.
+    """
+
+    def __init__(self, y_stereo, sr: int, stage_rates: dict = None, spectrogram_chunk_s: float = None):
+        y_stereo = np.asarray(y_stereo)
+        if y_stereo.ndim == 1:
+            y_stereo = np.vstack([y_stereo, y_stereo])
+        self.native_sr = int(sr)
+        self.analysis_sr = get_analysis_sample_rate(self.native_sr)
+        self.stage_rates = {**STAGE_SAMPLE_RATES, **(stage_rates or {})}
+        self.spectrogram_chunk_s = spectrogram_chunk_s
+        self._stereo = {self.native_sr: y_stereo}
+        self._mono = {}
+        self._spectrograms = {}
+
+    def stereo(self, sr: int = None):
+        sr = sr or self.analysis_sr
+        if sr not in self._stereo:
+            source_sr = min(rate for rate in self._stereo if rate >= sr)
+            self._stereo[sr] = resample(self._stereo[source_sr], source_sr, sr)
+        return self._stereo[sr]
+
+    def mono(self, sr: int = None):
+        sr = sr or self.analysis_sr
+        if sr not in self._mono:
+            if sr >= self.analysis_sr:
+                # Downmix after resampling: both are linear, and the stereo buffer is shared
+                self._mono[sr] = np.mean(self.stereo(sr), axis=0)
+            else:
+                # Lower stage rates only need mono: resample the downmix, not both channels
+                self._mono[sr] = resample(self.mono(self.analysis_sr), self.analysis_sr, sr)
+        return self._mono[sr]
+
+    def power_spectrogram(self, n_fft: int = SPECTROGRAM_N_FFT, hop_length: int = SPECTROGRAM_HOP_LENGTH):
+        """
+        |STFT|^2 of the analysis-rate mono signal, float32, shape (1 + n_fft // 2, frames).
+        """
+        key = (n_fft, hop_length)
+        if key not in self._spectrograms:
+            if self.spectrogram_chunk_s:
+                self._spectrograms[key] = self._chunked_power_spectrogram(n_fft, hop_length)
+            else:
+                S = librosa.stft(self.mono(), n_fft=n_fft, hop_length=hop_length)
+                self._spectrograms[key] = (np.abs(S) ** 2).astype(np.float32)
+        return self._spectrograms[key]
+
+    def _chunked_power_spectrogram(self, n_fft: int, hop_length: int):
+        # Same frames as librosa.stft(center=True, pad_mode="constant"), one block of frames at a time
+        padded = np.pad(self.mono(), n_fft // 2)
+        n_frames = 1 + (len(padded) - n_fft) // hop_length
+        frames_per_block = max(1, int(self.spectrogram_chunk_s * self.analysis_sr) // hop_length)
+
+        S_power = np.empty((1 + n_fft // 2, n_frames), dtype=np.float32)
+        for f0 in range(0, n_frames, frames_per_block):
+            f1 = min(n_frames, f0 + frames_per_block)
+            segment = padded[f0 * hop_length:(f1 - 1) * hop_length + n_fft]
+            S = librosa.stft(segment, n_fft=n_fft, hop_length=hop_length, center=False)
+            S_power[:, f0:f1] = np.abs(S) ** 2
+        return S_power
+
+    def stage_sr(self, stage: str):
+        return min(self.analysis_sr, self.stage_rates.get(stage, self.analysis_sr))
@@ -0,0 +1,191 @@
+import numpy as np
+from scipy.ndimage import uniform_filter1d
+from scipy.signal import find_peaks
+
+
+"""
+
+Section-aware analysis (intro / drop / breakdown ...)
+
+Finds section boundaries from data the pipeline already has (shared power
+spectrogram, onset envelope, stereo signal) and reports loudness, band energy
+and stereo width per section by aggregating frame-level values, instead of
+running each extractor again on every section.
+
+Boundaries come from a Foote checkerboard novelty curve over a self-similarity
+matrix of ~1 s blocks (band energies, loudness, onset strength, width).
+
+"""
+
+BANDS = {
+    "Sub": (20, 60),
+    "Bass": (61, 200),
+    "Low_mids": (201, 600),
+    "Mids": (601, 3000),
+    "High_mids": (3001, 8000),
+    "Air": (8001, 20000),
+}
+
+BLOCK_S = 1.0 # novelty resolution
+KERNEL_S = 16.0 # checkerboard kernel width (8 s either side of a boundary)
+MIN_SECTION_S = 8.0
+MAX_SECTIONS = 16
+
+
+def _frame_energy(x, hop_length: int, frames_per_block: int = 4096):
+    """
+    Sum of squares per hop-sized block (aligned with the STFT frames).
+    Done a block of frames at a time so no full-length float64 copy is made.
+    """
+    n_frames = len(x) // hop_length
+    energy = np.zeros(n_frames, dtype=np.float64)
+    for f0 in range(0, n_frames, frames_per_block):
+        f1 = min(n_frames, f0 + frames_per_block)
+        blocks = x[f0 * hop_length:f1 * hop_length].reshape(f1 - f0, hop_length).astype(np.float64)
+        energy[f0:f1] = np.sum(blocks ** 2, axis=1)
+    return energy
+
+
+def _pool(values, block: int):
+    """
+    Mean over consecutive groups of `block` frames along the last axis.
+    """
+    n_blocks = values.shape[-1] // block
+    if n_blocks == 0:
+        return values[..., :0]
+    trimmed = values[..., :n_blocks * block]
+    return trimmed.reshape(*values.shape[:-1], n_blocks, block).mean(axis=-1)
+
+
+def _checkerboard_kernel(size: int):
+    half = size // 2
+    sign = np.ones(size)
+    sign[:half] = -1
+    kernel = np.outer(sign, sign) # +1 within a side, -1 across the boundary
+    taper = np.hanning(size + 2)[1:-1]
+    return kernel * np.outer(taper, taper)
+
+
+def _novelty(block_features, kernel_blocks: int):
+    """
+    Foote novelty: correlate a checkerboard kernel along the SSM diagonal.
+    """
+    n = block_features.shape[1]
+    norms = np.linalg.norm(block_features, axis=0) + 1e-12
+    unit = block_features / norms
+    ssm = unit.T @ unit # cosine similarity, (n, n)
+
+    kernel = _checkerboard_kernel(kernel_blocks)
+    half = kernel_blocks // 2
+    padded = np.pad(ssm, half, mode="edge")
+    novelty = np.array([
+        np.sum(padded[i:i + kernel_blocks, i:i + kernel_blocks] * kernel)
+        for i in range(n)
+    ])
+    return np.maximum(novelty, 0)
+
+
+def get_section_features(S_power, sr: int, hop_length: int, y_stereo, onset_env=None, onset_sr: int = None, onset_hop: int = 512):
+    """
+    Segment a track into sections and aggregate frame-level metrics per section.
+
+    Args:
+        S_power: shared power spectrogram (1 + n_fft // 2, frames) at `sr`
+        sr: sample rate of S_power and y_stereo
+        hop_length: hop length of S_power
+        y_stereo: stereo audio at `sr`, shape (2, samples)
+        onset_env: onset strength envelope (optional, any frame rate)
+        onset_sr: sample rate the onset envelope was computed at
+        onset_hop: hop length of the onset envelope
+
+    Returns:
+        Dictionary with section boundaries and per-section loudness, band energy and stereo width
+    """
+    n_fft = 2 * (S_power.shape[0] - 1)
+    freqs = np.fft.rfftfreq(n_fft, 1.0 / sr)
+
+
+    # --- FRAME-LEVEL DATA ---
+
+    # Band energies per frame: one masked sum per band over the shared spectrogram
+    band_frames = np.stack([
+        S_power[(freqs >= lo) & (freqs <= min(hi, sr / 2))].sum(axis=0)
+        for lo, hi in BANDS.values()
+    ]).astype(np.float64)
+
+    left, right = y_stereo[0], y_stereo[1]
+    mid_frames = _frame_energy((left + right) / 2, hop_length)
+    side_frames = _frame_energy((left - right) / 2, hop_length)
+
+    n_frames = min(band_frames.shape[1], mid_frames.size)
+    band_frames, mid_frames, side_frames = band_frames[:, :n_frames], mid_frames[:n_frames], side_frames[:n_frames]
+    frame_times = np.arange(n_frames) * hop_length / sr
+
+    # Onset envelope re-sampled onto the spectrogram frame grid
+    if onset_env is not None and onset_sr:
+        onset_times = np.arange(len(onset_env)) * onset_hop / onset_sr
+        onset_frames = np.interp(frame_times, onset_times, onset_env)
+    else:
+        onset_frames = np.zeros(n_frames)
+
+
+    # --- NOVELTY AND BOUNDARIES ---
+
+    frames_per_block = max(1, int(round(BLOCK_S * sr / hop_length)))
+    block_mid = _pool(mid_frames, frames_per_block)
+    n_blocks = block_mid.size
+    block_duration = frames_per_block * hop_length / sr
+
+    boundaries = [0.0]
+    kernel_blocks = max(4, int(round(KERNEL_S / block_duration)) // 2 * 2)
+    if n_blocks >= kernel_blocks:
+        block_features = np.vstack([
+            10 * np.log10(_pool(band_frames, frames_per_block) + 1e-12),
+            10 * np.log10(block_mid + 1e-12)[None, :],
+            _pool(onset_frames, frames_per_block)[None, :],
+            (_pool(side_frames, frames_per_block) / (block_mid + _pool(side_frames, frames_per_block) + 1e-12))[None, :],
+        ])
+        # Standardize each feature so dB and 0..1 values weigh the same
+        block_features = (block_features - block_features.mean(axis=1, keepdims=True)) / (block_features.std(axis=1, keepdims=True) + 1e-9)
+
+        novelty = uniform_filter1d(_novelty(block_features, kernel_blocks), size=3)
+        min_distance = max(1, int(MIN_SECTION_S / block_duration))
+        peaks, props = find_peaks(novelty, distance=min_distance, height=novelty.mean() + 0.5 * novelty.std())
+
+        # Keep the strongest boundaries, then restore time order
+        if len(peaks) > MAX_SECTIONS - 1:
+            peaks = np.sort(peaks[np.argsort(props["peak_heights"])[::-1][:MAX_SECTIONS - 1]])
+        boundaries += [float(p * block_duration) for p in peaks]
+
+    duration = n_frames * hop_length / sr
+    # The track start always opens a section, so short tracks still get one covering everything
+    boundaries = [0.0] + [b for b in boundaries[1:] if MIN_SECTION_S / 2 <= b < duration - MIN_SECTION_S / 2] + [duration]
+
+
+    # --- PER-SECTION AGGREGATES ---
+
+    track_rms_db = 10 * np.log10(np.mean(mid_frames) / hop_length + 1e-12)
+    sections = []
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        i0, i1 = int(start * sr / hop_length), max(int(start * sr / hop_length) + 1, int(end * sr / hop_length))
+        mid_energy = float(np.sum(mid_frames[i0:i1]))
+        side_energy = float(np.sum(side_frames[i0:i1]))
+        band_energy = band_frames[:, i0:i1].sum(axis=1)
+        band_total = float(band_energy.sum()) + 1e-12
+
+        rms_db = 10 * np.log10(mid_energy / (max(1, i1 - i0) * hop_length) + 1e-12)
+        sections.append({
+            "start_s": round(start, 2),
+            "end_s": round(end, 2),
+            "rms_db": round(float(rms_db), 2),
+            "relative_loudness_db": round(float(rms_db - track_rms_db), 2),
+            "energy_bands": {name: round(float(e / band_total), 4) for name, e in zip(BANDS, band_energy)},
+            "side_fraction": round(side_energy / (mid_energy + side_energy + 1e-12), 4),
+            "onset_strength": round(float(np.mean(onset_frames[i0:i1])) if i1 > i0 else 0.0, 3),
+        })
+
+    return {
+        "num_sections": len(sections),
+        "boundaries_s": [round(b, 2) for b in boundaries],
+        "sections": sections,
+    }
@@ -0,0 +1,235 @@
+"""
+
+Multi-resolution waveform peaks for the frontend
+
+Built from the decoded PCM right after it is loaded: level 0 holds one
+(min, max, rms) triple per channel for every BASE_SAMPLES_PER_PEAK samples,
+each further level halves the resolution (mipmap-style), down to about
+MIN_LEVEL_PEAKS peaks. Values are quantized to int8 (x127) by default.
+
+    <path>/<track id>.json      index: sample rate, channels, dtype, one entry per level
+    <path>/<track id>.bin       levels back to back, each shaped (peaks, channels, 3)
+
+A level entry gives its byte offset, so a client fetches one zoom level, or
+the part of it covering a time window, with an HTTP Range request. A 3-minute
+stereo track is about 370 KB for all levels in int8, against 63 MB of float32 PCM.
+
+The directory is capped at WAVEFORM_MAX_MB with the chunk cache's policy:
+every EVICT_EVERY_PUTS writes, the least recently used tracks (by mtime, which
+reading the index refreshes) are deleted until the total is under the cap.
+A track's index goes before its data, so an index never points at a missing
+file.
+
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+
+from analysis.utils.helper import DATA_DIR, TMP_FILE_GRACE_S
+
+
+WAVEFORM_DIR = os.getenv("WAVEFORM_DIR", os.path.join(DATA_DIR, "waveforms"))
+WAVEFORM_DTYPE = os.getenv("WAVEFORM_DTYPE", "int8") # int8 or float16
+WAVEFORM_MAX_MB = float(os.getenv("WAVEFORM_MAX_MB", 1024))
+EVICT_EVERY_PUTS = 64
+
+BASE_SAMPLES_PER_PEAK = 256
+MIN_LEVEL_PEAKS = 1024
+FIELDS = ["min", "max", "rms"]
+
+
+def build_peak_pyramid(y, sr: int):
+    """
+    Min/max/RMS peaks per channel at every zoom level.
+
+    Args:
+        y: audio, shape (channels, samples) or (samples,)
+        sr: sample rate
+
+    Returns:
+        List of float32 arrays of shape (peaks, channels, 3), finest level first
+    """
+    y = np.atleast_2d(y)
+    channels, n = y.shape
+    full = n // BASE_SAMPLES_PER_PEAK
+
+    # Level 0: whole blocks vectorized, a partial last block on its own
+    blocks = y[:, :full * BASE_SAMPLES_PER_PEAK].reshape(channels, full, BASE_SAMPLES_PER_PEAK)
+    mins, maxs = blocks.min(axis=2).T, blocks.max(axis=2).T
+    sum_squares = np.einsum("cpk,cpk->pc", blocks, blocks, dtype=np.float64)
+    counts = np.full(full, BASE_SAMPLES_PER_PEAK, dtype=np.float64)
+    tail = y[:, full * BASE_SAMPLES_PER_PEAK:]
+    if tail.shape[1] or full == 0:
+        tail = tail if tail.shape[1] else np.zeros((channels, 1), dtype=y.dtype)
+        mins = np.vstack([mins, tail.min(axis=1)])
+        maxs = np.vstack([maxs, tail.max(axis=1)])
+        sum_squares = np.vstack([sum_squares, np.sum(tail.astype(np.float64) ** 2, axis=1)])
+        counts = np.append(counts, tail.shape[1])
+
+    levels = []
+    while True:
+        rms = np.sqrt(sum_squares / counts[:, None])
+        levels.append(np.stack([mins, maxs, rms], axis=2).astype(np.float32))
+        if len(mins) <= MIN_LEVEL_PEAKS:
+            return levels
+
+        # Next level: merge pairs of peaks (an odd last peak stays on its own)
+        pairs = len(mins) // 2
+        odd = len(mins) % 2
+        merge = lambda a, op: np.concatenate([op(a[:2 * pairs:2], a[1:2 * pairs:2]), a[2 * pairs:]]) if odd else op(a[0::2], a[1::2])
+        mins = merge(mins, np.minimum)
+        maxs = merge(maxs, np.maximum)
+        sum_squares = merge(sum_squares, np.add)
+        counts = merge(counts, np.add)
+
+
+def _quantize(level, dtype: str):
+    if dtype == "int8":
+        return np.round(np.clip(level, -1.0, 1.0) * 127).astype(np.int8)
+    return level.astype(np.float16)
+
+
+class WaveformStore:
+
+    def __init__(self, path: str = WAVEFORM_DIR, max_mb: float = WAVEFORM_MAX_MB):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.max_bytes = max_mb * 1024 * 1024
+        self._puts = 0
+
+    def index_path(self, track_id: str):
+        return os.path.join(self.path, f"{track_id}.json")
+
+    def data_path(self, track_id: str):
+        return os.path.join(self.path, f"{track_id}.bin")
+
+    def __contains__(self, track_id: str):
+        return os.path.exists(self.index_path(track_id))
+
+    def get_index(self, track_id: str):
+        try:
+            with open(self.index_path(track_id)) as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return None
+        self._touch(track_id)
+        return index
+
+    def _touch(self, track_id: str):
+        # The mtime is the LRU clock: a read keeps the track from being evicted
+        for path in (self.index_path(track_id), self.data_path(track_id)):
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+
+    def put(self, track_id: str, y, sr: int, dtype: str = WAVEFORM_DTYPE):
+        """
+        Build and store the pyramid of a track (no-op if it is already stored).
+
+        Returns:
+            The index of the stored pyramid
+        """
+        if track_id in self:
+            return self.get_index(track_id)
+
+        y = np.atleast_2d(y)
+        levels, offset = [], 0
+        data_tmp = f"{self.data_path(track_id)}.{os.getpid()}.tmp"
+        with open(data_tmp, "wb") as f:
+            for i, level in enumerate(build_peak_pyramid(y, sr)):
+                raw = _quantize(level, dtype).tobytes()
+                f.write(raw)
+                levels.append({
+                    "level": i,
+                    "samples_per_peak": BASE_SAMPLES_PER_PEAK << i,
+                    "peaks": level.shape[0],
+                    "byte_offset": offset,
+                    "byte_length": len(raw),
+                })
+                offset += len(raw)
+
+        index = {
+            "track_id": track_id,
+            "sample_rate": sr,
+            "channels": y.shape[0],
+            "duration_s": round(y.shape[1] / sr, 3),
+            "dtype": dtype,
+            "scale": 127 if dtype == "int8" else 1.0,
+            "fields": FIELDS,
+            "layout": "peaks x channels x fields, row-major",
+            "levels": levels,
+        }
+
+        # Data first, index last: an index on disk always points at a complete file
+        os.replace(data_tmp, self.data_path(track_id))
+        index_tmp = f"{self.index_path(track_id)}.{os.getpid()}.tmp"
+        with open(index_tmp, "w") as f:
+            json.dump(index, f)
+        os.replace(index_tmp, self.index_path(track_id))
+
+        self._puts += 1
+        if self._puts % EVICT_EVERY_PUTS == 0:
+            self.evict()
+        return index
+
+    def evict(self):
+        """
+        Delete least recently used tracks until the store is under max_bytes.
+        Several processes may evict at once; files already gone are skipped.
+
+        Returns:
+            Number of tracks deleted
+        """
+        now = time.time()
+        tracks = {} # track id -> [newest mtime, total size]
+        stray = [] # temporary files of crashed writers, data without an index
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if ".tmp" in entry.name:
+                    if now - stat.st_mtime >= TMP_FILE_GRACE_S:
+                        stray.append(entry.path)
+                    continue
+                track_id = entry.name.split(".")[0]
+                track = tracks.setdefault(track_id, [0.0, 0])
+                track[0] = max(track[0], stat.st_mtime)
+                track[1] += stat.st_size
+
+        for path in stray:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        total = sum(size for _, size in tracks.values())
+        deleted = 0
+        for track_id, (_, size) in sorted(tracks.items(), key=lambda item: item[1][0]):
+            if total <= self.max_bytes:
+                break
+            for path in (self.index_path(track_id), self.data_path(track_id)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            deleted += 1
+            total -= size
+        return deleted
+
+
+_store = None
+
+def get_waveform_store():
+    """
+    Process-wide store instance (lazily opened).
+    """
+    global _store
+    if _store is None:
+        _store = WaveformStore()
+    return _store
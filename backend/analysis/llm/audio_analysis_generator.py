@@ -2,40 +2,104 @@ from groq import Groq
 import os
 import time
 import json
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from fastapi.encoders import jsonable_encoder
-from analysis.llm.audio_analysis_prompt import create_audio_analysis_prompt
+from analysis.llm.audio_analysis_prompt import build_report_prompt, create_compact_audio_analysis_prompt, LLM_PROMPT_FORMAT
+from analysis.llm.token_budget import LLM_PROMPT_TOKEN_BUDGET
 load_dotenv(".env.development")
 
 client = Groq(api_key=os.getenv("GROQ_API_KEY"))
 
 MODEL = "openai/gpt-oss-120b"
 
+SYSTEM_PROMPT = "You are a professional audio engineer and mastering specialist with extensive experience across multiple genres. You provide detailed, technical analysis with specific, actionable recommendations."
 
+# sections: one request per report section, run concurrently (compact prompts only)
+# single: the whole report in one completion
+LLM_REPORT_MODE = os.getenv("LLM_REPORT_MODE", "sections")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8")) # section requests in flight, process-wide
+LLM_SECTION_RETRIES = int(os.getenv("LLM_SECTION_RETRIES", "2"))
+LLM_RETRY_BACKOFF_S = float(os.getenv("LLM_RETRY_BACKOFF_S", "1.0"))
 
-def generate_report(features: dict, features_reference: dict = None):
+# Top-level categories every report must contain
+REQUIRED_CATEGORIES = [
+    "summary",
+    "loudness_dynamics_analysis",
+    "spectral_analysis",
+    "stereo_analysis",
+    "strengths_and_improvements",
+    "suggestions",
+    "processing_recommendations"
+]
+
+# Section request -> report categories it returns, feature groups its prompt
+# carries (None = all) and its completion length limit
+REPORT_SECTIONS = {
+    "summary": {"categories": ["summary"], "groups": ["tempo", "loud", "trans", "spec", "stereo"], "max_tokens": 800},
+    "loudness": {"categories": ["loudness_dynamics_analysis"], "groups": ["tempo", "loud", "trans", "sections"], "max_tokens": 1200},
+    "spectral": {"categories": ["spectral_analysis"], "groups": ["spec", "sections"], "max_tokens": 1000},
+    "stereo": {"categories": ["stereo_analysis"], "groups": ["stereo", "sections"], "max_tokens": 1000},
+    "suggestions": {"categories": ["strengths_and_improvements", "suggestions"], "groups": None, "max_tokens": 1400},
+    "processing": {"categories": ["processing_recommendations"], "groups": None, "max_tokens": 1600},
+    "reference": {"categories": ["reference_comparison"], "groups": None, "max_tokens": 1600},
+}
+
+
+def generate_report(features: dict, features_reference: dict = None, prompt_format: str = LLM_PROMPT_FORMAT, comparison: dict = None, report_mode: str = LLM_REPORT_MODE):
     """
     Generates a comprehensive audio analysis report.
     
     Args:
         features: dict containing target track audio features
         features_reference: dict containing reference track features (optional)
+        prompt_format: "compact" (token-budgeted summary) or "full" (feature dicts as JSON)
+        comparison: numeric comparison of the two tracks (compare_tracks, optional)
+        report_mode: "sections" (concurrent per-section requests) or "single";
+            the full prompt format always runs as a single request
     
     Returns:
         dict: Parsed JSON response with analysis
     """
     start_time = time.time()
 
-    # Create the optimized prompt
-    prompt = create_audio_analysis_prompt(features, features_reference)
+    if report_mode == "sections" and prompt_format == "compact":
+        dict_response, prompt_info = _generate_by_section(features, features_reference, comparison)
+    else:
+        dict_response, prompt_info = _generate_single(features, features_reference, prompt_format, comparison)
+    
+    # Define expected categories for validation
+    required_categories = list(REQUIRED_CATEGORIES)
+    
+    # Add reference_comparison if reference was provided
+    if features_reference is not None:
+        required_categories.append("reference_comparison")
+
+    # Validate response structure
+    for cat in required_categories:
+        if cat not in dict_response:
+            dict_response[cat] = None
+            print(f"Warning: Missing category '{cat}' in response")
 
-    # Make API call
+    end_time = time.time() - start_time
+    
+    print(f"\n{'='*50}")
+    if features_reference is not None:
+        print(f"Reference Comparison: {'Included' if dict_response.get('reference_comparison') else 'Missing'}")
+    print(f"Prompt: {prompt_info}")
+    print(f"AI Analysis completed in: {end_time:.2f} seconds")
+    print(f"{'='*50}\n")
+
+    return dict_response
+
+
+def _complete(prompt: str, max_tokens: int):
     completion = client.chat.completions.create(
         model=MODEL,
         messages=[
             {
                 "role": "system",
-                "content": "You are a professional audio engineer and mastering specialist with extensive experience across multiple genres. You provide detailed, technical analysis with specific, actionable recommendations."
+                "content": SYSTEM_PROMPT
             },
             {
                 "role": "user",
@@ -44,42 +108,86 @@ def generate_report(features: dict, features_reference: dict = None):
         ],
         response_format={"type": "json_object"},
         temperature=0.7,
-        max_tokens=4000
+        max_tokens=max_tokens
     )
 
     raw_response = completion.choices[0].message.content
 
     # Parse response
     safe_response = jsonable_encoder(raw_response)
-    dict_response = json.loads(safe_response)
-    
-    # Define expected categories for validation
-    required_categories = [
-        "summary",
-        "loudness_dynamics_analysis",
-        "spectral_analysis",
-        "stereo_analysis",
-        "strengths_and_improvements",
-        "suggestions",
-        "processing_recommendations"
-    ]
-    
-    # Add reference_comparison if reference was provided
-    if features_reference is not None:
-        required_categories.append("reference_comparison")
+    return json.loads(safe_response), completion.usage
 
-    # Validate response structure
-    for cat in required_categories:
-        if cat not in dict_response:
-            dict_response[cat] = None
-            print(f"Warning: Missing category '{cat}' in response")
 
-    end_time = time.time() - start_time
-    
-    print(f"\n{'='*50}")
-    if features_reference is not None:
-        print(f"Reference Comparison: {'Included' if dict_response.get('reference_comparison') else 'Missing'}")
-    print(f"AI Analysis completed in: {end_time:.2f} seconds")
-    print(f"{'='*50}\n")
+def _generate_single(features: dict, features_reference: dict, prompt_format: str, comparison: dict):
+    # Create the optimized prompt, measured against the token budget before sending
+    prompt, prompt_stats = build_report_prompt(features, features_reference, prompt_format, comparison=comparison)
+    if not prompt_stats["within_budget"]:
+        print(f"Warning: prompt is {prompt_stats['tokens']} tokens, over the budget of {prompt_stats['budget']}")
+
+    dict_response, usage = _complete(prompt, 4000)
+    info = f"{prompt_stats['format']}, ~{prompt_stats['tokens']} tokens (detail level {prompt_stats['detail_level']}), {usage.prompt_tokens if usage else '?'} reported by the API"
+    return dict_response, info
+
+
+# --- PER-SECTION GENERATION ---
+
+_executor = None
+
+def get_llm_executor():
+    """
+    Process-wide thread pool for section requests (lazily opened).
+    Its size bounds the LLM requests in flight across all reports.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix="llm-section")
+    return _executor
+
+
+def _generate_section(name: str, section: dict, features: dict, features_reference: dict, comparison: dict):
+    """
+    One section request, retried on its own until it returns all its categories.
+
+    Returns:
+        ({category: content or None}, prompt tokens)
+    """
+    categories = section["categories"]
+    prompt, prompt_stats = create_compact_audio_analysis_prompt(
+        features, features_reference, comparison, LLM_PROMPT_TOKEN_BUDGET,
+        categories=categories, groups=section["groups"]
+    )
+
+    for attempt in range(1 + LLM_SECTION_RETRIES):
+        try:
+            response, _ = _complete(prompt, section["max_tokens"])
+            missing = [category for category in categories if not response.get(category)]
+            if missing:
+                raise ValueError(f"missing {', '.join(missing)}")
+            return {category: response[category] for category in categories}, prompt_stats["tokens"]
+        except Exception as e:
+            print(f"Report section '{name}' failed (attempt {attempt + 1}/{1 + LLM_SECTION_RETRIES}): {e}")
+            if attempt < LLM_SECTION_RETRIES:
+                time.sleep(LLM_RETRY_BACKOFF_S * 2 ** attempt)
+
+    return {category: None for category in categories}, prompt_stats["tokens"]
+
+
+def _generate_by_section(features: dict, features_reference: dict, comparison: dict):
+    sections = {name: section for name, section in REPORT_SECTIONS.items() if features_reference is not None or name != "reference"}
+    executor = get_llm_executor()
+    futures = {
+        name: executor.submit(_generate_section, name, section, features, features_reference, comparison)
+        for name, section in sections.items()
+    }
+
+    # Merge in report order
+    merged, tokens = {}, {}
+    for name, future in futures.items():
+        contents, tokens[name] = future.result()
+        merged.update(contents)
+    if not any(merged.values()):
+        raise RuntimeError("Every report section failed")
+    dict_response = {category: merged[category] for category in REQUIRED_CATEGORIES + ["reference_comparison"] if category in merged}
 
-    return dict_response
\ No newline at end of file
+    info = f"{len(sections)} section requests, ~{sum(tokens.values())} tokens in total ({', '.join(f'{name} {n}' for name, n in tokens.items())})"
+    return dict_response, info
@@ -1,35 +1,185 @@
 import json
+import os
 
-def create_audio_analysis_prompt(features: dict, features_reference: dict = None) -> str:
+from analysis.llm.compact_features import compact_features, dumps_compact, legend, DETAIL_LEVELS
+from analysis.llm.token_budget import count_tokens, LLM_PROMPT_TOKEN_BUDGET
+from analysis.reference.reference_comparison import condensed_comparison
+
+# compact: abbreviated, rounded feature summary within LLM_PROMPT_TOKEN_BUDGET
+# full: the feature dicts as indented JSON (the original prompt)
+LLM_PROMPT_FORMAT = os.getenv("LLM_PROMPT_FORMAT", "compact")
+
+# Machine-only outputs that mean nothing to the LLM and only cost tokens
+PROMPT_EXCLUDED_KEYS = {"embedding", "analysis_stats", "waveform", "octave_spectrum"}
+
+INTRO = "You are an expert audio engineer and mastering specialist. Analyze the provided audio data and deliver a comprehensive technical report."
+
+COMPARISON_NOTE = "COMPARISON REQUIRED: Compare the target track against the reference track. The reference represents the desired sonic standard."
+
+COMPUTED_COMPARISON_NOTE = "COMPUTED COMPARISON (exact values, mix minus reference: loudness and bands_db in dB, tilt_db_per_octave in dB per octave (negative = the mix is darker), stereo on the feature scales; eq_moves are [Hz, dB gain to apply to the mix]). Quote these numbers in the reference comparison instead of recomputing them:"
+
+DEGRADED_NOTE = """NOTE: Fields listed under "degraded" were computed on part of the track ("approximate") or not at all ("skipped") because the server was busy. Treat approximate values as indicative and do not comment on skipped ones."""
+
+
+def prompt_features(features: dict):
+    # An empty `degraded` map (full analysis) is left out
+    return {k: v for k, v in features.items() if k not in PROMPT_EXCLUDED_KEYS and not (k == "degraded" and not v)}
+
+
+def _comparison_block(comparison: dict):
+    return f"""
+{COMPUTED_COMPARISON_NOTE}
+{dumps_compact(condensed_comparison(comparison))}
+"""
+
+
+def create_audio_analysis_prompt(features: dict, features_reference: dict = None, comparison: dict = None) -> str:
     """
     Creates an optimized prompt for audio analysis with Groq LLM.
     
     Args:
         features: dict containing target track audio features
         features_reference: dict containing reference track features (optional)
+        comparison: numeric comparison of the two (compare_tracks, optional)
     
     Returns:
         str: Complete prompt for the LLM
     """
     
-    base_prompt = f"""You are an expert audio engineer and mastering specialist. Analyze the provided audio data and deliver a comprehensive technical report.
+    base_prompt = f"""{INTRO}
 
 TARGET TRACK DATA:
-{json.dumps(features, indent=2)}
+{json.dumps(prompt_features(features), indent=2)}
 """
 
     if features_reference is not None:
         base_prompt += f"""
 REFERENCE TRACK DATA:
-{json.dumps(features_reference, indent=2)}
+{json.dumps(prompt_features(features_reference), indent=2)}
 
-COMPARISON REQUIRED: Compare the target track against the reference track. The reference represents the desired sonic standard.
+{COMPARISON_NOTE}
 """
+        if comparison:
+            base_prompt += _comparison_block(comparison)
+
+    if features.get("degraded") or (features_reference or {}).get("degraded"):
+        base_prompt += f"""
+{DEGRADED_NOTE}
+"""
+
+    return base_prompt + report_instructions(features_reference is not None)
+
 
-    analysis_instructions = """
+def create_compact_audio_analysis_prompt(features: dict, features_reference: dict = None, comparison: dict = None, token_budget: int = LLM_PROMPT_TOKEN_BUDGET, categories: list = None, groups: list = None):
+    """
+    Creates the report prompt with compact feature summaries, at the highest
+    detail level that fits the token budget.
+
+    Args:
+        features: dict containing target track audio features
+        features_reference: dict containing reference track features (optional)
+        comparison: numeric comparison of the two (compare_tracks, optional)
+        token_budget: maximum prompt tokens
+        categories: only request these report categories (default: the whole report)
+        groups: only include these feature groups (default: all)
+
+    Returns:
+        (prompt, stats) where stats holds the token count, detail level and budget.
+        If even the core metrics exceed the budget, the level-0 prompt is returned
+        with within_budget False.
+    """
+    for level in DETAIL_LEVELS:
+        target = compact_features(features, level, groups)
+        reference = compact_features(features_reference, level, groups) if features_reference is not None else None
+
+        prompt = f"""{INTRO}
+
+DATA KEYS (compact JSON; missing keys were not measured):
+{legend(level, groups)}
+
+TARGET TRACK DATA:
+{dumps_compact(target)}
+"""
+        if reference is not None:
+            prompt += f"""
+REFERENCE TRACK DATA:
+{dumps_compact(reference)}
+
+{COMPARISON_NOTE}
+"""
+            if comparison:
+                prompt += _comparison_block(comparison)
+        if "degraded" in target or (reference or {}).get("degraded"):
+            prompt += f"""
+{DEGRADED_NOTE}
+"""
+        prompt += report_instructions(features_reference is not None, categories)
+
+        tokens = count_tokens(prompt)
+        if tokens <= token_budget:
+            break
+
+    return prompt, {
+        "format": "compact",
+        "tokens": tokens,
+        "detail_level": level,
+        "budget": token_budget,
+        "within_budget": tokens <= token_budget,
+    }
+
+
+def build_report_prompt(features: dict, features_reference: dict = None, prompt_format: str = LLM_PROMPT_FORMAT, token_budget: int = LLM_PROMPT_TOKEN_BUDGET, comparison: dict = None):
+    """
+    Report prompt in the configured format, with its token count.
+
+    Returns:
+        (prompt, stats)
+    """
+    if prompt_format == "full":
+        prompt = create_audio_analysis_prompt(features, features_reference, comparison)
+        tokens = count_tokens(prompt)
+        return prompt, {"format": "full", "tokens": tokens, "detail_level": None, "budget": token_budget, "within_budget": tokens <= token_budget}
+    if prompt_format != "compact":
+        raise ValueError(f"Unknown prompt format: {prompt_format}")
+    return create_compact_audio_analysis_prompt(features, features_reference, comparison, token_budget)
+
+
+def report_instructions(has_reference: bool, categories: list = None):
+    """
+    Analysis requirements and output format, shared by both prompt formats.
+
+    Args:
+        has_reference: whether the reference comparison is requested
+        categories: only request these report categories (default: the whole report)
+    """
+    if categories is None:
+        categories = [category for category in SECTION_FORMATS if has_reference or category != "reference_comparison"]
+
+    analysis_instructions = ANALYSIS_HEADER + "".join(text for category, text in SECTION_INSTRUCTIONS.items() if category in categories)
+
+    output_format = OUTPUT_HEADER
+    for category, text in SECTION_FORMATS.items():
+        if category in categories:
+            # The reference comparison follows the other categories after a comma
+            output_format += ("," if category == "reference_comparison" and category != categories[0] else "") + text
+    output_format += OUTPUT_FOOTER
+
+    return analysis_instructions + output_format
+
+
+# --- REPORT SECTIONS ---
+# Instruction and output-format text per report category. The single-call
+# prompt joins all of them; a per-section request (REPORT_SECTIONS and
+# _generate_section in audio_analysis_generator.py) uses the entries of its
+# own categories.
+
+ANALYSIS_HEADER = """
 ANALYSIS REQUIREMENTS:
 
-1. SUMMARY
+"""
+
+SECTION_INSTRUCTIONS = {
+    "summary": """1. SUMMARY
     Summarize the mix’s overall sound and character in a way that is clear and easy to understand for a non-technical listener.
     Take the genre into account and describe how the track feels, highlighting its main strengths and any areas that limit clarity, impact, or balance.   
         - The overview should:
@@ -44,7 +194,8 @@ ANALYSIS REQUIREMENTS:
           Describe differences neutrally
           Do not rank quality or give instructions
 
-2. LOUDNESS & DYNAMICS ANALYSIS
+""",
+    "loudness_dynamics_analysis": """2. LOUDNESS & DYNAMICS ANALYSIS
     Generate a clear, easy-to-understand explanation of how loud, dynamic, and controlled the track feels to a listener, using simple language and focusing on listening impact rather than technical metrics.
     Write for clients and artists, not audio engineers.
     Explain what the numbers mean for the listening experience.
@@ -58,7 +209,8 @@ ANALYSIS REQUIREMENTS:
         Example phrasing: “consistently loud”, “very controlled”,“little contrast between sections”, “punchy but tightly limited”
       - If a reference track is provided, compare the two at a high level, focusing on perceived loudness, punch, and openness
 
-3 . STEREO IMAGE ANALYSIS
+""",
+    "stereo_analysis": """3 . STEREO IMAGE ANALYSIS
    - Provide a general overview of the track's stereo image.
    - The overview should naturally mention: Overall stereo width (narrow, balanced, wide, very wide) without score, 
       mono compatibility and phase safety, 
@@ -70,7 +222,8 @@ ANALYSIS REQUIREMENTS:
    - If a reference track is provided, include a comparison summary, highlighting differences in width, side energy, and balance.
    - Include band-wise correlation (Sub, Bass, Low mids, Mids, High mids, Air) in a concise, readable way without mentioning numbers.
    
-4. SPECTRAL ANALYSIS
+""",
+    "spectral_analysis": """4. SPECTRAL ANALYSIS
    - Analyze frequency balance across all bands:
      * Sub Bass (20-60 Hz)
      * Bass (60-250 Hz)
@@ -84,18 +237,21 @@ ANALYSIS REQUIREMENTS:
    - Identify problematic frequencies, resonances, harshness, or muddy regions
    - Assess overall tonal balance (bright, dark, balanced, etc.)
 
-6. IDENTIFY STRENGTHS AND IMPROVEMENT
+""",
+    "strengths_and_improvements": """6. IDENTIFY STRENGTHS AND IMPROVEMENT
    - Describe the track's strengths in a clear and positive way, highlighting what makes it sound good or unique.
    - Explain areas that could be improved, using simple technical terms that a non-expert can understand.
    - Keep the tone friendly, encouraging, and constructive, avoiding overly complex jargon.
    - Provide suggestions in a way that a client can easily grasp, e.g., "the bass feels a bit congested, which could be balanced for more clarity," rather than detailed mixing instructions.
 
-7. PROVIDE ACTIONABLE SUGGESTIONS
+""",
+    "suggestions": """7. PROVIDE ACTIONABLE SUGGESTIONS
    - Give an overview of possible ways to improve the mix, explaining each suggestion in simple terms, including what the change aims to achieve (e.g., clarity, balance, punch, or warmth).
    - Provide a list of more technical suggestions for someone with audio knowledge, clearly linked to the improvement goal.
    - Prioritize the suggestions by importance or potential impact on the overall mix quality.
 
-8. PROCESSING RECOMMENDATIONS
+""",
+    "processing_recommendations": """8. PROCESSING RECOMMENDATIONS
    - Provide detailed, actionable technical instructions for improving the mix.
    - Include specifics for each processing stage:
      * EQ adjustments with specific frequencies, gain amounts, and Q values
@@ -106,10 +262,8 @@ ANALYSIS REQUIREMENTS:
    - Organize recommendations in the logical order they would typically be applied in a workflow.
    - Be precise with plugin settings, parameter values, and expected results.
    - Keep explanations clear enough for someone with intermediate audio knowledge to follow.
-"""
-
-    if features_reference is not None:
-        analysis_instructions += """
+""",
+    "reference_comparison": """
 9. REFERENCE COMPARISON (REQUIRED)
    - Compare loudness levels (LUFS difference, dynamic range)
    - Compare spectral balance (frequency by frequency)
@@ -118,18 +272,24 @@ ANALYSIS REQUIREMENTS:
    - Assess competitive positioning for the genre
    - Rate overall quality gap (1-10 scale, 10 = identical quality)
    - Provide specific recommendations to match reference sonic characteristics
-"""
+""",
+}
 
-    output_format = """
+OUTPUT_HEADER = """
 OUTPUT FORMAT:
 
 Return ONLY valid JSON with NO markdown formatting (no asterisks, no bold, no italic, no backticks, no code blocks).
 
 JSON structure:
 {
-  "summary": "string",
+"""
+
+# Output structure per category, in report order
+SECTION_FORMATS = {
+    "summary": """  "summary": "string",
 
-  "loudness_dynamics_analysis": {
+""",
+    "loudness_dynamics_analysis": """  "loudness_dynamics_analysis": {
     "overview": "string",
 
     "loudness_analysis": {
@@ -146,7 +306,8 @@ JSON structure:
     },
   }
 
-  "spectral_analysis": {
+""",
+    "spectral_analysis": """  "spectral_analysis": {
     "overview": "string",
     "energy_bands": {
       "Low_end": "Analysis and assessment",
@@ -158,7 +319,8 @@ JSON structure:
     }
   },
 
-  "stereo_analysis": {
+""",
+    "stereo_analysis": """  "stereo_analysis": {
     "overview": "",
 
     "correlation_per_band": {
@@ -171,12 +333,14 @@ JSON structure:
     },
   }
 
-  "strengths_and_improvements": {
+""",
+    "strengths_and_improvements": """  "strengths_and_improvements": {
     "strengths": "string",
     "improvements": "string"
   }
 
-  "suggestions": 
+""",
+    "suggestions": """  "suggestions": 
     "overview": "string"
     "suggestions_list: [
       "Actionable suggestion 1 with specific approach",
@@ -184,16 +348,15 @@ JSON structure:
       "Actionable suggestion 3 with specific approach"
     ],
 
-  "processing_recommendations": {
+""",
+    "processing_recommendations": """  "processing_recommendations": {
     "process_1": "string",
     "process_2": "string",
     "process_3": "string",
     "process_4": "string",
     "process_5": "string",  
-  }"""
-
-    if features_reference is not None:
-        output_format += """,
+  }""",
+    "reference_comparison": """
   "reference_comparison": {
     "loudness_difference": "LUFS and DR comparison with specific dB values",
     "spectral_differences": {
@@ -210,9 +373,10 @@ JSON structure:
       "Specific adjustment 2 to match reference",
       "Specific adjustment 3 to match reference"
     ]
-  }"""
+  }""",
+}
 
-    output_format += """
+OUTPUT_FOOTER = """
 }
 
 CRITICAL RULES:
@@ -223,5 +387,3 @@ CRITICAL RULES:
 - Consider genre conventions and commercial standards
 - Return ONLY the JSON object, nothing else
 """
-
-    return base_prompt + analysis_instructions + output_format
\ No newline at end of file
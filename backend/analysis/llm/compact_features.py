@@ -0,0 +1,187 @@
+import json
+import math
+
+from analysis.audio.octave_spectrum import tilt_db_per_octave, TILT_MIN_HZ, TILT_MAX_HZ, TILT_VALID_FLOOR_DB
+
+
+"""
+
+Compact feature summary for the report prompt
+
+Instead of the full feature dicts (full-precision floats, every diagnostic),
+the prompt gets one small JSON object per track with abbreviated keys,
+values rounded to what a written report can use (0.1 dB, whole percent), and
+only the metrics a report section reads:
+
+    tempo       summary                         bpm, beat timing
+    loud        summary, loudness & dynamics    LUFS, peaks, dynamics, level over time
+    trans       loudness & dynamics             transient rate, percussive energy
+    spec        summary, spectral               band energy shares, tilt (dB/octave)
+    stereo      summary, stereo                 width, correlation, balance, width per band
+    sections    summary, loudness & dynamics    per-section level (and, at full detail, balance)
+
+Every metric has a detail level. At level 2 everything above is included; a
+token budget is met by falling back to level 1 (no per-section balance, peak
+or width statistics) and then level 0 (core numbers only). legend() explains the
+abbreviations once per prompt, shared by the target and reference tracks.
+
+"""
+
+DETAIL_LEVELS = [2, 1, 0]
+BAND_NAMES = ["Sub", "Bass", "Low_mids", "Mids", "High_mids", "Air"]
+
+
+def _rounded(digits=1, factor=1.0):
+    # Whole numbers come out as ints ("117", not "117.0"); + 0.0 turns -0.0 into 0.0
+    return lambda v: round(float(v) * factor, digits) + 0.0 if digits else round(float(v) * factor)
+
+
+def _rms_to_db(values):
+    return [round(20 * math.log10(max(float(v), 1e-10)), 1) + 0.0 for v in values]
+
+
+def _band_shares(bands):
+    return {band: round(float(share) * 100, 1) for band, share in bands.items()}
+
+
+def _octave_tilt(curve):
+    # The analysis' spectral_tilt is a raw magnitude slope with no unit; this one is dB/octave
+    valid = [(center, db) for center, db in zip(curve["center_hz"], curve["mean_db"]) if db > TILT_VALID_FLOOR_DB]
+    tilt = tilt_db_per_octave(*zip(*valid)) if valid else None
+    if tilt is None:
+        raise ValueError("Too few bands for a tilt")
+    return round(tilt, 1) + 0.0
+
+
+def _band_values(bands):
+    return {band: round(float(value), 2) for band, value in bands.items()}
+
+
+# group -> [(key, source field, source key, transform, detail level, legend)]
+METRICS = {
+    "tempo": [
+        ("bpm", "tempo_features", "tempo_bpm", _rounded(0), 0, "tempo (BPM)"),
+        ("beat_sd_ms", "tempo_features", "tempo_std_s", _rounded(0, 1000), 1, "beat interval deviation (ms)"),
+    ],
+    "loud": [
+        ("lufs", "loudness_features", "loudness_lufs", _rounded(), 0, "integrated loudness (LUFS)"),
+        ("tp", "loudness_features", "true_peak_db", _rounded(), 0, "true peak (dBTP)"),
+        ("dr", "loudness_features", "dynamic_range_db", _rounded(), 0, "dynamic range (dB)"),
+        ("crest", "loudness_features", "crest_factor_db", _rounded(), 0, "crest factor (dB)"),
+        ("rms", "loudness_features", "rms_db", _rounded(), 1, "RMS level (dBFS)"),
+        ("pk", "loudness_features", "peak_db", _rounded(), 2, "sample peak (dBFS)"),
+        ("rms_30s", "loudness_features", "loudness_evolution", _rms_to_db, 1, "RMS per 30 s block (dBFS)"),
+    ],
+    "trans": [
+        ("rate", "transient_features", "transient_density", _rounded(), 0, "transients per second"),
+        ("perc_pct", "transient_features", "percussion_energy_pct", _rounded(0), 0, "percussive share of energy (%)"),
+    ],
+    "spec": [
+        ("bands_pct", "frequency_spectrum_energy", "energy_bands", _band_shares, 0, "energy share per band (%)"),
+        ("tilt", "octave_spectrum", "third_octave", _octave_tilt, 0, f"spectral tilt (dB/octave, {TILT_MIN_HZ:.0f} Hz-{TILT_MAX_HZ / 1000:.0f} kHz; negative = darker)"),
+    ],
+    "stereo": [
+        ("width", "stereo_image_features", "stereo_width_label", str, 0, "stereo width"),
+        ("corr", "stereo_image_features", "correlation", _rounded(2), 0, "L/R correlation (-1..1)"),
+        ("side_pct", "stereo_image_features", "ms_side_fraction", _rounded(0, 100), 0, "side energy share (%)"),
+        ("lr_bal", "stereo_image_features", "lr_balance", _rounded(2), 0, "L/R balance (-1 left..1 right)"),
+        ("band_width", "stereo_image_features", "band_widths", _band_values, 1, "width per band (0 mono..1 wide)"),
+        ("width_sd", "stereo_image_features", "std_frame_width", _rounded(3), 2, "width variation over time"),
+    ],
+}
+
+# Per-section columns: (key, section key, transform, detail level, legend)
+SECTION_COLUMNS = [
+    ("start_s", "start_s", _rounded(0), 1, "section start (s)"),
+    ("rel_db", "relative_loudness_db", _rounded(), 1, "level against the track (dB)"),
+    ("side_pct", "side_fraction", _rounded(0, 100), 2, None),
+    ("onset", "onset_strength", _rounded(2), 2, "onset strength (relative)"),
+] + [(f"{band}_pct", band, _rounded(0, 100), 2, None) for band in BAND_NAMES]
+
+# Feature field -> group, for the "degraded" map
+FIELD_GROUPS = {field: group for group, metrics in METRICS.items() for _, field, *_ in metrics}
+FIELD_GROUPS["section_features"] = "sections"
+
+
+def compact_features(features: dict, level: int = 2, groups: list = None):
+    """
+    Compact summary of one track's features.
+
+    Args:
+        features: feature dict as returned by the analysis (or a reference target profile)
+        level: detail level, 2 (full) to 0 (core metrics only)
+        groups: only these groups (METRICS keys and "sections"; default all)
+
+    Returns:
+        Nested dict of rounded values under abbreviated keys; metrics that are
+        missing, failed or skipped are left out
+    """
+    summary = {}
+    if features.get("note"):
+        summary["note"] = features["note"]
+
+    for group, metrics in METRICS.items():
+        if groups is not None and group not in groups:
+            continue
+        values = {}
+        for key, field, source_key, transform, metric_level, _ in metrics:
+            value = (features.get(field) or {}).get(source_key)
+            if metric_level > level or value is None:
+                continue
+            try:
+                values[key] = transform(value)
+            except (TypeError, ValueError):
+                continue
+        if values:
+            summary[group] = values
+
+    sections = (features.get("section_features") or {}).get("sections")
+    if sections and (groups is None or "sections" in groups):
+        if level == 0:
+            summary["sections"] = {"count": len(sections)}
+        else:
+            columns = [column for column in SECTION_COLUMNS if column[3] <= level]
+            summary["sections"] = {
+                "cols": [key for key, *_ in columns],
+                "rows": [[_section_value(section, source_key, transform) for _, source_key, transform, _, _ in columns] for section in sections],
+            }
+
+    degraded = {
+        FIELD_GROUPS[field]: info.get("mode") for field, info in (features.get("degraded") or {}).items()
+        if field in FIELD_GROUPS and (groups is None or FIELD_GROUPS[field] in groups)
+    }
+    if degraded:
+        summary["degraded"] = degraded
+
+    return summary
+
+
+def _section_value(section, source_key, transform):
+    value = section.get(source_key, (section.get("energy_bands") or {}).get(source_key))
+    return None if value is None else transform(value)
+
+
+def legend(level: int = 2, groups: list = None):
+    """
+    One line per group explaining the abbreviated keys used at a detail level.
+    """
+    lines = []
+    for group, metrics in METRICS.items():
+        if groups is not None and group not in groups:
+            continue
+        entries = [f"{key}={text}" for key, _, _, _, metric_level, text in metrics if metric_level <= level]
+        lines.append(f"{group}: " + "; ".join(entries))
+    if groups is None or "sections" in groups:
+        if level == 0:
+            lines.append("sections: count=number of detected sections")
+        else:
+            entries = [f"{key}={text}" for key, _, _, column_level, text in SECTION_COLUMNS if column_level <= level and text]
+            if level >= 2:
+                entries.append("side_pct=side energy share (%); <band>_pct=energy share per band (%)")
+            lines.append("sections (cols/rows table): " + "; ".join(entries))
+    lines.append(f"bands: {', '.join(BAND_NAMES)}")
+    return "\n".join(lines)
+
+
+def dumps_compact(summary: dict):
+    return json.dumps(summary, separators=(",", ":"), ensure_ascii=False)
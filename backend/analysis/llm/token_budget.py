@@ -0,0 +1,51 @@
+import math
+import os
+import re
+
+
+"""
+
+Prompt token counting
+
+With tiktoken installed (optional extra "tokens") prompts are counted with the
+o200k_base encoding, the vocabulary of the gpt-oss models. Without it a
+heuristic count is used: one token per punctuation character, per group of up
+to three digits and per word, plus one for every 6 letters a word runs past 8.
+BPE vocabularies merge common punctuation runs (`":`, `},{`), so on JSON the
+heuristic tends to count high, which is the safe side for a budget.
+
+"""
+
+LLM_PROMPT_TOKEN_BUDGET = int(os.getenv("LLM_PROMPT_TOKEN_BUDGET", "4000"))
+
+_PIECES = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    # Not installed, or the vocabulary cannot be downloaded: fall back to the heuristic
+    _encoding = None
+
+
+def count_tokens(text: str):
+    """
+    Number of tokens the LLM will see for a text.
+
+    Args:
+        text: prompt text
+
+    Returns:
+        Token count (exact with tiktoken, approximate without)
+    """
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+
+    tokens = 0
+    for piece in _PIECES.findall(text):
+        tokens += 1 + (math.ceil((len(piece) - 8) / 6) if piece[0].isalpha() and len(piece) > 8 else 0)
+    return tokens
+
+
+def token_counter_name():
+    return "tiktoken o200k_base" if _encoding is not None else "heuristic"
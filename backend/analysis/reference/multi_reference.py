@@ -0,0 +1,108 @@
+import warnings
+
+import numpy as np
+
+from analysis.reference.reference_library import (
+    feature_vector,
+    _column_weights,
+    FEATURE_VECTOR_COLUMNS,
+    BAND_NAMES
+)
+
+
+"""
+
+One mix against many references
+
+All references are flattened into the reference library's feature vector
+(band energies in dB, loudness, dynamics, width) and stacked into one
+(references x columns) matrix, so every comparison is a single array
+operation:
+
+    deltas              mix minus each reference, per column
+    target_profile      per-column median over the references (robust to one odd reference)
+    target_spread       per-column spread over the references (half the 10-90 % range)
+    main_vs_target      mix minus the target profile
+    distances           weighted, standardized distance from the mix to each reference
+
+Missing values (stages that failed or were skipped) stay NaN in the matrix and
+come out as None.
+
+"""
+
+COLUMNS = [name for name, _ in FEATURE_VECTOR_COLUMNS]
+
+
+def _rounded(values, digits: int = 2):
+    return [None if not np.isfinite(v) else round(float(v), digits) for v in values]
+
+
+def compare_references(features: dict, references: list, group_weights: dict = None):
+    """
+    Compare a mix against N references at once.
+
+    Args:
+        features: feature dict of the mix
+        references: list of {"id", "name", "features"}
+        group_weights: optional {"tonal", "loudness", "width"} distance weights
+
+    Returns:
+        Dictionary with the columns, per-reference deltas and distances, and the aggregate target profile
+    """
+    main = feature_vector(features)
+    matrix = np.stack([feature_vector(ref["features"]) for ref in references])
+
+    deltas = main[None, :] - matrix
+
+    with warnings.catch_warnings():
+        # A column missing in every reference (stage skipped everywhere) is expected
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        target = np.nanmedian(matrix, axis=0)
+        low, high = np.nanpercentile(matrix, [10, 90], axis=0)
+        spread = (high - low) / 2
+
+        # Distance in units of the spread the references themselves show (at least 1 dB / 0.05)
+        scale = np.fmax(np.nan_to_num(spread), np.array([0.05 if group == "width" else 1.0 for _, group in FEATURE_VECTOR_COLUMNS]))
+        weights = _column_weights(group_weights)
+        distances = np.sqrt(np.nansum((deltas / scale) ** 2 * weights, axis=1))
+
+    return {
+        "columns": COLUMNS,
+        "references": [
+            {"id": ref["id"], "name": ref["name"], "source": ref.get("source"), "distance": round(float(d), 3)}
+            for ref, d in zip(references, distances)
+        ],
+        "deltas": [_rounded(row) for row in deltas],
+        "target_profile": dict(zip(COLUMNS, _rounded(target))),
+        "target_spread": dict(zip(COLUMNS, _rounded(spread))),
+        "main_vs_target": dict(zip(COLUMNS, _rounded(main - target))),
+        "closest_reference": references[int(np.argmin(distances))]["id"],
+    }
+
+
+def target_profile_features(target_profile: dict, references: list):
+    """
+    Turn a target profile back into the feature-dict shape the report prompt
+    expects, so the LLM can compare the mix against "the references" as one track.
+    The median 1/3-octave curve is added when every reference has one on the same bands.
+    """
+    def value(column):
+        return target_profile.get(column)
+
+    bands_db = {band: value(f"band_{band}_db") for band in BAND_NAMES}
+    linear = {band: 10 ** (db / 10) for band, db in bands_db.items() if db is not None}
+    total = sum(linear.values()) or 1.0
+
+    features = {
+        "note": f"Target profile: median of {len(references)} reference tracks",
+        "loudness_features": {key: value(key) for key in ("loudness_lufs", "true_peak_db", "crest_factor_db", "dynamic_range_db")},
+        "frequency_spectrum_energy": {"energy_bands": {band: energy / total for band, energy in linear.items()}},
+        "stereo_image_features": {key: value(key) for key in ("stereo_width_score", "ms_side_fraction", "correlation")},
+    }
+
+    curves = [(ref["features"].get("octave_spectrum") or {}).get("third_octave") for ref in references]
+    if all(curves) and all(curve["center_hz"] == curves[0]["center_hz"] for curve in curves):
+        mean_db = np.median(np.array([curve["mean_db"] for curve in curves], dtype=np.float64), axis=0)
+        features["octave_spectrum"] = {"third_octave": {"center_hz": curves[0]["center_hz"], "mean_db": np.round(mean_db, 1).tolist()}}
+
+    return features
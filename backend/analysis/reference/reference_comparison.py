@@ -0,0 +1,202 @@
+import numpy as np
+
+from analysis.audio.octave_spectrum import tilt_db_per_octave
+
+
+"""
+
+Numeric comparison of a mix against its reference
+
+Every number the report's reference comparison needs, computed directly
+instead of left to the LLM. Deltas are mix minus reference (positive = the mix
+has more), like the multi-reference matrix:
+
+    loudness        LUFS, true peak, sample peak, RMS, crest factor and dynamic range differences
+    bands_db        per-band energy ratio in dB, from the band energy shares
+                    (level-independent: +2 dB in Bass = the mix has relatively more bass)
+    tilt_db_per_octave
+                    slope of the 1/3-octave balance difference against log2 frequency
+                    over TILT_MIN_HZ-TILT_MAX_HZ (negative = the mix is darker)
+    eq_match        gain per 1/3-octave band that moves the mix's average spectrum
+                    onto the reference's, smoothed over frequency, plus its largest
+                    peaks and dips as EQ moves
+    stereo          width, side energy, correlation and balance differences, width per band
+
+Groups whose features are missing on either side are left out.
+
+"""
+
+EQ_SMOOTHING_OCTAVES = 1 / 3 # standard deviation of the Gaussian smoothing over log frequency
+EQ_MAX_GAIN_DB = 12.0
+EQ_MIN_MOVE_DB = 1.0
+EQ_MAX_MOVES = 5
+EQ_VALID_FLOOR_DB = -90.0 # bands this far below the mean power are noise, not balance
+
+LOUDNESS_KEYS = {
+    "lufs": "loudness_lufs",
+    "true_peak_db": "true_peak_db",
+    "peak_db": "peak_db",
+    "rms_db": "rms_db",
+    "crest_db": "crest_factor_db",
+    "dynamic_range_db": "dynamic_range_db",
+}
+
+STEREO_KEYS = {
+    "width_score": "stereo_width_score",
+    "side_fraction": "ms_side_fraction",
+    "correlation": "correlation",
+    "lr_balance": "lr_balance",
+}
+
+
+def _delta(a, b, digits: int = 2):
+    if a is None or b is None:
+        return None
+    return round(float(a) - float(b), digits) + 0.0
+
+
+def _deltas(main: dict, ref: dict, keys: dict, digits: int):
+    deltas = {name: _delta(main.get(key), ref.get(key), digits) for name, key in keys.items()}
+    return {name: value for name, value in deltas.items() if value is not None}
+
+
+def band_ratios_db(main_bands: dict, ref_bands: dict):
+    """
+    Per-band energy ratio in dB (mix over reference) of two band-share dicts.
+    """
+    ratios = {}
+    for band, share in main_bands.items():
+        ref_share = ref_bands.get(band)
+        if share is None or ref_share is None:
+            continue
+        ratios[band] = round(10 * np.log10((float(share) + 1e-12) / (float(ref_share) + 1e-12)), 1) + 0.0
+    return ratios
+
+
+def eq_match_curve(main_octave: dict, ref_octave: dict):
+    """
+    Smoothed gain curve that matches the mix's average 1/3-octave spectrum to the reference.
+
+    Args:
+        main_octave, ref_octave: "third_octave" entries of get_octave_spectrum
+            (dB relative to each track's mean power, so the curves are level-matched)
+
+    Returns:
+        Dictionary with center_hz, gain_db (None where either track has no
+        energy) and the largest peaks / dips of the curve as EQ moves
+    """
+    centers = np.asarray(main_octave["center_hz"], dtype=np.float64)
+    if not np.array_equal(centers, np.asarray(ref_octave["center_hz"], dtype=np.float64)):
+        raise ValueError("Octave spectra use different bands")
+
+    main_db = np.asarray(main_octave["mean_db"], dtype=np.float64)
+    ref_db = np.asarray(ref_octave["mean_db"], dtype=np.float64)
+    valid = (main_db > EQ_VALID_FLOOR_DB) & (ref_db > EQ_VALID_FLOOR_DB)
+    if not valid.any():
+        raise ValueError("No bands with energy in both tracks")
+
+    # Gaussian smoothing over log frequency, normalized over the valid bands only
+    octaves = np.log2(centers)
+    kernel = np.exp(-0.5 * ((octaves[:, None] - octaves[None, :]) / EQ_SMOOTHING_OCTAVES) ** 2) * valid[None, :]
+    raw = np.where(valid, ref_db - main_db, 0.0)
+    gain = np.clip(kernel @ raw / np.maximum(kernel.sum(axis=1), 1e-12), -EQ_MAX_GAIN_DB, EQ_MAX_GAIN_DB)
+
+    # Local extrema of the smoothed curve, largest first
+    moves = []
+    for i in np.flatnonzero(valid):
+        left = gain[i - 1] if i > 0 and valid[i - 1] else None
+        right = gain[i + 1] if i + 1 < len(gain) and valid[i + 1] else None
+        neighbours = [g for g in (left, right) if g is not None]
+        is_peak = all(gain[i] >= g for g in neighbours) and gain[i] > 0
+        is_dip = all(gain[i] <= g for g in neighbours) and gain[i] < 0
+        if (is_peak or is_dip) and abs(gain[i]) >= EQ_MIN_MOVE_DB:
+            moves.append({"freq_hz": round(float(centers[i])), "gain_db": round(float(gain[i]), 1)})
+    moves.sort(key=lambda move: -abs(move["gain_db"]))
+
+    return {
+        "center_hz": [round(float(f), 1) for f in centers],
+        "gain_db": [round(float(g), 1) + 0.0 if v else None for g, v in zip(gain, valid)],
+        "moves": moves[:EQ_MAX_MOVES],
+        "smoothing_octaves": round(EQ_SMOOTHING_OCTAVES, 3),
+    }
+
+
+def tilt_delta_db_per_octave(main_octave: dict, ref_octave: dict):
+    """
+    Difference in spectral tilt between two 1/3-octave spectra, in dB per octave.
+
+    Least-squares slope of (mix - reference) mean_db against log2 of the band
+    centre (tilt_db_per_octave, over its fixed range) for the bands where both
+    tracks have energy. Bands are matched by centre frequency, so spectra at different
+    sample rates compare over the bands they share.
+
+    Returns:
+        Slope in dB/octave (negative = the mix is darker), or None with too few
+        shared bands
+    """
+    ref_db = dict(zip(ref_octave["center_hz"], ref_octave["mean_db"]))
+    shared = [
+        (center, main - ref_db[center])
+        for center, main in zip(main_octave["center_hz"], main_octave["mean_db"])
+        if center in ref_db and main > EQ_VALID_FLOOR_DB and ref_db[center] > EQ_VALID_FLOOR_DB
+    ]
+    return tilt_db_per_octave(*zip(*shared)) if shared else None
+
+
+def compare_tracks(features: dict, reference: dict):
+    """
+    Numeric deltas between a mix and one reference (or a reference target profile).
+
+    Args:
+        features: feature dict of the mix
+        reference: feature dict of the reference
+
+    Returns:
+        Dictionary with the loudness, bands_db, tilt_db_per_octave, eq_match and
+        stereo groups that both feature dicts allow
+    """
+    comparison = {"sign": "mix minus reference; eq_match gain_db is what to apply to the mix"}
+
+    loudness = _deltas(features.get("loudness_features") or {}, reference.get("loudness_features") or {}, LOUDNESS_KEYS, 1)
+    if loudness:
+        comparison["loudness"] = loudness
+
+    main_spectrum = features.get("frequency_spectrum_energy") or {}
+    ref_spectrum = reference.get("frequency_spectrum_energy") or {}
+    bands = band_ratios_db(main_spectrum.get("energy_bands") or {}, ref_spectrum.get("energy_bands") or {})
+    if bands:
+        comparison["bands_db"] = bands
+
+    main_octave = (features.get("octave_spectrum") or {}).get("third_octave")
+    ref_octave = (reference.get("octave_spectrum") or {}).get("third_octave")
+    if main_octave and ref_octave:
+        tilt = tilt_delta_db_per_octave(main_octave, ref_octave)
+        if tilt is not None:
+            comparison["tilt_db_per_octave"] = tilt
+        try:
+            comparison["eq_match"] = eq_match_curve(main_octave, ref_octave)
+        except ValueError as e:
+            print(f"Skipping EQ match curve: {e}")
+
+    main_stereo = features.get("stereo_image_features") or {}
+    ref_stereo = reference.get("stereo_image_features") or {}
+    stereo = _deltas(main_stereo, ref_stereo, STEREO_KEYS, 2)
+    band_widths = _deltas(main_stereo.get("band_widths") or {}, ref_stereo.get("band_widths") or {}, {band: band for band in (main_stereo.get("band_widths") or {})}, 2)
+    if band_widths:
+        stereo["band_widths"] = band_widths
+    if main_stereo.get("stereo_width_label") and ref_stereo.get("stereo_width_label"):
+        stereo["width_labels"] = [main_stereo["stereo_width_label"], ref_stereo["stereo_width_label"]]
+    if stereo:
+        comparison["stereo"] = stereo
+
+    return comparison
+
+
+def condensed_comparison(comparison: dict):
+    """
+    The comparison without the full EQ curve (only its moves), for the report prompt.
+    """
+    condensed = {key: value for key, value in comparison.items() if key not in ("sign", "eq_match")}
+    if "eq_match" in comparison:
+        condensed["eq_moves"] = [[move["freq_hz"], move["gain_db"]] for move in comparison["eq_match"]["moves"]]
+    return condensed
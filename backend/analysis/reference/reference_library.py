@@ -0,0 +1,321 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+
+from analysis.audio.audio_embeddings import EmbeddingIndex, EMBEDDING_SIZE, EMBEDDING_VERSION
+from analysis.utils.helper import to_python, DATA_DIR
+
+
+"""
+
+Server-side reference library
+
+Reference tracks are analyzed once at ingest time. Their feature dicts are
+stored as JSON and a compact numeric feature vector (tonal balance, loudness,
+width) is kept in a single matrix, so finding the closest references to a mix
+is one vectorized distance computation and comparing against a library
+reference costs no analysis at all.
+
+Every uvicorn worker holds its own copy of the index and reloads it when
+index.npz changes on disk, so references ingested by another worker or by
+pipeline/ingest_references.py show up without a restart. Writers take an
+exclusive flock on index.lock and reload the index under it before adding
+their entry, so concurrent ingests from several processes all end up in it.
+
+"""
+
+REFERENCE_LIBRARY_DIR = os.getenv("REFERENCE_LIBRARY_DIR", os.path.join(DATA_DIR, "reference_library"))
+
+BAND_NAMES = ["Sub", "Bass", "Low_mids", "Mids", "High_mids", "Air"]
+
+# Columns of the feature vector and the group each one belongs to
+FEATURE_VECTOR_COLUMNS = (
+    [(f"band_{band}_db", "tonal") for band in BAND_NAMES] +
+    [
+        ("loudness_lufs", "loudness"),
+        ("true_peak_db", "loudness"),
+        ("crest_factor_db", "loudness"),
+        ("dynamic_range_db", "loudness"),
+        ("stereo_width_score", "width"),
+        ("ms_side_fraction", "width"),
+        ("correlation", "width"),
+    ]
+)
+
+# Default weight of each group in the distance
+DEFAULT_GROUP_WEIGHTS = {"tonal": 1.0, "loudness": 1.0, "width": 1.0}
+
+
+def feature_vector(features: dict):
+    """
+    Flatten a feature dict into the fixed-order numeric vector used for matching.
+    Missing values (failed stages) become NaN.
+
+    Args:
+        features: output of analyze_uploaded_track_complete
+
+    Returns:
+        float32 array of len(FEATURE_VECTOR_COLUMNS)
+    """
+    loudness = features.get("loudness_features") or {}
+    spectrum = (features.get("frequency_spectrum_energy") or {}).get("energy_bands") or {}
+    stereo = features.get("stereo_image_features") or {}
+
+    values = [
+        10 * np.log10(spectrum[band] + 1e-12) if band in spectrum else np.nan
+        for band in BAND_NAMES
+    ]
+    values += [loudness.get(key, np.nan) for key in ("loudness_lufs", "true_peak_db", "crest_factor_db", "dynamic_range_db")]
+    values += [stereo.get(key, np.nan) for key in ("stereo_width_score", "ms_side_fraction", "correlation")]
+
+    vector = np.array([np.nan if v is None else v for v in values], dtype=np.float32)
+    vector[~np.isfinite(vector)] = np.nan # e.g. -inf LUFS for digital silence
+    return vector
+
+
+def _column_weights(group_weights: dict):
+    """
+    Spread each group's weight over its columns, so the six bands together count
+    as much as the four loudness columns.
+    """
+    group_weights = {**DEFAULT_GROUP_WEIGHTS, **(group_weights or {})}
+    groups = [group for _, group in FEATURE_VECTOR_COLUMNS]
+    return np.array([group_weights[g] / groups.count(g) for g in groups], dtype=np.float32)
+
+
+class ReferenceLibrary:
+    """
+    On-disk reference library.
+
+    Layout:
+        <path>/features/<id>.json   name, metadata and the full feature dict
+        <path>/index.npz            ids, the (n_refs, n_columns) feature matrix
+                                    and the (n_refs, EMBEDDING_SIZE) embedding matrix
+        <path>/index.lock           held (flock) by the process writing the index
+    """
+
+    def __init__(self, path: str = REFERENCE_LIBRARY_DIR):
+        self.path = path
+        self.features_dir = os.path.join(path, "features")
+        self.index_path = os.path.join(path, "index.npz")
+        self.lock_path = os.path.join(path, "index.lock")
+        os.makedirs(self.features_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._ids = []
+        self._matrix = np.zeros((0, len(FEATURE_VECTOR_COLUMNS)), dtype=np.float32)
+        self._embeddings = EmbeddingIndex()
+        self._index_version = None
+        self._load_index()
+
+
+    # --- STORAGE ---
+
+    def _index_stat(self):
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        # os.replace gives every saved index a new inode, even within one mtime tick
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def _refresh(self):
+        """
+        Reload the index if another process replaced it since it was loaded (one stat call).
+        """
+        if self._index_stat() != self._index_version:
+            with self._lock:
+                if self._index_stat() != self._index_version:
+                    self._load_index()
+
+    def _load_index(self):
+        self._index_version = self._index_stat()
+        if self._index_version is None:
+            return
+        with np.load(self.index_path) as index:
+            self._ids = [str(i) for i in index["ids"]]
+            self._matrix = index["matrix"].astype(np.float32)
+            # Embeddings from an older recipe are not comparable; they are rebuilt on re-ingest
+            if "embeddings" in index and int(index["embedding_version"]) == EMBEDDING_VERSION:
+                self._embeddings = EmbeddingIndex(self._ids, index["embeddings"])
+            else:
+                self._embeddings = EmbeddingIndex(self._ids, np.zeros((len(self._ids), EMBEDDING_SIZE), dtype=np.float32))
+
+    @contextmanager
+    def _write_lock(self):
+        """
+        Exclusive across the threads of this process (threading.Lock) and across processes (flock).
+        """
+        with self._lock, open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save_index(self):
+        # A name of its own, so no other writer can touch the file before it is renamed
+        tmp_path = f"{self.index_path}.{os.getpid()}.{uuid.uuid4().hex}.tmp.npz"
+        np.savez(
+            tmp_path,
+            ids=np.array(self._ids),
+            matrix=self._matrix,
+            embeddings=self._embeddings.matrix,
+            embedding_version=EMBEDDING_VERSION
+        )
+        os.replace(tmp_path, self.index_path) # atomic, readers never see a partial index
+        self._index_version = self._index_stat()
+
+    def _entry_path(self, ref_id: str):
+        return os.path.join(self.features_dir, f"{ref_id}.json")
+
+    @staticmethod
+    def make_id(audio_bytes: bytes):
+        """
+        Content-addressed id: re-ingesting the same file is a no-op.
+        """
+        return hashlib.sha256(audio_bytes).hexdigest()[:16]
+
+
+    # --- PUBLIC API ---
+
+    def __contains__(self, ref_id: str):
+        self._refresh()
+        return ref_id in self._ids
+
+    def __len__(self):
+        self._refresh()
+        return len(self._ids)
+
+    def add(self, ref_id: str, name: str, features: dict, metadata: dict = None):
+        """
+        Store a reference's features and add its vector to the index.
+
+        Returns:
+            The stored entry
+        """
+        entry = {
+            "id": ref_id,
+            "name": name,
+            "metadata": metadata or {},
+            "created_at": time.time(),
+            "features": to_python(features),
+        }
+        vector = feature_vector(features)
+        embedding = features.get("embedding")
+        embedding = np.asarray(embedding, dtype=np.float32) if embedding is not None else np.zeros(EMBEDDING_SIZE, dtype=np.float32)
+
+        with self._write_lock():
+            # Start from the latest index on disk, so references added elsewhere are kept
+            if self._index_stat() != self._index_version:
+                self._load_index()
+            with open(self._entry_path(ref_id), "w") as f:
+                json.dump(entry, f)
+
+            if ref_id in self._ids:
+                self._matrix[self._ids.index(ref_id)] = vector
+            else:
+                self._ids.append(ref_id)
+                self._matrix = np.vstack([self._matrix, vector[None, :]])
+            self._embeddings.upsert(ref_id, embedding)
+            self._save_index()
+
+        return entry
+
+    def get(self, ref_id: str):
+        """
+        Returns:
+            The stored entry, or None if the id is unknown
+        """
+        if ref_id not in self:
+            return None
+        with open(self._entry_path(ref_id)) as f:
+            return json.load(f)
+
+    def list(self):
+        self._refresh()
+        entries = [self.get(ref_id) for ref_id in self._ids]
+        return [
+            {"id": e["id"], "name": e["name"], "metadata": e["metadata"], "created_at": e["created_at"]}
+            for e in entries if e is not None
+        ]
+
+    def nearest(self, features: dict, k: int = 5, group_weights: dict = None):
+        """
+        Top-k closest references to a mix by weighted, standardized Euclidean distance.
+
+        Columns are z-scored over the library so dB, LUFS and 0..1 width values
+        are comparable; brute force over the matrix is a few microseconds per
+        thousand references.
+
+        Args:
+            features: feature dict of the mix
+            k: number of references to return
+            group_weights: optional {"tonal", "loudness", "width"} weights
+
+        Returns:
+            List of {"id", "name", "distance"} sorted by distance
+        """
+        self._refresh()
+        if not self._ids:
+            return []
+
+        ids = self._ids
+        matrix = self._matrix
+        query = feature_vector(features)
+
+        # Standardize; missing values sit at the column mean (contribute zero distance)
+        mean = np.nanmean(matrix, axis=0)
+        std = np.nanstd(matrix, axis=0)
+        std[~np.isfinite(std) | (std < 1e-6)] = 1.0
+        mean = np.nan_to_num(mean)
+        z_matrix = np.nan_to_num((matrix - mean) / std)
+        z_query = np.nan_to_num((query - mean) / std)
+
+        weights = _column_weights(group_weights)
+        distances = np.sqrt(((z_matrix - z_query) ** 2 * weights).sum(axis=1))
+
+        k = min(k, len(ids))
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+
+        results = []
+        for i in top:
+            entry = self.get(ids[i])
+            results.append({"id": ids[i], "name": entry["name"] if entry else None, "distance": float(distances[i])})
+        return results
+
+    def similar(self, embedding, k: int = 5):
+        """
+        Top-k references by embedding cosine similarity (sound-alike search).
+
+        Returns:
+            List of {"id", "name", "similarity"} sorted by similarity
+        """
+        if embedding is None:
+            return []
+        self._refresh()
+        results = []
+        for ref_id, similarity in self._embeddings.search(embedding, k=k):
+            entry = self.get(ref_id)
+            results.append({"id": ref_id, "name": entry["name"] if entry else None, "similarity": similarity})
+        return results
+
+
+_library = None
+
+def get_reference_library():
+    """
+    Process-wide library instance (lazily opened).
+    """
+    global _library
+    if _library is None:
+        _library = ReferenceLibrary()
+    return _library
@@ -0,0 +1,258 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+
+"""
+
+Cost-aware admission control
+
+Every request is priced in estimated CPU-seconds (from its duration, sample
+rate and channel count) and in audio-seconds. A global CPU-seconds budget caps
+the work in flight across all clients, excess requests wait in a short FIFO
+queue (nothing overtakes a waiting request, so large ones do not starve), and
+per-client token buckets denominated in audio-seconds keep any single client
+from monopolising the workers. Requests that cannot be served in time are
+rejected with a Retry-After hint; a request that fails gets its audio-seconds
+back.
+
+A bucket left idle for a whole refill period is full again, which is what a
+new bucket starts as, so idle buckets are dropped; at most
+ADMISSION_MAX_CLIENTS are kept (least recently used go first).
+
+"""
+
+# --- COST MODEL ---
+
+# CPU-seconds per million samples (duration x sample rate x channels), measured on the full pipeline
+CPU_S_PER_MSAMPLE = float(os.getenv("ADMISSION_CPU_S_PER_MSAMPLE", 1.0))
+# Fixed per-track overhead (decoding setup, onset envelope, beat tracking)
+CPU_S_PER_TRACK = 0.3
+# The LLM report is mostly network wait, but parsing and the slot it holds still count
+CPU_S_PER_REPORT = 0.5
+
+# --- BUDGETS ---
+
+# Global CPU-seconds allowed in flight (defaults to ~20 s of work per worker core)
+CPU_BUDGET_S = float(os.getenv("ADMISSION_CPU_BUDGET_S", 20 * max(1, (os.cpu_count() or 2) - 1)))
+# Longest time a request may wait in the queue before being rejected
+MAX_QUEUE_WAIT_S = float(os.getenv("ADMISSION_MAX_QUEUE_WAIT_S", 30))
+# Per-client bucket: burst size and refill rate, in audio-seconds
+CLIENT_BURST_AUDIO_S = float(os.getenv("ADMISSION_CLIENT_BURST_AUDIO_S", 1800))
+CLIENT_REFILL_AUDIO_S_PER_MIN = float(os.getenv("ADMISSION_CLIENT_REFILL_AUDIO_S_PER_MIN", 900))
+MAX_CLIENTS = int(os.getenv("ADMISSION_MAX_CLIENTS", 10000))
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request cannot be admitted; retry_after is in seconds.
+    status_code is 429 for a client over its quota, 503 when the server is saturated.
+    """
+    def __init__(self, reason: str, retry_after: float, status_code: int = 503):
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+def estimate_track_cost(duration_s: float, sample_rate: int, channels: int):
+    """
+    Estimate the CPU-seconds needed to analyze one track.
+
+    Args:
+        duration_s: duration in seconds
+        sample_rate: sample rate in Hz
+        channels: number of channels
+
+    Returns:
+        Estimated CPU-seconds
+    """
+    samples = duration_s * sample_rate * max(1, channels)
+    return CPU_S_PER_TRACK + CPU_S_PER_MSAMPLE * samples / 1e6
+
+
+def estimate_request_cost(main_shape: dict, ref_shape: dict = None, wants_report: bool = True):
+    """
+    Estimate the CPU-seconds and audio-seconds of a whole request.
+
+    Args:
+        main_shape: {"duration_s", "sample_rate", "channels"} of the main track (e.g. its header probe)
+        ref_shape: same for the reference track, or a list for several (optional)
+        wants_report: whether an LLM report is generated
+
+    Returns:
+        (cpu_seconds, audio_seconds)
+    """
+    cpu_seconds = estimate_track_cost(main_shape["duration_s"], main_shape["sample_rate"], main_shape["channels"])
+    audio_seconds = main_shape["duration_s"]
+
+    for shape in [ref_shape] if isinstance(ref_shape, dict) else ref_shape or []:
+        cpu_seconds += estimate_track_cost(shape["duration_s"], shape["sample_rate"], shape["channels"])
+        audio_seconds += shape["duration_s"]
+
+    if wants_report:
+        cpu_seconds += CPU_S_PER_REPORT
+
+    return cpu_seconds, audio_seconds
+
+
+# --- TOKEN BUCKET ---
+
+class TokenBucket:
+    """
+    Classic token bucket; tokens are audio-seconds.
+    """
+    def __init__(self, capacity: float, refill_per_s: float):
+        self.capacity = capacity
+        self.refill_per_s = refill_per_s
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_s)
+        self.updated = now
+
+    def take(self, amount: float):
+        """
+        Take tokens if available.
+
+        Returns:
+            0.0 on success, otherwise the seconds until enough tokens are available
+        """
+        self._refill()
+        # A request larger than the whole bucket is allowed once the bucket is full
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_s
+
+    def refund(self, amount: float):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+# --- ADMISSION CONTROLLER ---
+
+class AdmissionController:
+
+    def __init__(
+        self,
+        cpu_budget_s: float = CPU_BUDGET_S,
+        workers: int = None,
+        max_queue_wait_s: float = MAX_QUEUE_WAIT_S,
+        client_burst_audio_s: float = CLIENT_BURST_AUDIO_S,
+        client_refill_audio_s_per_min: float = CLIENT_REFILL_AUDIO_S_PER_MIN,
+        max_clients: int = MAX_CLIENTS
+    ):
+        self.cpu_budget_s = cpu_budget_s
+        # CPU-seconds drained per wall-clock second
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.max_queue_wait_s = max_queue_wait_s
+        self.client_burst_audio_s = client_burst_audio_s
+        self.client_refill_audio_s = client_refill_audio_s_per_min / 60
+        self.max_clients = max_clients
+
+        self.in_flight_cost = 0.0
+        self.queued_cost = 0.0
+        self.queue_depth = 0
+        self._buckets = OrderedDict() # least recently used first
+        self._waiting = deque() # queued requests, in arrival order
+        self._condition = asyncio.Condition()
+
+    def _bucket(self, client_id: str):
+        bucket = self._buckets.get(client_id)
+        if bucket is None:
+            bucket = TokenBucket(self.client_burst_audio_s, self.client_refill_audio_s)
+            self._buckets[client_id] = bucket
+        self._buckets.move_to_end(client_id)
+        self._prune_buckets()
+        return bucket
+
+    def _prune_buckets(self):
+        # Idle for a whole refill period = full = the same as a new bucket
+        idle_s = self.client_burst_audio_s / self.client_refill_audio_s
+        now = time.monotonic()
+        while self._buckets:
+            oldest = next(iter(self._buckets.values()))
+            if len(self._buckets) <= self.max_clients and now - oldest.updated < idle_s:
+                break
+            self._buckets.popitem(last=False)
+
+    def _fits(self, cost: float):
+        # A request bigger than the whole budget still runs when nothing else does
+        return self.in_flight_cost == 0 or self.in_flight_cost + cost <= self.cpu_budget_s
+
+    def estimated_wait(self, cost: float):
+        """
+        Seconds until `cost` would fit in the budget, assuming the queue drains at `workers` CPU-s/s.
+        """
+        excess = self.in_flight_cost + self.queued_cost + cost - self.cpu_budget_s
+        return max(0.0, excess) / self.workers
+
+    @asynccontextmanager
+    async def admit(self, client_id: str, cpu_cost: float, audio_seconds: float):
+        """
+        Admit a request, queueing it if the global budget is exhausted.
+
+        Args:
+            client_id: client key (e.g. remote address)
+            cpu_cost: estimated CPU-seconds
+            audio_seconds: audio-seconds charged to the client's bucket
+
+        Raises:
+            AdmissionRejected: client over its quota, or the queue wait would exceed max_queue_wait_s
+        """
+
+        # --- PER-CLIENT QUOTA ---
+
+        bucket = self._bucket(client_id)
+        wait_for_tokens = bucket.take(audio_seconds)
+        if wait_for_tokens > 0:
+            raise AdmissionRejected("Client audio quota exceeded", wait_for_tokens, status_code=429)
+
+
+        # --- GLOBAL BUDGET ---
+
+        async with self._condition:
+            # FIFO: while anyone is queued, small requests queue behind them instead of slipping past
+            if self._waiting or not self._fits(cpu_cost):
+                wait = self.estimated_wait(cpu_cost)
+                if wait > self.max_queue_wait_s:
+                    bucket.refund(audio_seconds)
+                    raise AdmissionRejected("Server busy", wait)
+
+                ticket = object()
+                self._waiting.append(ticket)
+                self.queue_depth += 1
+                self.queued_cost += cpu_cost
+                try:
+                    await asyncio.wait_for(
+                        self._condition.wait_for(lambda: self._waiting[0] is ticket and self._fits(cpu_cost)),
+                        timeout=self.max_queue_wait_s
+                    )
+                except asyncio.TimeoutError:
+                    bucket.refund(audio_seconds)
+                    raise AdmissionRejected("Server busy", self.estimated_wait(cpu_cost))
+                finally:
+                    self._waiting.remove(ticket)
+                    self.queue_depth -= 1
+                    self.queued_cost -= cpu_cost
+                    # The next request in line may fit now (or become the head after a timeout)
+                    self._condition.notify_all()
+
+            self.in_flight_cost += cpu_cost
+
+        try:
+            yield
+        except Exception:
+            # Failed requests (undecodable audio, analysis errors) do not count against the quota
+            bucket.refund(audio_seconds)
+            raise
+        finally:
+            async with self._condition:
+                self.in_flight_cost -= cpu_cost
+                self._condition.notify_all()
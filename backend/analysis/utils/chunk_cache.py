@@ -0,0 +1,155 @@
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from analysis.utils.helper import to_python, evict_lru_files, DATA_DIR, TRACK_ID_PATTERN
+
+
+"""
+
+On-disk cache of chunk aggregates and per-track chunk manifests
+
+    <path>/chunks/<chunk hash>.npz      partial aggregates of one chunk
+    <path>/manifests/<track id>.json    chunk hashes, per-chunk summaries and merged metrics
+
+Chunk files are content-addressed, so they are shared between revisions and
+between tracks, and safe to write from several worker processes.
+
+The directory is capped at CHUNK_CACHE_MAX_MB: every EVICT_EVERY_PUTS writes,
+the least recently used files (chunks and manifests alike, by mtime, which a
+cache hit refreshes) are deleted until the total is under the cap. Temporary
+files of writers that have not renamed them yet are left alone; those of
+crashed writers go after TMP_FILE_GRACE_S.
+
+"""
+
+CHUNK_CACHE_DIR = os.getenv("CHUNK_CACHE_DIR", os.path.join(DATA_DIR, "chunk_cache"))
+CHUNK_CACHE_MAX_MB = float(os.getenv("CHUNK_CACHE_MAX_MB", 2048))
+MEMORY_CACHE_SIZE = 512 # chunks kept in memory (~10 KB each)
+EVICT_EVERY_PUTS = 64
+
+MANIFEST_KEYS = ["track_id", "sample_rate", "chunk_s", "chunk_hashes", "chunk_summaries", "metrics"]
+
+
+class ChunkCache:
+
+    def __init__(self, path: str = CHUNK_CACHE_DIR, max_mb: float = CHUNK_CACHE_MAX_MB):
+        self.chunks_dir = os.path.join(path, "chunks")
+        self.manifests_dir = os.path.join(path, "manifests")
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        os.makedirs(self.manifests_dir, exist_ok=True)
+        self.max_bytes = max_mb * 1024 * 1024
+        self._memory = OrderedDict()
+        self._puts = 0
+
+
+    # --- CHUNK AGGREGATES ---
+
+    def get(self, chunk_hash: str):
+        path = os.path.join(self.chunks_dir, f"{chunk_hash}.npz")
+        if chunk_hash in self._memory:
+            self._memory.move_to_end(chunk_hash)
+            self._touch(path)
+            return self._memory[chunk_hash]
+
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                aggregate = {key: data[key] for key in data.files}
+        except (OSError, ValueError):
+            return None # partial/corrupt file: recompute
+        self._touch(path)
+        self._remember(chunk_hash, aggregate)
+        return aggregate
+
+    def put(self, chunk_hash: str, aggregate: dict):
+        path = os.path.join(self.chunks_dir, f"{chunk_hash}.npz")
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, **aggregate)
+        os.replace(tmp_path, path)
+        self._remember(chunk_hash, aggregate)
+        self._count_put()
+
+    def _remember(self, chunk_hash: str, aggregate: dict):
+        self._memory[chunk_hash] = aggregate
+        self._memory.move_to_end(chunk_hash)
+        while len(self._memory) > MEMORY_CACHE_SIZE:
+            self._memory.popitem(last=False)
+
+
+    # --- TRACK MANIFESTS ---
+
+    def _manifest_path(self, track_id: str):
+        if not isinstance(track_id, str) or not TRACK_ID_PATTERN.match(track_id):
+            raise ValueError(f"Invalid track id {track_id!r}")
+        return os.path.join(self.manifests_dir, f"{track_id}.json")
+
+    def load_manifest(self, track_id: str):
+        """
+        Returns:
+            The stored manifest, or None if it is missing or malformed
+
+        Raises:
+            ValueError: track_id is not a content id
+        """
+        path = self._manifest_path(track_id)
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable manifest {track_id}: {e}")
+            return None
+        if not isinstance(manifest, dict) or any(key not in manifest for key in MANIFEST_KEYS):
+            print(f"Ignoring malformed manifest {track_id}")
+            return None
+        self._touch(path)
+        return manifest
+
+    def save_manifest(self, track_id: str, manifest: dict):
+        path = self._manifest_path(track_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(to_python(manifest), f)
+        os.replace(tmp_path, path)
+        self._count_put()
+
+
+    # --- EVICTION ---
+
+    @staticmethod
+    def _touch(path: str):
+        try:
+            os.utime(path)
+        except OSError:
+            pass # evicted by another process in the meantime
+
+    def _count_put(self):
+        self._puts += 1
+        if self._puts % EVICT_EVERY_PUTS == 0:
+            self.evict()
+
+    def evict(self):
+        """
+        Delete least recently used files until the cache is under max_bytes.
+
+        Returns:
+            Number of files deleted
+        """
+        return evict_lru_files([self.chunks_dir, self.manifests_dir], self.max_bytes)
+
+
+_cache = None
+
+def get_chunk_cache():
+    """
+    Process-wide chunk cache (lazily opened), so the in-memory LRU is shared by every request of a worker.
+    """
+    global _cache
+    if _cache is None:
+        _cache = ChunkCache()
+    return _cache
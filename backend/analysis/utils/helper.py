@@ -1,5 +1,20 @@
+import os
+import re
+import time
+
 import numpy as np
 
+# backend/ directory: default data directories live under it, whatever the working directory
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DATA_DIR = os.path.join(BACKEND_DIR, "data")
+
+# Track ids are content ids (ReferenceLibrary.make_id); anything else never names a file
+TRACK_ID_PATTERN = re.compile(r"^[0-9a-f]{16}$")
+
+# Temporary files younger than this may belong to a writer that has not renamed them yet
+TMP_FILE_GRACE_S = 3600
+
+
 def to_python(obj):
     if isinstance(obj, np.ndarray):
         return obj.tolist()
@@ -14,3 +29,43 @@ def to_python(obj):
     if isinstance(obj, list):
         return [to_python(v) for v in obj]
     return obj
+
+
+def evict_lru_files(directories: list, max_bytes: float, tmp_grace_s: float = TMP_FILE_GRACE_S):
+    """
+    Delete least recently used files (by mtime) until the directories are under max_bytes.
+    Several processes may evict at once; files already gone are skipped.
+
+    Args:
+        directories: directories to scan (not recursive)
+        max_bytes: size cap for all of them together
+        tmp_grace_s: "*.tmp*" files are only deleted once this old (left by crashed writers)
+
+    Returns:
+        Number of files deleted
+    """
+    now = time.time()
+    files = []
+    for directory in directories:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if ".tmp" in entry.name and now - stat.st_mtime < tmp_grace_s:
+                    continue # still being written: its size counts once it is renamed
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in files)
+    deleted = 0
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            deleted += 1
+        except FileNotFoundError:
+            pass
+        total -= size
+    return deleted
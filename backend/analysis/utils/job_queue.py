@@ -0,0 +1,318 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import deque
+from typing import NamedTuple
+
+from analysis.utils.helper import to_python
+
+
+"""
+
+Analysis job queue shared by API nodes and worker nodes
+
+The API submits a job (audio bytes + arguments) and waits for its result;
+workers (worker.py) claim jobs, run them on their own process pool and push
+the result back. Two brokers speak the same protocol:
+
+    LocalBroker     in-process, for ANALYSIS_BACKEND=local and tests
+    RedisBroker     any Redis-compatible server (REDIS_URL), for multi-node setups
+
+Claiming a job leases it to one worker for JOB_LEASE_S. Workers renew the
+leases of their running jobs with heartbeats; a job whose lease runs out
+(worker died or hung) goes back to the front of the queue, up to
+JOB_MAX_ATTEMPTS times, after which the submitter gets a failure. Errors
+raised by the analysis itself are reported once, not retried.
+
+"""
+
+JOB_LEASE_S = float(os.getenv("JOB_LEASE_S", 30))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+JOB_RESULT_TTL_S = int(os.getenv("JOB_RESULT_TTL_S", 600)) # results nobody waits for any more expire
+JOB_TIMEOUT_S = float(os.getenv("JOB_TIMEOUT_S", 900)) # longest the API waits for a result
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "analysis:")
+
+
+class Job(NamedTuple):
+    id: str
+    kind: str
+    audio: bytes
+    mime: str
+    args: dict
+    attempt: int
+
+
+class JobFailed(Exception):
+    pass
+
+
+# --- LOCAL BROKER ---
+
+class LocalBroker:
+    """
+    In-process broker with the same leasing semantics as RedisBroker.
+    """
+
+    def __init__(self, lease_s: float = JOB_LEASE_S, max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.lease_s = lease_s
+        self.max_attempts = max_attempts
+        self._pending = deque()
+        self._jobs = {}
+        self._leases = {} # job id -> (worker id, lease expiry)
+        self._results = {} # job id -> future
+        self._workers = {} # worker id -> (info, liveness expiry)
+
+    async def submit(self, kind: str, audio: bytes, mime: str, args: dict = None):
+        job_id = uuid.uuid4().hex
+        self._jobs[job_id] = {"kind": kind, "audio": audio, "mime": mime, "args": args or {}, "attempts": 0}
+        self._results[job_id] = asyncio.get_running_loop().create_future()
+        self._pending.appendleft(job_id)
+        return job_id
+
+    async def wait(self, job_id: str, timeout: float = JOB_TIMEOUT_S):
+        future = self._results[job_id]
+        try:
+            outcome = await asyncio.wait_for(future, timeout)
+        finally:
+            # Like an expired Redis result: a late outcome has nobody to go to
+            self._results.pop(job_id, None)
+        if outcome["status"] != "done":
+            raise JobFailed(outcome["error"])
+        return outcome["result"]
+
+    async def claim(self, worker_id: str):
+        if not self._pending:
+            return None
+        job_id = self._pending.pop()
+        job = self._jobs[job_id]
+        job["attempts"] += 1
+        self._leases[job_id] = (worker_id, time.time() + self.lease_s)
+        return Job(job_id, job["kind"], job["audio"], job["mime"], job["args"], job["attempts"])
+
+    async def heartbeat(self, worker_id: str, job_ids: list, info: dict = None):
+        now = time.time()
+        self._workers[worker_id] = (info or {}, now + self.lease_s)
+        for job_id in job_ids:
+            if self._leases.get(job_id, (None,))[0] == worker_id:
+                self._leases[job_id] = (worker_id, now + self.lease_s)
+
+    async def complete(self, worker_id: str, job_id: str, result):
+        self._finish(worker_id, job_id, {"status": "done", "result": result})
+
+    async def fail(self, worker_id: str, job_id: str, error: str):
+        self._finish(worker_id, job_id, {"status": "failed", "error": error})
+
+    def _finish(self, worker_id: str, job_id: str, outcome: dict):
+        # A worker whose lease was taken over no longer owns the job
+        if self._leases.get(job_id, (None,))[0] != worker_id:
+            return
+        del self._leases[job_id]
+        del self._jobs[job_id]
+        self._resolve(job_id, outcome)
+
+    def _resolve(self, job_id: str, outcome: dict):
+        future = self._results.get(job_id)
+        if future is not None and not future.done():
+            future.set_result(outcome)
+
+    async def requeue_expired(self):
+        now = time.time()
+        expired = [job_id for job_id, (_, expiry) in self._leases.items() if expiry <= now]
+        for job_id in expired:
+            del self._leases[job_id]
+            attempts = self._jobs[job_id]["attempts"]
+            if attempts < self.max_attempts:
+                self._pending.append(job_id) # front of the queue
+            else:
+                del self._jobs[job_id]
+                self._resolve(job_id, {"status": "failed", "error": f"Worker lost the job {attempts} times"})
+        return len(expired)
+
+    async def stats(self):
+        now = time.time()
+        return {
+            "pending": len(self._pending),
+            "leased": len(self._leases),
+            "workers": {worker_id: info for worker_id, (info, expiry) in self._workers.items() if expiry > now},
+        }
+
+    async def close(self):
+        pass
+
+
+# --- REDIS BROKER ---
+
+# Keys (all under REDIS_PREFIX):
+#   pending             list of job ids (LPUSH to submit, RPOP to claim; retries RPUSH to the front)
+#   leases              sorted set: job id -> lease expiry (server time)
+#   job:<id>            hash: kind, mime, args, audio, attempts, worker
+#   result:<id>         list holding the outcome, BLPOP-ed by the submitter
+#   worker:<id>         liveness key of a worker, expires after one lease period
+
+# Skips ids whose job hash expired while they sat in the pending list (nobody waits for
+# them any more) and returns the job fields in the same atomic step
+_CLAIM = """
+while true do
+    local id = redis.call('RPOP', KEYS[1])
+    if not id then return nil end
+    local job = ARGV[3] .. 'job:' .. id
+    if redis.call('EXISTS', job) == 1 then
+        local t = redis.call('TIME')
+        redis.call('ZADD', KEYS[2], tonumber(t[1]) + tonumber(ARGV[2]), id)
+        redis.call('HSET', job, 'worker', ARGV[1])
+        local attempts = redis.call('HINCRBY', job, 'attempts', 1)
+        local fields = redis.call('HMGET', job, 'kind', 'mime', 'args', 'audio')
+        return {id, attempts, fields[1], fields[2], fields[3], fields[4]}
+    end
+end
+"""
+
+_HEARTBEAT = """
+local t = redis.call('TIME')
+for i = 4, #ARGV do
+    if redis.call('HGET', ARGV[3] .. 'job:' .. ARGV[i], 'worker') == ARGV[1] then
+        redis.call('ZADD', KEYS[1], 'XX', tonumber(t[1]) + tonumber(ARGV[2]), ARGV[i])
+    end
+end
+return 1
+"""
+
+_FINISH = """
+local job = ARGV[3] .. 'job:' .. ARGV[2]
+if redis.call('HGET', job, 'worker') ~= ARGV[1] then return 0 end
+redis.call('ZREM', KEYS[1], ARGV[2])
+redis.call('DEL', job)
+local result = ARGV[3] .. 'result:' .. ARGV[2]
+redis.call('LPUSH', result, ARGV[4])
+redis.call('EXPIRE', result, ARGV[5])
+return 1
+"""
+
+_REQUEUE = """
+local t = redis.call('TIME')
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', tonumber(t[1]))
+for _, id in ipairs(expired) do
+    redis.call('ZREM', KEYS[1], id)
+    local job = ARGV[2] .. 'job:' .. id
+    local attempts = tonumber(redis.call('HGET', job, 'attempts') or '0')
+    if attempts < tonumber(ARGV[1]) then
+        redis.call('HDEL', job, 'worker')
+        redis.call('RPUSH', KEYS[2], id)
+    else
+        redis.call('DEL', job)
+        local result = ARGV[2] .. 'result:' .. id
+        redis.call('LPUSH', result, cjson.encode({status = 'failed', error = 'Worker lost the job ' .. attempts .. ' times'}))
+        redis.call('EXPIRE', result, ARGV[3])
+    end
+end
+return #expired
+"""
+
+
+class RedisBroker:
+    """
+    Broker on a Redis-compatible server; claim, heartbeat, finish and requeue are Lua scripts (atomic).
+    Needs the optional `redis` package (pip install "backend[queue]").
+    """
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = REDIS_PREFIX, lease_s: float = JOB_LEASE_S, max_attempts: int = JOB_MAX_ATTEMPTS, client=None):
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError as e:
+                raise RuntimeError("RedisBroker needs the 'redis' package (pip install redis)") from e
+            client = redis.from_url(url)
+
+        self.redis = client # or any client with the redis.asyncio API (e.g. fakeredis)
+        self.prefix = prefix
+        self.lease_s = lease_s
+        self.max_attempts = max_attempts
+        self._pending_key = f"{prefix}pending"
+        self._leases_key = f"{prefix}leases"
+        self._claim = self.redis.register_script(_CLAIM)
+        self._heartbeat = self.redis.register_script(_HEARTBEAT)
+        self._finish = self.redis.register_script(_FINISH)
+        self._requeue = self.redis.register_script(_REQUEUE)
+
+    async def submit(self, kind: str, audio: bytes, mime: str, args: dict = None):
+        job_id = uuid.uuid4().hex
+        job_key = f"{self.prefix}job:{job_id}"
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(job_key, mapping={"kind": kind, "mime": mime, "args": json.dumps(args or {}), "audio": audio, "attempts": 0})
+            pipe.expire(job_key, int(JOB_TIMEOUT_S + JOB_RESULT_TTL_S))
+            pipe.lpush(self._pending_key, job_id)
+            await pipe.execute()
+        return job_id
+
+    async def wait(self, job_id: str, timeout: float = JOB_TIMEOUT_S):
+        popped = await self.redis.blpop([f"{self.prefix}result:{job_id}"], timeout=timeout)
+        if popped is None:
+            raise asyncio.TimeoutError(f"No result for job {job_id} after {timeout:.0f} s")
+        outcome = json.loads(popped[1])
+        if outcome["status"] != "done":
+            raise JobFailed(outcome["error"])
+        return outcome["result"]
+
+    async def claim(self, worker_id: str):
+        claimed = await self._claim(keys=[self._pending_key, self._leases_key], args=[worker_id, self.lease_s, self.prefix])
+        if claimed is None:
+            return None
+        job_id, attempt, kind, mime, args, audio = claimed
+        return Job(job_id.decode(), kind.decode(), audio, mime.decode(), json.loads(args), int(attempt))
+
+    async def heartbeat(self, worker_id: str, job_ids: list, info: dict = None):
+        await self.redis.set(f"{self.prefix}worker:{worker_id}", json.dumps(info or {}), ex=max(1, int(self.lease_s)))
+        if job_ids:
+            await self._heartbeat(keys=[self._leases_key], args=[worker_id, self.lease_s, self.prefix, *job_ids])
+
+    async def complete(self, worker_id: str, job_id: str, result):
+        await self._finish_job(worker_id, job_id, {"status": "done", "result": to_python(result)})
+
+    async def fail(self, worker_id: str, job_id: str, error: str):
+        await self._finish_job(worker_id, job_id, {"status": "failed", "error": error})
+
+    async def _finish_job(self, worker_id: str, job_id: str, outcome: dict):
+        await self._finish(keys=[self._leases_key], args=[worker_id, job_id, self.prefix, json.dumps(outcome), JOB_RESULT_TTL_S])
+
+    async def requeue_expired(self):
+        return await self._requeue(keys=[self._leases_key, self._pending_key], args=[self.max_attempts, self.prefix, JOB_RESULT_TTL_S])
+
+    async def stats(self):
+        workers = {}
+        async for key in self.redis.scan_iter(match=f"{self.prefix}worker:*"):
+            info = await self.redis.get(key)
+            if info is not None:
+                workers[key.decode()[len(f"{self.prefix}worker:"):]] = json.loads(info)
+        return {
+            "pending": await self.redis.llen(self._pending_key),
+            "leased": await self.redis.zcard(self._leases_key),
+            "workers": workers,
+        }
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+# --- SUBMITTING ---
+
+async def run_job(broker, kind: str, audio: bytes, mime: str, timeout: float = JOB_TIMEOUT_S, **args):
+    """
+    Submit a job and wait for its result.
+
+    Raises:
+        JobFailed: the analysis raised, or workers kept dying on the job
+        asyncio.TimeoutError: no result within `timeout`
+    """
+    job_id = await broker.submit(kind, audio, mime, args)
+    return await broker.wait(job_id, timeout)
+
+
+def create_broker(backend: str):
+    if backend == "local":
+        return LocalBroker()
+    if backend == "redis":
+        return RedisBroker()
+    raise ValueError(f"Unknown analysis backend '{backend}' (expected pool, local or redis)")
@@ -0,0 +1,216 @@
+import os
+import resource
+
+from analysis.audio.sample_rate_policy import get_analysis_sample_rate, STAGE_SAMPLE_RATES
+from analysis.audio.audio_probe import probe_audio, ProbeError
+
+
+"""
+
+Per-request memory budget
+
+Before a track is decoded, its peak memory is estimated from the duration,
+sample rate and channel count in its header (audio_probe). The estimate is
+what stays resident (decoded PCM,
+resampled buffers, shared spectrogram) plus the largest temporary peak of any
+stage. If the estimate is over ANALYSIS_MEMORY_BUDGET_MB, the track runs in
+low-memory mode:
+
+    loudness            chunked K-weighting / true peak (same metrics)
+    spectrum            float32 FFT, bands and tilt accumulated over bin blocks (same metrics)
+    stereo imaging      STFT per chunk (frames at chunk edges differ slightly)
+    spectrogram         computed block by block (same values)
+    tempo / onsets      at LOW_MEMORY_TEMPO_SR (the tempo rate unless overridden)
+    transients          shorter centre window (LOW_MEMORY_TRANSIENT_S)
+
+Stage costs are bytes per sample at the rate the stage runs at, measured with
+tracemalloc on 2-5 minute tracks. The measured peak of every request is
+reported next to the estimate so the coefficients can be checked.
+
+"""
+
+ANALYSIS_MEMORY_BUDGET_MB = float(os.getenv("ANALYSIS_MEMORY_BUDGET_MB", 1024))
+
+LOW_MEMORY_CHUNK_S = 30
+# Decimating onsets to 11025 Hz halved the BPM on some tracks (validate_fast_modes,
+# case tempo_decimated): only lower this once that case passes
+LOW_MEMORY_TEMPO_SR = int(os.getenv("LOW_MEMORY_TEMPO_SR", STAGE_SAMPLE_RATES["tempo"]))
+LOW_MEMORY_TRANSIENT_S = 30
+TRANSIENT_MAX_S = 120
+
+# Temporary peak of each stage, in bytes per sample at the stage's own rate
+STAGE_BYTES_PER_SAMPLE = {
+    "standard": {
+        "onset": 50,           # tempo rate, mono
+        "loudness": 14,        # native rate, per channel
+        "transient": 130,      # transient rate, mono, capped window
+        "spectrum": 44,        # native rate, mono
+        "stereo": 80,          # analysis rate
+        "spectrogram": 24,     # analysis rate (plus the resident float32 result)
+        "sections": 8,         # analysis rate
+    },
+    "low_memory": {
+        "onset": 50,
+        "loudness": 1,         # whole-track part; the rest scales with the chunk
+        "transient": 130,
+        "spectrum": 12,
+        "stereo": 0,           # chunk only
+        "spectrogram": 4,      # padded copy of the mono signal; the rest scales with the chunk
+        "sections": 8,
+    },
+}
+
+# Per-chunk temporaries in low-memory mode, bytes per sample of one chunk
+CHUNK_BYTES_PER_SAMPLE = {"loudness": 45, "stereo": 90, "spectrogram": 32}
+
+
+def estimate_peak_memory(duration_s: float, sr: int, channels: int, low_memory: bool = False):
+    """
+    Estimate the peak memory of analyze_decoded_track.
+
+    Args:
+        duration_s: track duration in seconds
+        sr: native sample rate
+        channels: channel count of the decoded audio
+        low_memory: estimate for low-memory mode
+
+    Returns:
+        Dictionary with PCM, resident and per-stage estimates and the peaks, in MB
+    """
+    mode = "low_memory" if low_memory else "standard"
+    analysis_sr = get_analysis_sample_rate(sr)
+    tempo_sr = min(analysis_sr, LOW_MEMORY_TEMPO_SR if low_memory else STAGE_SAMPLE_RATES["tempo"])
+    transient_sr = min(analysis_sr, STAGE_SAMPLE_RATES["transient"])
+    transient_s = min(duration_s, LOW_MEMORY_TRANSIENT_S if low_memory else TRANSIENT_MAX_S)
+
+    n_native = duration_s * sr
+    n_analysis = duration_s * analysis_sr
+
+    # Decoded PCM (float32); then resampled stereo + mono, native mono for the spectrum,
+    # stage-rate mono signals, float32 spectrogram
+    pcm = 4 * channels * n_native
+    resident = 0.0
+    if analysis_sr != sr:
+        resident += 4 * 2 * n_analysis + 4 * n_native
+    resident += 4 * n_analysis
+    resident += 4 * duration_s * sum({tempo_sr, transient_sr} - {analysis_sr})
+    resident += 8 * n_analysis
+
+    costs = STAGE_BYTES_PER_SAMPLE[mode]
+    stages = {
+        "onset": costs["onset"] * duration_s * tempo_sr,
+        "loudness": costs["loudness"] * channels * n_native,
+        "transient": costs["transient"] * transient_s * transient_sr,
+        "spectrum": costs["spectrum"] * n_native,
+        "stereo": costs["stereo"] * n_analysis,
+        "spectrogram": costs["spectrogram"] * n_analysis,
+        "sections": costs["sections"] * n_analysis,
+    }
+    if low_memory:
+        for stage, per_sample in CHUNK_BYTES_PER_SAMPLE.items():
+            chunk_sr = sr if stage == "loudness" else analysis_sr
+            stages[stage] += per_sample * min(duration_s, LOW_MEMORY_CHUNK_S) * chunk_sr
+
+    mb = 1024 * 1024
+    analysis_peak = resident + max(stages.values())
+    return {
+        "pcm_mb": round(pcm / mb, 1),
+        "resident_mb": round(resident / mb, 1),
+        "stages_mb": {stage: round(value / mb, 1) for stage, value in stages.items()},
+        "analysis_peak_mb": round(analysis_peak / mb, 1), # on top of the decoded PCM
+        "peak_mb": round((pcm + analysis_peak) / mb, 1),
+    }
+
+
+def plan_analysis(duration_s: float, sr: int, channels: int, budget_mb: float = None):
+    """
+    Choose standard or low-memory mode for a track.
+
+    Returns:
+        Dictionary with the mode, budget and estimated peak (MB)
+    """
+    budget_mb = budget_mb or ANALYSIS_MEMORY_BUDGET_MB
+    estimate = estimate_peak_memory(duration_s, sr, channels)
+    low_memory = estimate["peak_mb"] > budget_mb
+    if low_memory:
+        estimate = estimate_peak_memory(duration_s, sr, channels, low_memory=True)
+
+    return {
+        "low_memory": low_memory,
+        "source": "pcm",
+        "budget_mb": budget_mb,
+        "estimated_peak_mb": estimate["peak_mb"],
+        "estimated_analysis_peak_mb": estimate["analysis_peak_mb"],
+        "over_budget": estimate["peak_mb"] > budget_mb,
+        "estimate": estimate,
+    }
+
+
+def plan_upload(audio_bytes: bytes, budget_mb: float = None):
+    """
+    Plan an upload's analysis from its header alone, before anything is decoded.
+
+    Returns:
+        plan_analysis result with source "header", or None if the header cannot be probed
+    """
+    try:
+        probe = probe_audio(audio_bytes)
+    except ProbeError as e:
+        print(f"Memory plan falls back to the decoded PCM: {e}")
+        return None
+    plan = plan_analysis(probe["duration_s"], probe["sample_rate"], probe["channels"], budget_mb)
+    plan["source"] = "header"
+    return plan
+
+
+# --- MEASURED PEAK ---
+
+def _status_mb(field: str):
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class PeakMemoryTracker:
+    """
+    Measures the peak RSS of a block of work in this process.
+
+    On Linux the RSS high-water mark is reset first (/proc/self/clear_refs),
+    so the peak belongs to this request even in a long-lived worker. Elsewhere
+    it falls back to ru_maxrss, the peak since the process started.
+
+    actual_peak_mb is the rise over the RSS at entry, so it compares with
+    estimated_analysis_peak_mb. In pool workers the shared PCM pages also
+    count as they are first read.
+    """
+
+    def __enter__(self):
+        self.exact = False
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+            self.exact = True
+        except OSError:
+            pass
+        self.baseline_mb = _status_mb("VmRSS")
+        return self
+
+    def __exit__(self, *exc):
+        self.peak_mb = _status_mb("VmHWM") if self.exact else None
+        if self.peak_mb is None:
+            self.peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # kB on Linux
+        return False
+
+    def report(self):
+        baseline = self.baseline_mb or 0.0
+        return {
+            "baseline_rss_mb": round(baseline, 1),
+            "peak_rss_mb": round(self.peak_mb, 1),
+            "actual_peak_mb": round(self.peak_mb - baseline, 1),
+            "peak_is_per_request": self.exact,
+        }
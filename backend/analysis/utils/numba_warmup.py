@@ -0,0 +1,155 @@
+import io
+import os
+import time
+import wave
+
+import numpy as np
+
+
+"""
+
+Persistent numba cache and JIT warm-up for the librosa code paths
+
+librosa compiles beat tracking, onset detection and a few utilities with numba
+on first use. The compiled code is written to a shared on-disk cache. The API
+process (and worker.py) runs the full warm-up once, a synthetic track through
+the whole pipeline, which compiles every JIT path into the cache. Pool workers
+then only load the cached kernels, with one small call per numba-compiled
+path (load_kernels), instead of repeating the whole analysis
+ANALYSIS_WORKERS times.
+
+"""
+
+# Shared by all workers on the same machine (override with NUMBA_CACHE_DIR)
+DEFAULT_NUMBA_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "audio-mix-analyzer", "numba")
+
+WARMUP_SR = 44100
+WARMUP_DURATION_S = 4.0
+
+_warmed_up = False
+
+
+# --- NUMBA CACHE ---
+
+def configure_numba_cache(cache_dir: str = None):
+    """
+    Point numba at a persistent cache directory shared by all workers.
+
+    Must run before numba (and therefore librosa) is imported, because numba
+    reads NUMBA_CACHE_DIR only once at import time.
+
+    Args:
+        cache_dir: cache directory (defaults to NUMBA_CACHE_DIR or DEFAULT_NUMBA_CACHE_DIR)
+
+    Returns:
+        The cache directory in use
+    """
+    cache_dir = cache_dir or os.environ.get("NUMBA_CACHE_DIR") or DEFAULT_NUMBA_CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ["NUMBA_CACHE_DIR"] = cache_dir
+    return cache_dir
+
+
+# --- WARM-UP ---
+
+def _synthetic_wav_bytes(sr=WARMUP_SR, duration=WARMUP_DURATION_S):
+    """
+    Build a short stereo click track with some noise, encoded as 16-bit WAV.
+    The clicks give the beat tracker and onset detector something to lock on.
+    """
+    rng = np.random.default_rng(0)
+    n = int(sr * duration)
+    t = np.arange(n) / sr
+
+    signal = 0.2 * np.sin(2 * np.pi * 110 * t) + 0.05 * rng.standard_normal(n)
+    beat_period = int(sr * 0.5) # 120 BPM
+    click = np.exp(-np.arange(2048) / 200.0)
+    for start in range(0, n - click.size, beat_period):
+        signal[start:start + click.size] += 0.8 * click
+
+    stereo = np.stack([signal, np.roll(signal, 32)], axis=1)
+    pcm = (np.clip(stereo, -1.0, 1.0) * 32767).astype(np.int16)
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(sr)
+        wav.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+def warm_up():
+    """
+    Exercise every numba-compiled path that analyze_uploaded_track_complete touches.
+
+    Runs the full pipeline on a synthetic track, plus the transient stage
+    explicitly, since the pipeline only runs it for low dynamic range material.
+
+    Returns:
+        Warm-up time in seconds
+    """
+    global _warmed_up
+
+    # Imported here so configure_numba_cache() can run before librosa is loaded
+    import librosa
+    from analysis.audio.audio_features import get_transient_features
+    from pipeline.analyze_track_complete import analyze_uploaded_track_complete
+
+    start_time = time.time()
+
+    wav_bytes = _synthetic_wav_bytes()
+    analyze_uploaded_track_complete(wav_bytes, "audio/wav")
+
+    y = np.sin(2 * np.pi * 220 * np.arange(int(WARMUP_SR * WARMUP_DURATION_S)) / WARMUP_SR).astype(np.float32)
+    onset_env = librosa.onset.onset_strength(y=y, sr=WARMUP_SR)
+    get_transient_features(y, WARMUP_SR, max_duration=WARMUP_DURATION_S, onset_env=onset_env)
+
+    _warmed_up = True
+    warmup_time = time.time() - start_time
+    print(f"\n{'='*50}")
+    print(f"JIT warm-up completed in {warmup_time:.2f} seconds (cache: {os.environ.get('NUMBA_CACHE_DIR')}).")
+    print(f"\n{'='*50}")
+    return warmup_time
+
+
+def load_kernels():
+    """
+    Load every numba kernel the pipeline uses from the cache, with the smallest call that reaches it.
+
+    The beat tracker, peak picking and local maxima are eagerly compiled
+    gufuncs (loaded when librosa is imported); the inverse STFT of the HPSS
+    transient stage (overlap-add, window sum-square) compiles lazily.
+
+    Returns:
+        Load time in seconds
+    """
+    global _warmed_up
+
+    import librosa
+
+    start_time = time.time()
+
+    sr = 22050
+    y = np.sin(2 * np.pi * 220 * np.arange(sr) / sr).astype(np.float32)
+    S = librosa.stft(y)
+    librosa.istft(S, length=len(y))
+    onset_env = librosa.onset.onset_strength(y=y, sr=sr)
+    librosa.onset.onset_detect(onset_envelope=onset_env, sr=sr)
+    librosa.beat.beat_track(onset_envelope=onset_env, sr=sr)
+
+    _warmed_up = True
+    return time.time() - start_time
+
+
+def is_warmed_up():
+    return _warmed_up
+
+
+def init_worker():
+    """
+    ProcessPoolExecutor initializer: every fresh worker loads the cached kernels before its first job.
+    The API process has already compiled them into the cache (warm_up).
+    """
+    configure_numba_cache()
+    load_kernels()
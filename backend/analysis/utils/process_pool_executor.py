@@ -1,27 +1,138 @@
 import os
 import asyncio
+import threading
 
 from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker
 
-from pipeline.analyze_track_complete import analyze_uploaded_track_complete
+from analysis.utils.numba_warmup import init_worker, is_warmed_up
+from analysis.utils.shared_pcm import share_pcm, attach_pcm
+from analysis.reference.reference_library import ReferenceLibrary
+from analysis.utils.memory_budget import plan_upload
+from pipeline.analyze_track_complete import decode_track, analyze_decoded_track
+from pipeline.analyze_revision import analyze_revision
 
 
 """
 
 Split "analyze track function" between computer cores
 
+If a worker dies mid-job (OOM kill, segfault in native code) the executor is
+broken for good, so it is replaced by a fresh one and the job is retried once;
+a job that breaks the new pool too fails on its own.
+
 """
 
-executor = ProcessPoolExecutor(max_workers=os.cpu_count() - 1) # make sure 1 core is left for security reason
+# make sure 1 core is left for security reason (ANALYSIS_WORKERS overrides, e.g. for pool-size tuning)
+MAX_WORKERS = int(os.getenv("ANALYSIS_WORKERS", max(1, os.cpu_count() - 1)))
+
+# Start the shared-memory resource tracker before any worker exists, so workers share it
+# instead of starting their own (which would try to clean up segments the parent owns)
+resource_tracker.ensure_running()
+
+BROKEN_POOL_RETRIES = 1
+
+
+def _new_executor():
+    # Each worker loads the JIT kernels from the shared numba cache before its first job
+    return ProcessPoolExecutor(
+        max_workers=MAX_WORKERS,
+        initializer=init_worker
+    )
+
+
+executor = _new_executor()
+_executor_lock = threading.Lock()
+
+
+def _replace_broken_executor(broken):
+    """
+    Swap in a fresh executor, unless another request already replaced this broken one.
+    """
+    global executor
+    with _executor_lock:
+        if executor is broken:
+            print("Analysis pool broken (a worker died), starting a new one")
+            broken.shutdown(wait=False, cancel_futures=True)
+            executor = _new_executor()
+
+
+# --- WORKER ENTRY POINT ---
+
+def analyze_shared_track(pcm, deadline=None, pressure=0.0, memory_plan=None):
+    """
+    Run the analysis on PCM that the parent placed in shared memory.
+    Only the segment descriptor is pickled, never the samples.
+    """
+    with attach_pcm(pcm) as (y_stereo, sr):
+        return analyze_decoded_track(y_stereo, sr, deadline=deadline, pressure=pressure, memory_plan=memory_plan)
+
+
+def analyze_shared_revision(pcm, track_id, previous_track_id):
+    """
+    Incremental (chunk-cached) analysis of PCM in shared memory.
+    """
+    with attach_pcm(pcm) as (y_stereo, sr):
+        return analyze_revision(y_stereo, sr, track_id, previous_track_id)
 
 
 # --- HELPER CPU PROCESSOR ---
 
-async def run_in_processpool(audio_bytes: bytes, mime: str):
+async def _run_shared(audio_bytes: bytes, mime: str, fn, *args):
     loop = asyncio.get_event_loop()
-    return await loop.run_in_executor (
-        executor,
-        analyze_uploaded_track_complete,
-        audio_bytes,
-        mime
-    )
\ No newline at end of file
+
+    # Decode once in the API process (off the event loop), then hand the PCM over by name;
+    # the waveform peaks are built from the same decoded PCM, keyed by the file's content id
+    track_id = ReferenceLibrary.make_id(audio_bytes)
+    y_stereo, sr = await asyncio.to_thread(decode_track, audio_bytes, mime, track_id)
+    if y_stereo is None:
+        return None
+
+    with share_pcm(y_stereo, sr) as pcm:
+        del y_stereo # the shared segment is now the only copy
+        for attempt in range(BROKEN_POOL_RETRIES + 1):
+            current = executor
+            try:
+                result = await loop.run_in_executor (
+                    current,
+                    fn,
+                    pcm,
+                    *args
+                )
+                break
+            except BrokenProcessPool:
+                _replace_broken_executor(current)
+                if attempt == BROKEN_POOL_RETRIES:
+                    raise
+
+    if result is not None:
+        result["waveform"] = {"track_id": track_id, "index_url": f"/waveform/{track_id}", "data_url": f"/waveform/{track_id}/data"}
+    return result
+
+
+async def run_in_processpool(audio_bytes: bytes, mime: str, deadline: float = None, pressure: float = 0.0):
+    # Memory plan from the header, before the track is decoded
+    memory_plan = plan_upload(audio_bytes)
+    return await _run_shared(audio_bytes, mime, analyze_shared_track, deadline, pressure, memory_plan)
+
+
+async def run_revision_in_processpool(audio_bytes: bytes, mime: str, track_id: str, previous_track_id: str = None):
+    return await _run_shared(audio_bytes, mime, analyze_shared_revision, track_id, previous_track_id)
+
+
+async def prewarm_pool():
+    """
+    Start every worker and wait for its warm-up, so the first request never hits a cold worker.
+    """
+    loop = asyncio.get_event_loop()
+    await asyncio.gather(*(
+        loop.run_in_executor(executor, is_warmed_up) for _ in range(MAX_WORKERS)
+    ))
+
+
+def shutdown_pool():
+    """
+    Stop the workers on server shutdown; otherwise they outlive the API process.
+    """
+    executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,85 @@
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from typing import NamedTuple
+
+import numpy as np
+
+
+"""
+
+Zero-copy handoff of decoded PCM to worker processes
+
+The parent process decodes the upload once and places the samples in a
+multiprocessing.shared_memory segment. Workers receive only the segment name,
+shape and dtype (a few bytes to pickle) and map the samples without copying.
+The parent owns the segment and unlinks it when the job ends, whether the
+worker returned, raised or crashed.
+
+"""
+
+
+class SharedPCM(NamedTuple):
+    name: str
+    shape: tuple
+    dtype: str
+    sr: int
+
+
+# --- PARENT SIDE ---
+
+@contextmanager
+def share_pcm(y: np.ndarray, sr: int):
+    """
+    Copy decoded audio into a new shared memory segment.
+
+    Args:
+        y: decoded audio array
+        sr: sample rate
+
+    Yields:
+        SharedPCM descriptor to pass to the worker
+    """
+    y = np.ascontiguousarray(y)
+    shm = shared_memory.SharedMemory(create=True, size=max(y.nbytes, 1))
+    try:
+        shared = np.ndarray(y.shape, dtype=y.dtype, buffer=shm.buf)
+        shared[...] = y
+        pcm = SharedPCM(name=shm.name, shape=tuple(y.shape), dtype=y.dtype.str, sr=int(sr))
+        del shared, y # don't keep the private copy alive for the duration of the job
+        yield pcm
+    finally:
+        # Runs after the job finished, failed or the worker died
+        shm.close()
+        shm.unlink()
+
+
+# --- WORKER SIDE ---
+
+@contextmanager
+def attach_pcm(pcm: SharedPCM):
+    """
+    Map a shared PCM segment as a read-only numpy array (no copy).
+
+    The array is only valid inside the with-block; do not keep references to it
+    (or views of it) in the returned results.
+
+    Args:
+        pcm: SharedPCM descriptor created by share_pcm
+
+    Yields:
+        (y, sr)
+    """
+    shm = shared_memory.SharedMemory(name=pcm.name)
+    y = np.ndarray(pcm.shape, dtype=np.dtype(pcm.dtype), buffer=shm.buf)
+    y.flags.writeable = False
+    try:
+        yield y, pcm.sr
+    finally:
+        del y
+        try:
+            shm.close()
+        except BufferError:
+            # A view of the buffer is still alive somewhere (e.g. in a traceback);
+            # the mapping is released when it is garbage collected and the parent
+            # unlinks the segment regardless.
+            pass
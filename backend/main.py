@@ -1,24 +1,116 @@
-from fastapi import FastAPI, UploadFile, File, Request, HTTPException
-from typing import Optional
+from fastapi import FastAPI, UploadFile, File, Form, Header, Request, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, FileResponse
+from typing import List, Optional
+from contextlib import asynccontextmanager
+from collections import OrderedDict
 from fastapi.middleware.cors import CORSMiddleware
-from slowapi import Limiter
-from slowapi.util import get_remote_address
 import asyncio
+import math
+import os
+import time
+import numpy as np
 
+# Must run before librosa/numba are imported
+from analysis.utils.numba_warmup import configure_numba_cache, warm_up
+configure_numba_cache()
 
 from analysis.llm.audio_analysis_generator import generate_report
-from pipeline.analyze_track_complete import analyze_uploaded_track_complete
+from analysis.utils.process_pool_executor import (
+    run_in_processpool,
+    run_revision_in_processpool,
+    prewarm_pool,
+    shutdown_pool,
+    MAX_WORKERS
+)
+from analysis.utils.admission_controller import (
+    AdmissionController,
+    AdmissionRejected,
+    estimate_request_cost
+)
+from analysis.audio.audio_probe import probe_audio, ProbeError
+from analysis.reference.reference_library import get_reference_library, ReferenceLibrary
+from analysis.reference.multi_reference import compare_references, target_profile_features
+from analysis.reference.reference_comparison import compare_tracks
+from analysis.audio.realtime_meter import RealtimeMeter
+from analysis.audio.waveform_peaks import get_waveform_store
+from analysis.utils.job_queue import create_broker, run_job
+from analysis.utils.helper import TRACK_ID_PATTERN
+from worker import AnalysisWorker
+from pipeline.stage_scheduler import DEFAULT_DEADLINE_S, REPORT_RESERVE_S
+
+
+# --- ANALYSIS BACKEND ---
+
+# pool: analysis in this process's worker pool
+# local: same, but through the job queue protocol (in-process broker and worker)
+# redis: jobs go to a Redis-compatible queue served by worker.py nodes; this process stays thin
+ANALYSIS_BACKEND = os.getenv("ANALYSIS_BACKEND", "pool")
+broker = None if ANALYSIS_BACKEND == "pool" else create_broker(ANALYSIS_BACKEND)
+
+
+async def analyze_audio(audio_bytes: bytes, mime: str, deadline: float = None, pressure: float = 0.0):
+    if broker is None:
+        return await run_in_processpool(audio_bytes, mime, deadline, pressure)
+    return await run_job(broker, "analyze", audio_bytes, mime, deadline=deadline, pressure=pressure)
 
-app = FastAPI()
 
+async def analyze_revision_audio(audio_bytes: bytes, mime: str, track_id: str, previous_track_id: str = None):
+    if broker is None:
+        return await run_revision_in_processpool(audio_bytes, mime, track_id, previous_track_id)
+    return await run_job(broker, "revision", audio_bytes, mime, track_id=track_id, previous_track_id=previous_track_id)
+
+
+# --- STARTUP WARM-UP ---
+
+analysis_ready = False
+
+
+async def warm_up_analysis():
+    """
+    Compile (or load from the numba cache) every JIT path, then start the pool workers.
+    Runs in the background while the server is already up; /ready reports 503 until it is done.
+    """
+    global analysis_ready
+    try:
+        # Forked workers inherit the compiled code, spawned ones load it from the cache
+        await asyncio.to_thread(warm_up)
+        await prewarm_pool()
+    except Exception as e:
+        print(f"Error in warm-up: {e}")
+        return
+    analysis_ready = True
 
-limiter = Limiter(key_func=get_remote_address)
-app.state.limiter = limiter
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if ANALYSIS_BACKEND == "redis":
+        # Analysis runs on the worker nodes: nothing to compile or start here
+        yield
+        await broker.close()
+        return
+
+    warm_up_task = asyncio.create_task(warm_up_analysis())
+    local_worker = None
+    if ANALYSIS_BACKEND == "local":
+        local_worker = AnalysisWorker(broker, MAX_WORKERS)
+        local_worker_task = asyncio.create_task(local_worker.run())
+    yield
+    warm_up_task.cancel()
+    if local_worker:
+        local_worker.stop()
+        await local_worker_task
+    shutdown_pool()
+
+app = FastAPI(lifespan=lifespan)
+
+
+# Replaces the flat per-IP request limit: requests are priced by how much audio they carry
+admission = AdmissionController(workers=MAX_WORKERS)
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins = ['http://localhost:5173'],
-    allow_methods = ['POST'],
+    allow_methods = ['GET', 'POST'],
     allow_headers = ['*']
 )
 
@@ -28,60 +120,213 @@ MAX_FILE_SIZE_MB = 110
 MAX_FILE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
 
 
-# --- SET ALLOWED AUDIO TYPES ---
+# --- SET AUDIO LIMITS (checked on the header probe, before decoding) ---
+
+MAX_DURATION_S = 30 * 60
+MIN_SAMPLE_RATE = 8000
+MAX_SAMPLE_RATE = 384000
+MAX_CHANNELS = 8
+
+
+# --- REFERENCE LIBRARY ADMIN TOKEN (ingest is disabled when unset) ---
+
+REFERENCE_ADMIN_TOKEN = os.getenv("REFERENCE_ADMIN_TOKEN")
+
+
+# --- REFERENCES PER REQUEST ---
+
+MAX_REFERENCES = int(os.getenv("MAX_REFERENCES", "8"))
+REFERENCE_CACHE_SIZE = 64 # uploaded references kept (features only, by content id) for the next request
+reference_features_cache = OrderedDict()
+
 
-ALLOWED_TYPES = {"audio/wav", "audio/mpeg", "audio/ogg", "audio/flac", "audio/x-wav" }
+def remember_reference_features(content_id: str, features: dict):
+    reference_features_cache[content_id] = features
+    reference_features_cache.move_to_end(content_id)
+    while len(reference_features_cache) > REFERENCE_CACHE_SIZE:
+        reference_features_cache.popitem(last=False)
 
 
+# --- REAL-TIME METER LIMITS ---
+
+METER_MAX_SESSIONS = int(os.getenv("METER_MAX_SESSIONS", "64"))
+METER_MAX_FRAME_S = 1.0 # longest PCM frame accepted in one message
+METER_FORMATS = {"f32": np.dtype("<f4"), "s16": np.dtype("<i2")}
+meter_sessions = 0
+
+
+
+
+# --- HELPERS ---
+
+def get_client_id(request: Request):
+    return request.client.host if request.client else "unknown"
+
+
+def validate_upload(audio_bytes: bytes, label: str):
+    """
+    Reject oversized, unsupported or absurd files from their header alone.
+    The format comes from the file's magic bytes, never from the client content_type.
+
+    Returns:
+        The header probe (format, mime_type, duration_s, sample_rate, channels, bit_depth)
+    """
+    if len(audio_bytes) > MAX_FILE_BYTES:
+        raise HTTPException(status_code=400, detail=f"{label} file too large. Max is {MAX_FILE_SIZE_MB} MB.")
+
+    try:
+        probe = probe_audio(audio_bytes)
+    except ProbeError as e:
+        raise HTTPException(status_code=400, detail=f"{label} file unsupported audio format: {e}")
+
+    if probe["duration_s"] <= 0:
+        raise HTTPException(status_code=400, detail=f"{label} file contains no audio.")
+    if probe["duration_s"] > MAX_DURATION_S:
+        raise HTTPException(status_code=400, detail=f"{label} file too long. Max is {MAX_DURATION_S // 60} minutes.")
+    if not MIN_SAMPLE_RATE <= probe["sample_rate"] <= MAX_SAMPLE_RATE:
+        raise HTTPException(status_code=400, detail=f"{label} file has an unsupported sample rate ({probe['sample_rate']} Hz).")
+    if not 1 <= probe["channels"] <= MAX_CHANNELS:
+        raise HTTPException(status_code=400, detail=f"{label} file has an unsupported channel count ({probe['channels']}).")
+
+    return probe
 
 
 # --- ENDPOINTS ---
 
+@app.get("/ready")
+async def ready():
+    # A thin API node is ready once it reaches the queue
+    if ANALYSIS_BACKEND == "redis":
+        try:
+            stats = await broker.stats()
+        except Exception:
+            return JSONResponse(status_code=503, content={"status": "queue_unreachable"})
+        return {"status": "ready", "queue": stats}
+
+    # Load balancers should only route to workers that finished the JIT warm-up
+    if not analysis_ready:
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    return {"status": "ready"}
+
+
 @app.post("/analyze_and_report")
-@limiter.limit("5/minute") # Limit amount of request per IP
 async def analyze(
     request: Request, 
+    response: Response,
     main_audio_file: UploadFile = File(...), 
-    ref_audio_file: Optional[UploadFile] = File (None)
+    ref_audio_file: Optional[List[UploadFile]] = File (None),
+    ref_id: Optional[List[str]] = Form(None),
+    x_analysis_deadline: Optional[float] = Header(None)
     ):
 
-    # Read files async
+    # Whole-request time budget (X-Analysis-Deadline, seconds); analysis gets what the report does not need
+    arrival = time.time()
+    deadline_s = x_analysis_deadline if x_analysis_deadline and x_analysis_deadline > 0 else DEFAULT_DEADLINE_S
+    analysis_deadline = arrival + max(0.0, deadline_s - REPORT_RESERVE_S)
+
+    # Read files async (any number of references: repeat ref_audio_file / ref_id)
     try:
         main_audio_bytes = await main_audio_file.read()
-        ref_audio_bytes = await ref_audio_file.read() if ref_audio_file else None
+        ref_uploads = [(upload.filename, await upload.read()) for upload in ref_audio_file or []]
 
     except Exception as e:
         print(f"Error in converting files: {e}")
+        raise HTTPException(status_code=400, detail="Uploaded files could not be read.")
 
-    # Validate uploaded files
-    try:
-        if len(main_audio_bytes) > MAX_FILE_BYTES:
-            raise HTTPException(status_code=400, detail=f"Main file too large. Max is {MAX_FILE_SIZE_MB} MB.")
-        
-        if ref_audio_bytes and len(ref_audio_bytes) > MAX_FILE_BYTES:
-            raise HTTPException(status_code=400, detail=f"Reference file too large. Max is {MAX_FILE_SIZE_MB} MB.")
-        
-        if main_audio_file.content_type not in ALLOWED_TYPES:
-            raise HTTPException(status_code=400, detail="Main file unsupported audio format")
-        
-        if ref_audio_file and ref_audio_file.content_type not in ALLOWED_TYPES:
-            raise HTTPException(status_code=400, detail="Reference file unsupported audio format")
-    except Exception as e:
-        print(f"Error in validating: {e}")
+    if len(ref_uploads) + len(ref_id or []) > MAX_REFERENCES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_REFERENCES} references per request.")
+
+    # Validate uploaded files from their headers (HTTPException propagates to the client)
+    main_probe = validate_upload(main_audio_bytes, "Main")
 
+    # References: library ids and previously analyzed uploads cost no analysis; duplicates are analyzed once
+    library = get_reference_library()
+    references = {}
+    for library_id in ref_id or []:
+        library_entry = library.get(library_id)
+        if library_entry is None:
+            raise HTTPException(status_code=404, detail=f"Unknown reference id '{library_id}'.")
+        references[library_id] = {"id": library_id, "name": library_entry["name"], "source": "library", "features": library_entry["features"]}
+
+    to_analyze = {}
+    for filename, ref_audio_bytes in ref_uploads:
+        content_id = ReferenceLibrary.make_id(ref_audio_bytes)
+        if content_id in references or content_id in to_analyze:
+            continue
+        name = os.path.splitext(filename or content_id)[0]
+        library_entry = library.get(content_id)
+        cached = library_entry["features"] if library_entry else reference_features_cache.get(content_id)
+        if library_entry is not None:
+            references[content_id] = {"id": content_id, "name": name, "source": "library", "features": cached}
+        elif cached is not None:
+            references[content_id] = {"id": content_id, "name": name, "source": "cache", "features": cached}
+        else:
+            probe = validate_upload(ref_audio_bytes, f"Reference '{name}'")
+            to_analyze[content_id] = (name, ref_audio_bytes, probe)
+
+
+    # Price the request (CPU-seconds and audio-seconds) before doing any decoding
+    cpu_cost, audio_seconds = estimate_request_cost(main_probe, [probe for _, _, probe in to_analyze.values()], wants_report=True)
+
+    # Stage durations, reported in the Server-Timing header (used by tools/load_test.py)
+    stage_start = time.perf_counter()
+    timings = {}
 
-    # Generates features for uploaded tracks
-    # Run CPU-bound analysis in separate threads
     try:
-        features, ref_features = await asyncio.gather(
-            asyncio.to_thread(analyze_uploaded_track_complete, main_audio_bytes, main_audio_file.content_type),
-            asyncio.to_thread(analyze_uploaded_track_complete, ref_audio_bytes, ref_audio_file.content_type) if ref_audio_file else asyncio.sleep(0, result=None)
-        )
-    except Exception as e:
-        print(f"Error in generating features: {e}")
+        async with admission.admit(get_client_id(request), cpu_cost, audio_seconds):
+            timings["queue"] = time.perf_counter() - stage_start
+            # Requests still queued behind this one, per worker: the stage scheduler degrades optional stages under load
+            pressure = admission.queue_depth / admission.workers
 
-    # Generate AI report
-    report = generate_report(features, ref_features)
+            # Generates features for uploaded tracks: the main track once, new references in parallel
+            # Run CPU-bound analysis in worker processes (decoded PCM is handed over via shared memory)
+            try:
+                features, *analyzed = await asyncio.gather(
+                    analyze_audio(main_audio_bytes, main_probe["mime_type"], analysis_deadline, pressure),
+                    *(analyze_audio(ref_audio_bytes, probe["mime_type"], analysis_deadline, pressure) for _, ref_audio_bytes, probe in to_analyze.values())
+                )
+            except Exception as e:
+                print(f"Error in generating features: {e}")
+                raise HTTPException(status_code=422, detail="Audio could not be analyzed.")
+            timings["analysis"] = time.perf_counter() - stage_start - timings["queue"]
+
+            if features is None:
+                raise HTTPException(status_code=422, detail="Main file could not be analyzed.")
+
+            for (content_id, (name, _, _)), ref_features in zip(to_analyze.items(), analyzed):
+                if ref_features is None:
+                    raise HTTPException(status_code=422, detail=f"Reference '{name}' could not be analyzed.")
+                references[content_id] = {"id": content_id, "name": name, "source": "upload", "features": ref_features}
+                if not ref_features.get("degraded"):
+                    remember_reference_features(content_id, ref_features)
+
+            # Several references: compare in one vectorized pass, the report compares against their median profile
+            references = list(references.values())
+            reference_comparison = compare_references(features, references) if references else None
+            if len(references) > 1:
+                ref_features = target_profile_features(reference_comparison["target_profile"], references)
+            else:
+                ref_features = references[0]["features"] if references else None
+
+            # Exact deltas against the reference (or target profile), so the LLM only has to put them in words
+            reference_deltas = compare_tracks(features, ref_features) if ref_features is not None else None
+
+            # Generate AI report (blocking HTTP call: keep it off the event loop)
+            # If the LLM fails (e.g. every section request in sections mode), the analysis is still returned
+            report, report_error = None, None
+            try:
+                report = await asyncio.to_thread(generate_report, features, ref_features, comparison=reference_deltas)
+            except Exception as e:
+                print(f"Error in generating report: {e}")
+                report_error = "The report could not be generated; the analysis is complete."
+            timings["report"] = time.perf_counter() - stage_start - timings["queue"] - timings["analysis"]
+
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.reason,
+            headers={"Retry-After": str(e.retry_after)}
+        )
 
 
     print(f"\n{'+'*50}")
@@ -92,4 +337,202 @@ async def analyze(
     print(f"AI REPORT:")
     print(report)
     print(f"\n{'+'*50}")
-    return {"features": features, "ref_features": ref_features, "report": report}
+
+    response.headers["Server-Timing"] = ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+    return {
+        "features": features,
+        # The reference (or median target profile) the report and reference_deltas were computed against
+        "ref_features": ref_features,
+        "references": references,
+        "reference_comparison": reference_comparison,
+        "reference_deltas": reference_deltas,
+        "report": report,
+        "report_error": report_error
+    }
+
+
+
+@app.post("/analyze_revision")
+async def analyze_revision_endpoint(
+    request: Request,
+    main_audio_file: UploadFile = File(...),
+    previous_track_id: Optional[str] = Form(None)
+    ):
+
+    # Incremental analysis of a revised mix: only chunks that changed since any
+    # earlier upload are recomputed, and the diff against previous_track_id is returned
+    if previous_track_id is not None and not TRACK_ID_PATTERN.match(previous_track_id):
+        raise HTTPException(status_code=400, detail="Invalid previous_track_id.")
+
+    main_audio_bytes = await main_audio_file.read()
+    main_probe = validate_upload(main_audio_bytes, "Main")
+    track_id = ReferenceLibrary.make_id(main_audio_bytes)
+    cpu_cost, audio_seconds = estimate_request_cost(main_probe, None, wants_report=False)
+
+    try:
+        async with admission.admit(get_client_id(request), cpu_cost, audio_seconds):
+            result = await analyze_revision_audio(main_audio_bytes, main_probe["mime_type"], track_id, previous_track_id)
+            # Raised inside admit, so the client's audio-seconds are refunded
+            if result is None:
+                raise HTTPException(status_code=422, detail="Main file could not be analyzed.")
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.reason,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+    return result
+
+
+@app.websocket("/ws/meter")
+async def realtime_meter(websocket: WebSocket):
+
+    # Protocol:
+    #   client -> {"sample_rate": 48000, "channels": 2, "format": "f32" | "s16"}   (text, once)
+    #   server -> {"status": "ready"}
+    #   client -> interleaved little-endian PCM                                 (binary, repeated)
+    #   server -> meter reading, after every frame that completes a 100 ms sub-block
+    # Metering is a few hundred microseconds per frame, so it runs inline on the event loop
+    global meter_sessions
+    await websocket.accept()
+    if meter_sessions >= METER_MAX_SESSIONS:
+        await websocket.close(code=1013, reason="Too many meter sessions.")
+        return
+
+    meter_sessions += 1
+    try:
+        config = await websocket.receive_json()
+        sr = int(config.get("sample_rate", 0))
+        channels = int(config.get("channels", 2))
+        dtype = METER_FORMATS.get(config.get("format", "f32"))
+        if not MIN_SAMPLE_RATE <= sr <= MAX_SAMPLE_RATE or channels not in (1, 2) or dtype is None:
+            await websocket.close(code=1003, reason="Unsupported stream format.")
+            return
+
+        meter = RealtimeMeter(sr, channels)
+        scale = 1.0 / 32768 if dtype.kind == "i" else 1.0
+        max_frame_bytes = int(METER_MAX_FRAME_S * sr) * channels * dtype.itemsize
+        await websocket.send_json({"status": "ready"})
+
+        while True:
+            frame = await websocket.receive_bytes()
+            if len(frame) > max_frame_bytes or len(frame) % (channels * dtype.itemsize):
+                await websocket.close(code=1009, reason="Bad PCM frame size.")
+                return
+
+            samples = np.frombuffer(frame, dtype=dtype).reshape(-1, channels).T * scale
+            reading = meter.push(samples)
+            if reading is not None:
+                # -inf (silence) is not valid JSON
+                await websocket.send_json({
+                    key: None if isinstance(value, float) and not math.isfinite(value) else value
+                    for key, value in reading.items()
+                })
+
+    except WebSocketDisconnect:
+        pass
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Error in meter session: {e}")
+        await websocket.close(code=1003, reason="Bad meter message.")
+    finally:
+        meter_sessions -= 1
+
+
+# --- WAVEFORM PEAKS ---
+
+def get_waveform_index(track_id: str):
+    index = get_waveform_store().get_index(track_id) if TRACK_ID_PATTERN.match(track_id) else None
+    if index is None:
+        raise HTTPException(status_code=404, detail=f"No waveform for track '{track_id}'.")
+    return index
+
+
+@app.get("/waveform/{track_id}")
+async def waveform_index(track_id: str):
+    # Levels, byte offsets and encoding of the peak pyramid (tracks are immutable: cache forever)
+    return JSONResponse(get_waveform_index(track_id), headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+
+@app.get("/waveform/{track_id}/data")
+async def waveform_data(track_id: str):
+    # All levels back to back; clients fetch a level (or a time window of it) with a Range header
+    get_waveform_index(track_id)
+    return FileResponse(
+        get_waveform_store().data_path(track_id),
+        media_type="application/octet-stream",
+        headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
+
+
+# --- REFERENCE LIBRARY ---
+
+@app.get("/references")
+async def list_references():
+    return {"references": get_reference_library().list()}
+
+
+@app.post("/references")
+async def ingest_reference(
+    request: Request,
+    audio_file: UploadFile = File(...),
+    name: Optional[str] = Form(None),
+    genre: Optional[str] = Form(None),
+    x_admin_token: Optional[str] = Header(None)
+    ):
+
+    # Admin only: references are analyzed once here and reused by every client
+    if not REFERENCE_ADMIN_TOKEN or x_admin_token != REFERENCE_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Reference ingest not allowed.")
+
+    audio_bytes = await audio_file.read()
+    probe = validate_upload(audio_bytes, "Reference")
+
+    library = get_reference_library()
+    ref_id = ReferenceLibrary.make_id(audio_bytes)
+    if ref_id in library:
+        entry = library.get(ref_id)
+        return {"id": ref_id, "name": entry["name"], "created": False}
+
+    features = await analyze_audio(audio_bytes, probe["mime_type"])
+    if features is None:
+        raise HTTPException(status_code=422, detail="Reference could not be analyzed.")
+
+    name = name or os.path.splitext(audio_file.filename or ref_id)[0]
+    metadata = {"genre": genre, "format": probe["format"], "duration_s": probe["duration_s"], "sample_rate": probe["sample_rate"]}
+    library.add(ref_id, name, features, metadata)
+    return {"id": ref_id, "name": name, "created": True}
+
+
+@app.post("/references/match")
+async def match_references(
+    request: Request,
+    main_audio_file: UploadFile = File(...),
+    k: int = Form(5)
+    ):
+
+    # Top-k library references closest to the mix: by metrics (tonal balance, loudness, width)
+    # and by embedding similarity
+    main_audio_bytes = await main_audio_file.read()
+    main_probe = validate_upload(main_audio_bytes, "Main")
+    cpu_cost, audio_seconds = estimate_request_cost(main_probe, None, wants_report=False)
+
+    try:
+        async with admission.admit(get_client_id(request), cpu_cost, audio_seconds):
+            features = await analyze_audio(main_audio_bytes, main_probe["mime_type"])
+            if features is None:
+                raise HTTPException(status_code=422, detail="Main file could not be analyzed.")
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.reason,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+    k = max(1, min(k, 50))
+    library = get_reference_library()
+    return {
+        "features": features,
+        "matches": library.nearest(features, k=k),
+        "similar": library.similar(features.get("embedding"), k=k)
+    }
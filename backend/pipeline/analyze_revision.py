@@ -0,0 +1,171 @@
+from analysis.audio.chunk_aggregates import (
+    chunk_length,
+    split_chunks,
+    chunk_hash,
+    compute_chunk_aggregate,
+    merge_chunk_aggregates,
+    chunk_summary
+)
+from analysis.utils.chunk_cache import ChunkCache, get_chunk_cache
+import time
+import numpy as np
+
+
+# Metrics compared between revisions
+DIFF_METRICS = [
+    "loudness_lufs",
+    "rms_db",
+    "peak_db",
+    "true_peak_db",
+    "crest_factor_db",
+    "dynamic_range_db",
+    "correlation",
+    "ms_side_fraction",
+    "lr_balance",
+    "transient_density",
+]
+
+
+def revision_diff(previous: dict, current: dict):
+    """
+    Compare two track manifests chunk by chunk.
+
+    Arguments:
+        previous: manifest of the earlier revision
+        current: manifest of the new revision
+
+    Return:
+        Dictionary with changed time ranges, per-chunk metric moves and track-level deltas
+    """
+    chunk_s = current["chunk_s"]
+    prev_hashes, curr_hashes = previous["chunk_hashes"], current["chunk_hashes"]
+
+    changed = [
+        i for i in range(len(curr_hashes))
+        if i >= len(prev_hashes) or prev_hashes[i] != curr_hashes[i]
+    ]
+
+    # Merge consecutive changed chunks into time ranges
+    changed_ranges = []
+    for i in changed:
+        start, end = i * chunk_s, min((i + 1) * chunk_s, current["metrics"]["duration_s"])
+        if changed_ranges and abs(changed_ranges[-1]["end_s"] - start) < 1e-6:
+            changed_ranges[-1]["end_s"] = round(end, 2)
+        else:
+            changed_ranges.append({"start_s": round(start, 2), "end_s": round(end, 2)})
+
+    chunk_changes = []
+    for i in changed:
+        if i >= len(previous["chunk_summaries"]):
+            continue
+        before, after = previous["chunk_summaries"][i], current["chunk_summaries"][i]
+        chunk_changes.append({
+            "start_s": round(i * chunk_s, 2),
+            **{f"{key}_delta": round(after[key] - before[key], 4) for key in before}
+        })
+
+    prev_metrics, curr_metrics = previous["metrics"], current["metrics"]
+    metric_deltas = {
+        key: round(curr_metrics[key] - prev_metrics[key], 4)
+        for key in DIFF_METRICS
+        if np.isfinite(curr_metrics[key]) and np.isfinite(prev_metrics[key])
+    }
+    metric_deltas["energy_bands_db"] = {
+        band: round(float(10 * np.log10((curr_metrics["energy_bands"][band] + 1e-12) / (prev_metrics["energy_bands"][band] + 1e-12))), 2)
+        for band in curr_metrics["energy_bands"]
+    }
+
+    return {
+        "previous_track_id": previous["track_id"],
+        "changed_fraction": round(len(changed) / max(1, len(curr_hashes)), 4),
+        "changed_ranges": changed_ranges,
+        "chunk_changes": chunk_changes,
+        "metric_deltas": metric_deltas,
+        "length_change_s": round(curr_metrics["duration_s"] - prev_metrics["duration_s"], 2),
+    }
+
+
+def analyze_revision(y_stereo, sr: int, track_id: str, previous_track_id: str = None, cache: ChunkCache = None):
+    """
+    Incremental analysis: only chunks whose hash is not cached are recomputed.
+
+    Arguments:
+        y_stereo: decoded audio, shape (channels, samples) or (samples,)
+        sr: sample rate
+        track_id: id of this revision (content hash of the upload)
+        previous_track_id: id of the revision to diff against (optional)
+        cache: chunk cache (defaults to the process-wide cache)
+
+    Return:
+        Dictionary with merged metrics, cache statistics and the revision diff
+    """
+
+    start_time = time.time()
+    cache = cache or get_chunk_cache()
+
+    y_stereo = np.asarray(y_stereo)
+    if y_stereo.ndim == 1:
+        y_stereo = np.vstack([y_stereo, y_stereo])
+
+
+    # --- CHUNK AGGREGATES (cached by content hash) ---
+
+    hashes, aggregates, summaries = [], [], []
+    recomputed = 0
+    for start, chunk, preroll, postroll in split_chunks(y_stereo, sr):
+        h = chunk_hash(chunk, sr, preroll, postroll, start)
+        aggregate = cache.get(h)
+        if aggregate is None:
+            aggregate = compute_chunk_aggregate(chunk, sr, preroll, postroll, start)
+            cache.put(h, aggregate)
+            recomputed += 1
+        hashes.append(h)
+        aggregates.append(aggregate)
+        summaries.append(chunk_summary(aggregate, sr))
+
+
+    # --- MERGE ---
+
+    metrics = merge_chunk_aggregates(aggregates, sr)
+    chunk_s = chunk_length(sr) / sr
+    manifest = {
+        "track_id": track_id,
+        "sample_rate": sr,
+        "chunk_s": chunk_s,
+        "chunk_hashes": hashes,
+        "chunk_summaries": summaries,
+        "metrics": metrics,
+    }
+
+
+    # --- REVISION DIFF ---
+
+    diff = None
+    if metrics is None:
+        diff = {"error": "Empty audio"}
+    elif previous_track_id:
+        try:
+            previous = cache.load_manifest(previous_track_id)
+        except ValueError:
+            previous = None
+        if previous is None:
+            diff = {"error": f"Unknown previous revision '{previous_track_id}'"}
+        elif previous["sample_rate"] != sr:
+            diff = {"error": "Revisions have different sample rates; chunks are not comparable"}
+        else:
+            diff = revision_diff(previous, manifest)
+
+    cache.save_manifest(track_id, manifest)
+
+    elapsed_time = time.time() - start_time
+    print(f"\n{'='*50}")
+    print(f"Incremental analysis: {recomputed}/{len(hashes)} chunks recomputed in {elapsed_time:.2f} seconds.")
+    print(f"\n{'='*50}")
+
+    return {
+        "track_id": track_id,
+        "metrics": metrics,
+        "chunks_total": len(hashes),
+        "chunks_recomputed": recomputed,
+        "revision_diff": diff,
+    }
@@ -2,23 +2,50 @@ from analysis.audio.audio_features import (
     load_audio,
     get_tempo_features, 
     get_loudness_features, 
+    get_loudness_features_chunked,
     get_frequency_spectrum_energy,
+    get_frequency_spectrum_energy_low_memory,
     get_transient_features, 
     get_stereo_imaging_features
 )
 from analysis.audio.audio_converter import convert_to_wav_in_memory
+from analysis.audio.sample_rate_policy import AnalysisSignals, SPECTROGRAM_N_FFT, SPECTROGRAM_HOP_LENGTH
+from analysis.audio.octave_spectrum import get_octave_spectrum
+from analysis.audio.structure_segmentation import get_section_features
+from analysis.audio.waveform_peaks import get_waveform_store
+from analysis.audio.audio_embeddings import compute_embedding
+from analysis.utils.memory_budget import (
+    plan_analysis,
+    plan_upload,
+    PeakMemoryTracker,
+    LOW_MEMORY_CHUNK_S,
+    LOW_MEMORY_TEMPO_SR,
+    LOW_MEMORY_TRANSIENT_S,
+    TRANSIENT_MAX_S
+)
+from pipeline.stage_scheduler import (
+    StageScheduler,
+    estimate_stage_costs,
+    STAGES,
+    APPROX_TRANSIENT_S,
+    APPROX_STEREO_S
+)
 import time
 import librosa
 
     
-def analyze_uploaded_track_complete(audio_bytes: bytes, mime_type: str):
-    """
-    Extract ALL features in one pass.
-    Loads audio only once per sample rate needed.
+def decode_track(audio_bytes: bytes, mime_type: str, waveform_id: str = None):
     """
+    Convert uploaded audio to WAV and decode it to a float32 stereo array.
 
-    start_time = time.time()
+    Arguments:
+        audio_bytes: raw audio file bytes
+        mime_type: MIME type of the audio file
+        waveform_id: if given, the waveform peak pyramid is stored under this id while the PCM is at hand
 
+    Return:
+        (y_stereo, sr), or (None, None) if the file could not be decoded
+    """
 
     # --- CONVERT AUDIO TO WAV ---
 
@@ -28,8 +55,8 @@ def analyze_uploaded_track_complete(audio_bytes: bytes, mime_type: str):
         wav_bytes = convert_to_wav_in_memory(audio_bytes, mime_type)
     except ValueError as e:
         print(f"Skipping conversion: {e}")
-        wav_bytes = None # mark as unavailable
-    
+        return None, None
+
     conversion_time = time.time() - single_time
     print(f"\n{'='*50}")
     print(f"Audio conversion to WAV took {conversion_time:.2f} seconds.")
@@ -37,140 +64,288 @@ def analyze_uploaded_track_complete(audio_bytes: bytes, mime_type: str):
 
 
     # --- LOAD AUDIO ---
-    try:
 
+    try:
         # Load audio in stereo
         y_stereo, sr_stereo = load_audio(wav_bytes, sr=None, mono=False)
-        # Load audio in mono
-        y_mono = librosa.to_mono(y_stereo)
-        sr_mono = sr_stereo
-        # Load audio for harmonic_features
-        # y_harmonic = librosa.resample(y_mono, orig_sr=sr_mono, target_sr=22050)
-        # sr_harmonic = 22050
-        # Calculate onset
-        onset_env = librosa.onset.onset_strength(y=y_mono, sr=sr_mono)
-
     except Exception as e:
         print(f"Failed to load audio: {e}")
+        return None, None
 
 
-    # --- TEMPO FEATURES ---
+    # --- WAVEFORM PEAKS ---
 
-    tempo_features = None
-    if wav_bytes:
+    if waveform_id:
         single_time = time.time()
         try:
-            tempo_features = get_tempo_features(y_mono, sr_mono, onset_env=onset_env)
+            get_waveform_store().put(waveform_id, y_stereo, sr_stereo)
         except Exception as e:
-            print(f"Skipping tempo features: {e}")
-        tempo_time = time.time() - single_time
+            print(f"Skipping waveform peaks: {e}")
         print(f"\n{'='*50}")
-        print("TEMPO FEATURES")
-        print(tempo_features)
-        print(f"Tempo feature extraction took {tempo_time:.2f} seconds.")
+        print(f"Waveform peaks took {time.time() - single_time:.2f} seconds.")
         print(f"\n{'='*50}")
 
+    return y_stereo, sr_stereo
 
-    # --- LOUDNESS FEATURES ---
 
-    loudness_features = None
-    if wav_bytes:
-        single_time = time.time()
+def analyze_uploaded_track_complete(audio_bytes: bytes, mime_type: str):
+    """
+    Extract ALL features in one pass.
+    Loads audio only once per sample rate needed.
+    """
 
-        try:
-            loudness_features = get_loudness_features(y_stereo, sr_stereo)
-        except Exception as e:
-            print(f"Skipping loudness features: {e}")
-        loudness_time = time.time() - single_time
+    start_time = time.time()
+
+    # Memory plan from the header, before decoding allocates anything
+    memory_plan = plan_upload(audio_bytes)
+    y_stereo, sr_stereo = decode_track(audio_bytes, mime_type)
+    if y_stereo is None:
+        return None
+
+    return analyze_decoded_track(y_stereo, sr_stereo, start_time=start_time, memory_plan=memory_plan)
+
+
+def analyze_decoded_track(y_stereo, sr_stereo, start_time=None, deadline=None, pressure=0.0, memory_plan=None):
+    """
+    Extract ALL features from already decoded audio.
+
+    Arguments:
+        y_stereo: decoded audio, shape (channels, samples) or (samples,)
+        sr_stereo: sample rate
+        start_time: time the request started (defaults to now)
+        deadline: absolute time.time() the analysis should finish by (None = run every stage in full)
+        pressure: queued requests per worker when the request was admitted
+        memory_plan: plan_upload result made from the header before decoding
+            (None = plan from the decoded array)
+
+    Return:
+        Dictionary of features
+    """
+
+    start_time = start_time or time.time()
+
+    with PeakMemoryTracker() as memory:
+        features = _analyze_decoded_track(y_stereo, sr_stereo, start_time, deadline, pressure, memory_plan)
+    features["analysis_stats"]["memory"].update(memory.report())
+
+    print(f"\n{'='*50}")
+    print(f"Memory: estimated {features['analysis_stats']['memory']['estimated_analysis_peak_mb']} MB, measured {features['analysis_stats']['memory']['actual_peak_mb']} MB.")
+    print(f"\n{'='*50}")
+    return features
+
+
+def _analyze_decoded_track(y_stereo, sr_stereo, start_time, deadline, pressure, memory_plan):
+
+
+    # --- MEMORY PLAN ---
+
+    # Peak memory estimated from the header before decoding (or else from the track's shape);
+    # over budget -> chunked / decimated algorithms
+    channels, n_samples = (1, len(y_stereo)) if y_stereo.ndim == 1 else y_stereo.shape
+    memory_plan = memory_plan or plan_analysis(n_samples / sr_stereo, sr_stereo, channels)
+    low_memory = memory_plan["low_memory"]
+    if low_memory:
         print(f"\n{'='*50}")
-        print("LOUDNESS FEATURES")
-        print(loudness_features)
-        print(f"Loudness feature extraction took {loudness_time:.2f} seconds.")
+        print(f"Estimated peak {memory_plan['estimate']['peak_mb']} MB is over the {memory_plan['budget_mb']} MB budget: low-memory mode.")
         print(f"\n{'='*50}")
 
 
+    # --- PREPARE SIGNALS ---
+
+    # Loudness and true peak use the native rate; every other stage shares
+    # buffers resampled once to the analysis rate (or lower where allowed)
+    single_time = time.time()
+    signals = AnalysisSignals(
+        y_stereo, sr_stereo,
+        stage_rates={"tempo": LOW_MEMORY_TEMPO_SR} if low_memory else None,
+        spectrogram_chunk_s=LOW_MEMORY_CHUNK_S if low_memory else None
+    )
+    # Mono downmix at the analysis rate
+    y_mono = signals.mono()
+    sr_mono = signals.analysis_sr
+    # Tempo and transients run at their own (lower) rate
+    sr_tempo = signals.stage_sr("tempo")
+    y_tempo = signals.mono(sr_tempo)
+    sr_transient = signals.stage_sr("transient")
+    y_transient = signals.mono(sr_transient)
+    # Load audio for harmonic_features
+    # y_harmonic = signals.mono(22050)
+    # sr_harmonic = 22050
+    prepare_time = time.time() - single_time
+    print(f"\n{'='*50}")
+    print(f"Resampling {sr_stereo} Hz -> {sr_mono} Hz (tempo {sr_tempo} Hz, transients {sr_transient} Hz) took {prepare_time:.2f} seconds.")
+    print(f"\n{'='*50}")
+    # Calculate onset
+    onset_env = librosa.onset.onset_strength(y=y_tempo, sr=sr_tempo)
+
+
+    # --- STAGE SCHEDULE ---
+
+    # Deadline and queue pressure decide, stage by stage, between the full
+    # algorithm, a cheaper variant or skipping (optional stages only)
+    transient_max_s = LOW_MEMORY_TRANSIENT_S if low_memory else TRANSIENT_MAX_S
+    stage_costs, shared_costs = estimate_stage_costs(
+        n_samples / sr_stereo, sr_stereo, sr_mono, sr_tempo, sr_transient, transient_max_s, low_memory=low_memory
+    )
+    scheduler = StageScheduler(stage_costs, shared_costs, deadline=deadline, pressure=pressure)
+
+
+    # --- TEMPO FEATURES ---
+
+    def tempo_stage(variant):
+        return get_tempo_features(y_tempo, sr_tempo, onset_env=onset_env)
+
+
+    # --- LOUDNESS FEATURES ---
+
+    def loudness_stage(variant):
+        if low_memory:
+            return get_loudness_features_chunked(y_stereo, sr_stereo, chunk_s=LOW_MEMORY_CHUNK_S)
+        return get_loudness_features(y_stereo, sr_stereo)
+
+
     # --- TRANSIENT FEATURES ---
-    if loudness_features["dynamic_range_db"] < 8:
-        transient_features = None
-        if wav_bytes:
-            single_time = time.time()
-            try:
-                transient_features = get_transient_features(y_mono, sr_mono, max_duration=120)
-            except Exception as e:
-                print(f"Skipping transient features: {e}")
-            transient_time = time.time() - single_time
-            print(f"\n{'='*50}")
-            print("TRANSIENT FEATURES")
-            print(transient_features)
-            print(f"Transient feature extraction took {transient_time:.2f} seconds.")
-            print(f"\n{'='*50}")
-    else:
-        transient_features = {"note": "Transient features skipped."}
+
+    def transient_stage(variant):
+        max_duration = min(transient_max_s, APPROX_TRANSIENT_S) if variant == "approx" else transient_max_s
+        return get_transient_features(y_transient, sr_transient, max_duration=max_duration)
 
 
     # --- HARMONIC FEATURES --- (currently disabled) ---
 
     # harmonic_features = None
-    # if wav_bytes:
-    #     single_time = time.time()
-    #     try:
-    #         harmonic_features = get_harmonic_content_features(y_harmonic, sr_harmonic)
-    #     except Exception as e:
-    #         print(f"Skipping harmonic features: {e}")
-    #     harmonic_time = time.time() - single_time
-    #     print(f"\n{'='*50}")
-    #     print("HARMONIC FEATURES")
-    #     print(harmonic_features)
-    #     print(f"Harmonic content feature extraction took {harmonic_time:.2f} seconds.")
-    #     print(f"\n{'='*50}")
+    # single_time = time.time()
+    # try:
+    #     harmonic_features = get_harmonic_content_features(y_harmonic, sr_harmonic)
+    # except Exception as e:
+    #     print(f"Skipping harmonic features: {e}")
+    # harmonic_time = time.time() - single_time
+    # print(f"\n{'='*50}")
+    # print("HARMONIC FEATURES")
+    # print(harmonic_features)
+    # print(f"Harmonic content feature extraction took {harmonic_time:.2f} seconds.")
+    # print(f"\n{'='*50}")
 
 
     # --- FREQUENCY SPECTRUM ENERGY ---
 
-    frequency_spectrum_energy = None
-    if wav_bytes:
-        single_time = time.time()
-        try:
-            frequency_spectrum_energy = get_frequency_spectrum_energy(y_mono, sr_mono)
-        except Exception as e:
-            print(f"Skippin frequency spectrum features: {e}")
-        frequency_spectrum_time = time.time() - single_time
-        print(f"\n{'='*50}")
-        print("FREQUENCY SPECTRUM FEATURES")
-        print(frequency_spectrum_energy)
-        print(f"Frequency Spectrum extraction took {frequency_spectrum_time:.2f} seconds.")
-        print(f"\n{'='*50}")
+    def spectrum_stage(variant):
+        # Native rate: the tilt fit spans every bin up to Nyquist, so it depends on the sample rate
+        y_native = signals.mono(sr_stereo)
+        if low_memory:
+            return get_frequency_spectrum_energy_low_memory(y_native, sr_stereo)
+        return get_frequency_spectrum_energy(y_native, sr_stereo)
+
+
+    # --- FRACTIONAL-OCTAVE SPECTRUM ---
+
+    def octave_stage(variant):
+        return get_octave_spectrum(signals.power_spectrogram(), sr_mono, SPECTROGRAM_N_FFT)
 
 
     # --- STEREO IMAGE FEATURES ---
 
-    stereo_imaging_features = None
-    if wav_bytes:
+    def stereo_stage(variant):
+        y = signals.stereo()
+        if variant == "approx":
+            # Centre window of the track
+            window = int(APPROX_STEREO_S * sr_mono)
+            offset = max(0, (y.shape[-1] - window) // 2)
+            y = y[..., offset:offset + window]
+        return get_stereo_imaging_features(
+            y, sr_mono,
+            chunk_size=int(LOW_MEMORY_CHUNK_S * sr_mono) if low_memory else None
+        )
+
+
+    # --- SECTION FEATURES ---
+
+    def sections_stage(variant):
+        return get_section_features(
+            signals.power_spectrogram(), sr_mono, SPECTROGRAM_HOP_LENGTH, signals.stereo(),
+            onset_env=onset_env, onset_sr=sr_tempo
+        )
+
+
+    # --- EMBEDDING (similarity search) ---
+
+    def embedding_stage(variant):
+        return compute_embedding(signals.power_spectrogram(), sr_mono, SPECTROGRAM_N_FFT).tolist()
+
+
+    stage_functions = {
+        "tempo": ("TEMPO FEATURES", tempo_stage),
+        "loudness": ("LOUDNESS FEATURES", loudness_stage),
+        "transient": ("TRANSIENT FEATURES", transient_stage),
+        "spectrum": ("FREQUENCY SPECTRUM FEATURES", spectrum_stage),
+        "octave": ("FRACTIONAL-OCTAVE SPECTRUM", octave_stage),
+        "stereo": ("STEREO IMAGING FEATURES", stereo_stage),
+        "sections": ("SECTION FEATURES", sections_stage),
+        "embedding": ("EMBEDDING (incl. shared spectrogram)", embedding_stage),
+    }
+
+
+    # --- RUN STAGES ---
+
+    results = {STAGES[stage]["field"]: None for stage in stage_functions}
+
+    while (step := scheduler.next_stage()) is not None:
+        stage, variant = step
+        title, stage_function = stage_functions[stage]
+
         single_time = time.time()
         try:
-            stereo_imaging_features = get_stereo_imaging_features(y_stereo, sr_stereo)
+            results[STAGES[stage]["field"]] = stage_function(variant)
         except Exception as e:
-            print(f"Skipping stereo imaging feature: {e}")
-        stere_imaging_time = time.time() - single_time
+            print(f"Skipping {title.lower()}: {e}")
+        stage_time = time.time() - single_time
+        scheduler.finished(stage, variant, stage_time)
         print(f"\n{'='*50}")
-        print("STEREO IMAGING FEATURES")
-        print(stereo_imaging_features)
-        print(f"Stereo Imaging content feature extraction took {stere_imaging_time:.2f} seconds.")
+        print(title + (" (approximate)" if variant == "approx" else ""))
+        if stage not in ("embedding", "octave"):
+            print(results[STAGES[stage]["field"]])
+        print(f"{title.capitalize()} took {stage_time:.2f} seconds.")
         print(f"\n{'='*50}")
 
+        # Transients only matter for dense, compressed mixes
+        if stage == "loudness":
+            loudness_features = results["loudness_features"]
+            if not (loudness_features and loudness_features["dynamic_range_db"] < 8):
+                scheduler.drop("transient")
+                results["transient_features"] = {"note": "Transient features skipped."}
 
-        end_time = time.time()
-        elapsed_time = end_time - start_time
+    if scheduler.degraded:
         print(f"\n{'='*50}")
-        print(f"Analysis completed in {elapsed_time:.2f} seconds.")
+        print(f"Degraded under deadline / load: {scheduler.degraded}")
         print(f"\n{'='*50}")
 
-        return {
-            "tempo_features": tempo_features,
-            "loudness_features": loudness_features,
-            "transient_features": transient_features,
-            # "harmonic_features": harmonic_features,
-            "frequency_spectrum_energy": frequency_spectrum_energy,
-            "stereo_image_features": stereo_imaging_features
+
+    end_time = time.time()
+    elapsed_time = end_time - start_time
+    print(f"\n{'='*50}")
+    print(f"Analysis completed in {elapsed_time:.2f} seconds.")
+    print(f"\n{'='*50}")
+
+    return {
+        "tempo_features": results["tempo_features"],
+        "loudness_features": results["loudness_features"],
+        "transient_features": results["transient_features"],
+        # "harmonic_features": harmonic_features,
+        "frequency_spectrum_energy": results["frequency_spectrum_energy"],
+        "octave_spectrum": results["octave_spectrum"],
+        "stereo_image_features": results["stereo_image_features"],
+        "section_features": results["section_features"],
+        "embedding": results["embedding"],
+        # Fields computed approximately or not at all: {field: {"mode": ..., "reason": ...}}
+        "degraded": scheduler.degraded,
+        "analysis_stats": {
+            "memory": {
+                "low_memory_mode": low_memory,
+                "estimated_from": memory_plan["source"],
+                "budget_mb": memory_plan["budget_mb"],
+                "estimated_peak_mb": memory_plan["estimated_peak_mb"],
+                "estimated_analysis_peak_mb": memory_plan["estimated_analysis_peak_mb"],
+            },
+            "schedule": scheduler.report(),
         }
-        
\ No newline at end of file
+    }
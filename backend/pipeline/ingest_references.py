@@ -0,0 +1,77 @@
+import argparse
+import os
+import time
+
+# Must run before librosa/numba are imported
+from analysis.utils.numba_warmup import configure_numba_cache
+configure_numba_cache()
+
+from analysis.audio.audio_probe import probe_audio, ProbeError
+from analysis.reference.reference_library import ReferenceLibrary, REFERENCE_LIBRARY_DIR
+from pipeline.analyze_track_complete import analyze_uploaded_track_complete
+
+
+"""
+
+Ingest reference tracks into the reference library (run once per reference)
+
+    python -m pipeline.ingest_references path/to/ref1.wav path/to/ref2.flac --genre techno
+
+"""
+
+
+def ingest_reference(library: ReferenceLibrary, audio_bytes: bytes, name: str, metadata: dict = None, force: bool = False):
+    """
+    Analyze a reference track and store it in the library.
+
+    Args:
+        library: target ReferenceLibrary
+        audio_bytes: raw audio file bytes
+        name: display name
+        metadata: extra info stored with the entry (genre, artist, ...)
+        force: re-analyze even if the same file is already in the library
+
+    Returns:
+        The stored entry
+    """
+    ref_id = ReferenceLibrary.make_id(audio_bytes)
+    if ref_id in library and not force:
+        return library.get(ref_id)
+
+    probe = probe_audio(audio_bytes)
+    features = analyze_uploaded_track_complete(audio_bytes, probe["mime_type"])
+    if features is None:
+        raise ValueError(f"Could not analyze reference '{name}'")
+
+    metadata = {**(metadata or {}), "format": probe["format"], "duration_s": probe["duration_s"], "sample_rate": probe["sample_rate"]}
+    return library.add(ref_id, name, features, metadata)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest reference tracks into the reference library.")
+    parser.add_argument("files", nargs="+", help="audio files to ingest")
+    parser.add_argument("--library", default=REFERENCE_LIBRARY_DIR, help="library directory")
+    parser.add_argument("--genre", default=None, help="genre stored with every ingested reference")
+    parser.add_argument("--force", action="store_true", help="re-analyze files already in the library")
+    args = parser.parse_args()
+
+    library = ReferenceLibrary(args.library)
+    metadata = {"genre": args.genre} if args.genre else {}
+
+    for path in args.files:
+        start_time = time.time()
+        with open(path, "rb") as f:
+            audio_bytes = f.read()
+        name = os.path.splitext(os.path.basename(path))[0]
+        try:
+            entry = ingest_reference(library, audio_bytes, name, metadata, force=args.force)
+        except (ProbeError, ValueError) as e:
+            print(f"Skipping {path}: {e}")
+            continue
+        print(f"Ingested {name} as {entry['id']} in {time.time() - start_time:.2f} seconds.")
+
+    print(f"Library now holds {len(library)} references.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+
+Deadline-driven stage scheduling
+
+Each analysis gets a deadline (absolute wall-clock time) and the current
+queue pressure (queued requests per worker). Before every stage the scheduler
+picks the ready stage with the highest value per predicted CPU-second and a
+variant for it:
+
+    full        normal algorithm
+    approx      cheaper variant (shorter analysis window)
+    skip        not run (optional stages only)
+
+Required stages always run, approximated if the time left demands it, and the
+time they will need is reserved before optional stages are considered. An
+approximate variant is only offered once tools/validate_fast_modes.py passes
+for it. On 180 s tracks the centre-window stereo drifts up to ~0.13 width and
+the 30 s transient window ~2.8 % percussive energy, so both stay off unless
+listed in APPROX_STAGES (e.g. APPROX_STAGES=stereo,transient).
+Predictions are rescaled by how fast the stages already run actually went.
+Every approximated or skipped field is listed in the response's `degraded`
+map with the reason (deadline or load).
+
+"""
+
+import os
+import time
+
+
+# Default time budget for a whole request, and the part kept back for the LLM report
+DEFAULT_DEADLINE_S = float(os.getenv("ANALYSIS_DEADLINE_S", 60))
+REPORT_RESERVE_S = float(os.getenv("REPORT_RESERVE_S", 15))
+
+# Queued requests per worker from which optional stages are approximated / skipped (and required ones approximated)
+PRESSURE_APPROX = 1.0
+PRESSURE_SKIP = 2.0
+
+# Analysis windows of the approximate variants
+APPROX_TRANSIENT_S = 30
+APPROX_STEREO_S = 60
+# Stages allowed their approximate variant (comma-separated); add one once its
+# validate_fast_modes case (stereo_window, transient_window) passes
+APPROX_STAGES = {stage.strip() for stage in os.getenv("APPROX_STAGES", "").split(",") if stage.strip()}
+
+# value: how much the field is worth to the report (0-10)
+STAGES = {
+    "loudness": {"field": "loudness_features", "value": 10, "required": True},
+    "spectrum": {"field": "frequency_spectrum_energy", "value": 9, "required": True},
+    "stereo": {"field": "stereo_image_features", "value": 8, "required": True},
+    "tempo": {"field": "tempo_features", "value": 6},
+    "transient": {"field": "transient_features", "value": 4, "after": ["loudness"]},
+    "octave": {"field": "octave_spectrum", "value": 5, "shares": "spectrogram"},
+    "sections": {"field": "section_features", "value": 3, "shares": "spectrogram"},
+    "embedding": {"field": "embedding", "value": 2, "shares": "spectrogram"},
+}
+
+# CPU-seconds per million samples at the rate each stage runs at, measured on the full pipeline
+CPU_S_PER_MSAMPLE = {
+    "loudness": 0.15,        # native rate, stereo frames
+    "spectrum": 0.14,        # native rate (0.063 for the low-memory FFT)
+    "stereo": 0.15,          # analysis rate
+    "tempo": 0.17,           # tempo rate
+    "transient": 3.3,        # transient rate, analysis window only (HPSS)
+    "spectrogram": 0.054,    # analysis rate, shared by octave spectrum, sections and embedding
+    "octave": 0.013,         # analysis rate
+    "sections": 0.023,       # analysis rate
+    "embedding": 0.004,      # analysis rate
+}
+
+
+def estimate_stage_costs(duration_s: float, native_sr: int, analysis_sr: int, tempo_sr: int, transient_sr: int, transient_max_s: float, low_memory: bool = False):
+    """
+    Predicted CPU-seconds of each stage variant.
+
+    Returns:
+        ({stage: {"full": seconds, "approx": seconds or None}}, {shared work: seconds})
+    """
+    ms = lambda seconds, sr: seconds * sr / 1e6
+    spectrogram = CPU_S_PER_MSAMPLE["spectrogram"] * ms(duration_s, analysis_sr)
+
+    costs = {
+        "loudness": {"full": CPU_S_PER_MSAMPLE["loudness"] * ms(duration_s, native_sr), "approx": None},
+        "spectrum": {"full": (0.063 if low_memory else CPU_S_PER_MSAMPLE["spectrum"]) * ms(duration_s, native_sr), "approx": None},
+        "stereo": {
+            "full": CPU_S_PER_MSAMPLE["stereo"] * ms(duration_s, analysis_sr),
+            "approx": CPU_S_PER_MSAMPLE["stereo"] * ms(min(duration_s, APPROX_STEREO_S), analysis_sr),
+        },
+        "tempo": {"full": CPU_S_PER_MSAMPLE["tempo"] * ms(duration_s, tempo_sr), "approx": None},
+        "transient": {
+            "full": CPU_S_PER_MSAMPLE["transient"] * ms(min(duration_s, transient_max_s), transient_sr),
+            "approx": CPU_S_PER_MSAMPLE["transient"] * ms(min(duration_s, transient_max_s, APPROX_TRANSIENT_S), transient_sr),
+        },
+        # The shared spectrogram is charged to each; once one has run the others are re-priced without it
+        "octave": {"full": spectrogram + CPU_S_PER_MSAMPLE["octave"] * ms(duration_s, analysis_sr), "approx": None},
+        "sections": {"full": spectrogram + CPU_S_PER_MSAMPLE["sections"] * ms(duration_s, analysis_sr), "approx": None},
+        "embedding": {"full": spectrogram + CPU_S_PER_MSAMPLE["embedding"] * ms(duration_s, analysis_sr), "approx": None},
+    }
+    for stage, variants in costs.items():
+        if stage not in APPROX_STAGES:
+            variants["approx"] = None
+    return costs, {"spectrogram": spectrogram}
+
+
+class StageScheduler:
+
+    def __init__(self, costs: dict, shared_costs: dict = None, deadline: float = None, pressure: float = 0.0):
+        """
+        Args:
+            costs: predicted CPU-seconds per stage variant (see estimate_stage_costs)
+            shared_costs: CPU-seconds of work shared by stages with the same "shares" key
+            deadline: absolute time.time() by which analysis should finish (None = no limit)
+            pressure: queued requests per worker when the analysis started
+        """
+        self.costs = {stage: dict(variants) for stage, variants in costs.items()}
+        self.shared_costs = shared_costs or {}
+        self._shared_done = set()
+        self.deadline = deadline
+        self.pressure = pressure
+        self.pending = [stage for stage in STAGES if stage in costs]
+        self.done_stages = set()
+        self.degraded = {}
+        self.log = []
+        self._predicted_total = 0.0
+        self._actual_total = 0.0
+
+    # --- PREDICTION ---
+
+    @property
+    def speed(self):
+        # Observed / predicted time of the stages run so far (1.0 until something ran)
+        if self._predicted_total < 0.05:
+            return 1.0
+        return min(4.0, max(0.5, self._actual_total / self._predicted_total))
+
+    def predicted(self, stage: str, variant: str):
+        cost = self.costs[stage].get(variant)
+        return None if cost is None else cost * self.speed
+
+    def set_cost(self, stage: str, full: float, approx: float = None):
+        """
+        Re-price a pending stage (e.g. once it is known to be trivial or shares work already done).
+        """
+        self.costs[stage] = {"full": full, "approx": approx}
+
+    def drop(self, stage: str):
+        """
+        Remove a pending stage that turned out not to be needed (not reported as degraded).
+        """
+        if stage in self.pending:
+            self.pending.remove(stage)
+            self.done_stages.add(stage)
+
+    def remaining(self):
+        return float("inf") if self.deadline is None else self.deadline - time.time()
+
+    def _cheapest(self, stage: str):
+        return min(cost for cost in self.costs[stage].values() if cost is not None) * self.speed
+
+    # --- DECISIONS ---
+
+    def _ready(self):
+        return [
+            stage for stage in self.pending
+            if all(dep in self.done_stages for dep in STAGES[stage].get("after", []))
+        ]
+
+    def next_stage(self):
+        """
+        Pick the next stage to run and its variant. Skipped stages are recorded
+        and never returned.
+
+        Returns:
+            (stage, variant) with variant "full" or "approx", or None when every stage is decided
+        """
+        while self.pending:
+            ready = self._ready()
+            stage = max(ready, key=lambda s: STAGES[s]["value"] / max(self.predicted(s, "full"), 1e-3))
+            self.pending.remove(stage)
+
+            # Time left once the other required stages have their cheapest variant reserved
+            reserve = sum(self._cheapest(s) for s in self.pending if STAGES[s].get("required"))
+            available = self.remaining() - reserve
+            full, approx = self.predicted(stage, "full"), self.predicted(stage, "approx")
+
+            if STAGES[stage].get("required"):
+                if approx is not None and (self.pressure >= PRESSURE_SKIP or full > available):
+                    return self._decide(stage, "approx", "load" if self.pressure >= PRESSURE_SKIP else "deadline")
+                return self._decide(stage, "full")
+
+            # Under moderate load optional stages fall back to their approximate variant where they have one
+            prefer_approx = approx is not None and self.pressure >= PRESSURE_APPROX
+            if self.pressure >= PRESSURE_SKIP:
+                self._decide(stage, "skip", "load")
+            elif not prefer_approx and full <= available:
+                return self._decide(stage, "full")
+            elif approx is not None and approx <= available:
+                return self._decide(stage, "approx", "deadline" if full > available else "load")
+            else:
+                self._decide(stage, "skip", "deadline")
+        return None
+
+    def _decide(self, stage: str, variant: str, reason: str = None):
+        self.log.append({"stage": stage, "variant": variant, "predicted_s": round(self.predicted(stage, "full" if variant == "skip" else variant), 3)})
+        if variant != "full":
+            self.degraded[STAGES[stage]["field"]] = {
+                "mode": "skipped" if variant == "skip" else "approximate",
+                "reason": reason,
+            }
+        if variant == "skip":
+            self.done_stages.add(stage)
+            return None
+        return stage, variant
+
+    def finished(self, stage: str, variant: str, elapsed_s: float):
+        """
+        Record a stage's actual run time (updates the speed estimate).
+        """
+        self.done_stages.add(stage)
+        predicted = self.costs[stage][variant]
+        self._predicted_total += predicted
+        self._actual_total += elapsed_s
+        self.log[-1]["actual_s"] = round(elapsed_s, 3)
+
+        # Work shared with pending stages is done now (only the first stage to run pays for it)
+        shared = STAGES[stage].get("shares")
+        if not shared or shared in self._shared_done:
+            return
+        self._shared_done.add(shared)
+        for other in self.pending:
+            if STAGES[other].get("shares") == shared:
+                self.costs[other] = {
+                    name: None if cost is None else max(0.0, cost - self.shared_costs.get(shared, 0.0))
+                    for name, cost in self.costs[other].items()
+                }
+
+    def report(self):
+        return {
+            "deadline_remaining_s": None if self.deadline is None else round(self.remaining(), 2),
+            "pressure": round(self.pressure, 2),
+            "speed_factor": round(self.speed, 2),
+            "stages": self.log,
+        }
@@ -0,0 +1,336 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import numpy as np
+
+
+"""
+
+End-to-end load test for /analyze_and_report, without touching Groq
+
+Starts a mock chat-completions server (configurable latency and response size,
+same JSON categories generate_report validates), starts the API with
+GROQ_BASE_URL pointing at it, and fires concurrent uploads of synthetic audio.
+
+    pip install -e ".[loadtest]"   # httpx
+    python -m tools.load_test --requests 40 --concurrency 8 --durations 30,180 --workers 3
+
+Reports throughput, p50/p95/p99 per stage (client total plus the server's
+queue / analysis / report stages from the Server-Timing header), status codes
+and the peak RSS of the API process tree (API process + analysis workers).
+
+"""
+
+MOCK_CATEGORIES = [
+    "summary",
+    "loudness_dynamics_analysis",
+    "spectral_analysis",
+    "stereo_analysis",
+    "strengths_and_improvements",
+    "suggestions",
+    "processing_recommendations",
+    "reference_comparison",
+]
+
+SERVER_STAGES = ["queue", "analysis", "report"]
+
+
+# --- MOCK LLM SERVER ---
+
+def start_mock_llm(port: int, latency_s: float, jitter_s: float, response_kb: float):
+    """
+    Serve POST /openai/v1/chat/completions with a canned JSON report.
+
+    Returns:
+        The running ThreadingHTTPServer (call shutdown() to stop it)
+    """
+    filler = "x" * max(1, int(response_kb * 1024 / len(MOCK_CATEGORIES)))
+    content = json.dumps({category: filler for category in MOCK_CATEGORIES})
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            time.sleep(max(0.0, latency_s + random.uniform(-jitter_s, jitter_s)))
+
+            body = json.dumps({
+                "id": "chatcmpl-load-test",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# --- SYNTHETIC UPLOADS ---
+
+def synthetic_wav(duration_s: float, sr: int, seed: int):
+    """
+    Stereo 16-bit WAV: tone + noise + 120 BPM clicks. Every seed gives different
+    bytes, so no request is served from a cache.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(sr * duration_s)
+    t = np.arange(n) / sr
+
+    signal = 0.2 * np.sin(2 * np.pi * rng.uniform(60, 220) * t) + 0.05 * rng.standard_normal(n)
+    click = np.exp(-np.arange(2048) / 200.0)
+    for start in range(0, n - click.size, int(sr * 0.5)):
+        signal[start:start + click.size] += 0.8 * click
+
+    stereo = np.stack([signal, np.roll(signal, 32)], axis=1)
+    pcm = (np.clip(stereo, -1.0, 1.0) * 32767).astype(np.int16)
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(sr)
+        wav.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+# --- API PROCESS ---
+
+def start_api(port: int, llm_port: int, workers: int = None, extra_env: dict = None):
+    env = {
+        **os.environ,
+        "GROQ_API_KEY": "load-test",
+        "GROQ_BASE_URL": f"http://127.0.0.1:{llm_port}",
+        # One load generator is one client: lift the per-client quota, keep the CPU budget
+        "ADMISSION_CLIENT_BURST_AUDIO_S": "1e12",
+        **(extra_env or {}),
+    }
+    if workers:
+        env["ANALYSIS_WORKERS"] = str(workers)
+
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=backend_dir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+async def wait_ready(base_url: str, timeout_s: float):
+    deadline = time.time() + timeout_s
+    async with httpx.AsyncClient() as client:
+        while time.time() < deadline:
+            try:
+                if (await client.get(f"{base_url}/ready")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.5)
+    raise TimeoutError("API did not become ready")
+
+
+def _process_tree(pid: int):
+    pids = [pid]
+    for current in pids:
+        try:
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pids += [int(child) for child in f.read().split()]
+        except OSError:
+            continue
+    return pids
+
+
+def _status_kb(pid: int, field: str):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class RSSSampler:
+    """
+    Samples the summed RSS of a process tree (Linux /proc) in a background thread.
+    """
+
+    def __init__(self, pid: int, interval_s: float = 0.2):
+        self.pid = pid
+        self.interval_s = interval_s
+        self.peak_tree_kb = 0
+        self.peak_process_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            pids = _process_tree(self.pid)
+            self.peak_tree_kb = max(self.peak_tree_kb, sum(_status_kb(pid, "VmRSS") for pid in pids))
+            self.peak_process_kb = max([self.peak_process_kb] + [_status_kb(pid, "VmHWM") for pid in pids])
+            self._stop.wait(self.interval_s)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+# --- LOAD ---
+
+def _parse_server_timing(header: str):
+    timings = {}
+    for part in filter(None, (p.strip() for p in (header or "").split(","))):
+        name, _, duration = part.partition(";dur=")
+        if duration:
+            timings[name] = float(duration) / 1000
+    return timings
+
+
+async def run_load(base_url: str, uploads: list, concurrency: int, with_reference: float, timeout_s: float):
+    """
+    Args:
+        uploads: list of (duration_s, wav bytes)
+        concurrency: requests in flight at once
+        with_reference: fraction of requests that also upload a reference track
+
+    Returns:
+        List of per-request results
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    results = []
+
+    async def one(i, client):
+        duration_s, main_bytes = uploads[i]
+        files = {"main_audio_file": ("main.wav", main_bytes, "audio/wav")}
+        if random.random() < with_reference:
+            files["ref_audio_file"] = ("ref.wav", uploads[(i + 1) % len(uploads)][1], "audio/wav")
+
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.post(f"{base_url}/analyze_and_report", files=files)
+                status, timings = response.status_code, _parse_server_timing(response.headers.get("server-timing"))
+            except httpx.HTTPError as e:
+                status, timings = type(e).__name__, {}
+            results.append({
+                "audio_s": duration_s * (2 if "ref_audio_file" in files else 1),
+                "status": status,
+                "total": time.perf_counter() - start,
+                **timings,
+            })
+
+    async with httpx.AsyncClient(timeout=timeout_s) as client:
+        await asyncio.gather(*(one(i, client) for i in range(len(uploads))))
+    return results
+
+
+def summarize(results: list, wall_s: float, rss: RSSSampler):
+    ok = [r for r in results if r["status"] == 200]
+    statuses = {}
+    for r in results:
+        statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+
+    stages = {}
+    for stage in ["total"] + SERVER_STAGES:
+        values = [r[stage] for r in ok if stage in r]
+        if values:
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            stages[stage] = {"p50_s": round(p50, 3), "p95_s": round(p95, 3), "p99_s": round(p99, 3), "max_s": round(max(values), 3)}
+
+    return {
+        "requests": len(results),
+        "statuses": statuses,
+        "wall_s": round(wall_s, 2),
+        "throughput_rps": round(len(ok) / wall_s, 3),
+        "throughput_audio_s_per_s": round(sum(r["audio_s"] for r in ok) / wall_s, 2),
+        "stages": stages,
+        "peak_rss_tree_mb": round(rss.peak_tree_kb / 1024, 1),
+        "peak_rss_single_process_mb": round(rss.peak_process_kb / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test /analyze_and_report against a mock LLM.")
+    parser.add_argument("--requests", type=int, default=20, help="total requests")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight at once")
+    parser.add_argument("--durations", default="30,120", help="comma-separated upload durations in seconds (cycled)")
+    parser.add_argument("--sample-rate", type=int, default=44100, help="sample rate of the synthetic uploads")
+    parser.add_argument("--with-reference", type=float, default=0.0, help="fraction of requests that include a reference upload")
+    parser.add_argument("--workers", type=int, default=None, help="analysis pool size (ANALYSIS_WORKERS)")
+    parser.add_argument("--llm-latency", type=float, default=2.0, help="mock LLM latency in seconds")
+    parser.add_argument("--llm-jitter", type=float, default=0.5, help="mock LLM latency jitter in seconds (+/-)")
+    parser.add_argument("--llm-response-kb", type=float, default=6.0, help="mock LLM response size in KB")
+    parser.add_argument("--api-port", type=int, default=8765)
+    parser.add_argument("--llm-port", type=int, default=8766)
+    parser.add_argument("--timeout", type=float, default=600.0, help="per-request timeout in seconds")
+    parser.add_argument("--output", default=None, help="write the summary (and raw results) as JSON to this path")
+    args = parser.parse_args()
+
+    random.seed(0)
+    durations = [float(d) for d in args.durations.split(",")]
+    print(f"Generating {args.requests} synthetic uploads...")
+    uploads = [(durations[i % len(durations)], synthetic_wav(durations[i % len(durations)], args.sample_rate, seed=i)) for i in range(args.requests)]
+
+    llm = start_mock_llm(args.llm_port, args.llm_latency, args.llm_jitter, args.llm_response_kb)
+    api = start_api(args.api_port, args.llm_port, args.workers)
+    base_url = f"http://127.0.0.1:{args.api_port}"
+
+    try:
+        print("Waiting for the API to warm up...")
+        asyncio.run(wait_ready(base_url, timeout_s=300))
+
+        rss = RSSSampler(api.pid).start()
+        start_time = time.time()
+        results = asyncio.run(run_load(base_url, uploads, args.concurrency, args.with_reference, args.timeout))
+        wall_s = time.time() - start_time
+        rss.stop()
+    finally:
+        api.terminate()
+        api.wait()
+        llm.shutdown()
+
+    summary = summarize(results, wall_s, rss)
+    summary["config"] = {key: value for key, value in vars(args).items() if key != "output"}
+
+    print(f"\n{'='*50}")
+    print(json.dumps(summary, indent=2))
+    print(f"{'='*50}\n")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"summary": summary, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
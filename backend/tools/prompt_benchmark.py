@@ -0,0 +1,224 @@
+import argparse
+import json
+import re
+import threading
+import time
+
+import numpy as np
+
+
+"""
+
+Benchmark the compact report prompt against the full one
+
+Builds both prompt formats for the same tracks and compares their size. With
+--live it also generates reports (GROQ_API_KEY, GROQ_BASE_URL) with the full
+prompt, the compact prompt in one request, and the compact prompt as
+concurrent per-section requests, and compares latency, the prompt tokens the
+API reports (summed over a report's requests) and how complete the reports are.
+
+    python -m tools.prompt_benchmark                                  # synthetic tracks, sizes only
+    python -m tools.prompt_benchmark --audio mix.wav --reference-audio ref.wav --live 5
+    python -m tools.prompt_benchmark --features mix.json --budget 3000
+
+--features / --reference-features take feature JSON, either a features dict or
+a saved /analyze_and_report response. Report completeness is:
+
+    categories      share of the required top-level categories that are present and non-empty
+    fields          share of all leaf fields in the report that are non-empty
+    numbers         numeric values quoted in the report text (does the LLM still cite the data?)
+
+"""
+
+FORMATS = ["full", "compact"]
+
+# Live variants: (prompt format, report mode)
+VARIANTS = {
+    "full": ("full", "single"),
+    "compact": ("compact", "single"),
+    "compact_sections": ("compact", "sections"),
+}
+
+
+# --- INPUTS ---
+
+def load_features(path: str):
+    with open(path) as f:
+        data = json.load(f)
+    return data.get("features", data)
+
+
+def analyze_file(path: str):
+    from pipeline.analyze_track_complete import analyze_uploaded_track_complete
+
+    with open(path, "rb") as f:
+        audio_bytes = f.read()
+    mime = "audio/mpeg" if path.lower().endswith(".mp3") else "audio/wav"
+    return analyze_uploaded_track_complete(audio_bytes, mime)
+
+
+def analyze_synthetic(duration_s: float, seed: int):
+    from pipeline.analyze_track_complete import analyze_uploaded_track_complete
+    from tools.load_test import synthetic_wav
+
+    return analyze_uploaded_track_complete(synthetic_wav(duration_s, 44100, seed), "audio/wav")
+
+
+# --- COMPLETENESS ---
+
+def _leaves(value):
+    if isinstance(value, dict):
+        for item in value.values():
+            yield from _leaves(item)
+    elif isinstance(value, list) and value and all(isinstance(item, (dict, list)) for item in value):
+        for item in value:
+            yield from _leaves(item)
+    else:
+        yield value
+
+
+def report_completeness(report: dict, required: list):
+    present = [category for category in required if report.get(category)]
+    leaves = list(_leaves({category: report.get(category) for category in required}))
+    filled = [leaf for leaf in leaves if leaf not in (None, "", [], {})]
+    text = " ".join(str(leaf) for leaf in leaves if leaf is not None)
+    return {
+        "categories": round(len(present) / len(required), 3),
+        "fields": round(len(filled) / max(1, len(leaves)), 3),
+        "numbers": len(re.findall(r"-?\d+(?:\.\d+)?", text)),
+    }
+
+
+# --- BENCHMARK ---
+
+def prompt_sizes(features: dict, reference: dict, comparison: dict, budget: int):
+    from analysis.llm.audio_analysis_prompt import build_report_prompt
+    from analysis.llm.token_budget import token_counter_name
+
+    rows = {}
+    for prompt_format in FORMATS:
+        start = time.perf_counter()
+        prompt, stats = build_report_prompt(features, reference, prompt_format, budget, comparison)
+        rows[prompt_format] = {
+            **stats,
+            "chars": len(prompt),
+            "build_ms": round((time.perf_counter() - start) * 1000, 2),
+        }
+    rows["token_counter"] = token_counter_name()
+    rows["token_reduction_pct"] = round(100 * (1 - rows["compact"]["tokens"] / rows["full"]["tokens"]), 1)
+    return rows
+
+
+def run_live(features: dict, reference: dict, comparison: dict, runs: int):
+    import analysis.llm.audio_analysis_generator as generator
+
+    required = generator.REQUIRED_CATEGORIES + (["reference_comparison"] if reference is not None else [])
+    usage = {"prompt_tokens": 0}
+    create = generator.client.chat.completions.create
+
+    def recording_create(*args, **kwargs):
+        # Add up the API's own prompt token counts (section requests run in threads)
+        completion = create(*args, **kwargs)
+        with lock:
+            usage["prompt_tokens"] += completion.usage.prompt_tokens if completion.usage else 0
+        return completion
+
+    lock = threading.Lock()
+    generator.client.chat.completions.create = recording_create
+    results = {variant: [] for variant in VARIANTS}
+    try:
+        # Interleave the variants so drifting API latency hits all of them alike
+        for run in range(runs):
+            for variant, (prompt_format, report_mode) in VARIANTS.items():
+                usage["prompt_tokens"] = 0
+                start = time.perf_counter()
+                try:
+                    report = generator.generate_report(features, reference, prompt_format, comparison, report_mode)
+                except Exception as e:
+                    print(f"Run {run} ({variant}) failed: {e}")
+                    results[variant].append({"error": f"{type(e).__name__}: {e}"})
+                    continue
+                results[variant].append({
+                    "latency_s": time.perf_counter() - start,
+                    "api_prompt_tokens": usage["prompt_tokens"],
+                    **report_completeness(report, required),
+                })
+    finally:
+        generator.client.chat.completions.create = create
+
+    summary = {}
+    for variant, rows in results.items():
+        ok = [row for row in rows if "error" not in row]
+        if not ok:
+            summary[variant] = {"runs": len(rows), "failed": len(rows)}
+            continue
+        latencies = [row["latency_s"] for row in ok]
+        p50, p95 = np.percentile(latencies, [50, 95])
+        summary[variant] = {
+            "runs": len(rows),
+            "failed": len(rows) - len(ok),
+            "latency_p50_s": round(p50, 2),
+            "latency_p95_s": round(p95, 2),
+            "api_prompt_tokens": ok[-1]["api_prompt_tokens"],
+            "categories": round(float(np.mean([row["categories"] for row in ok])), 3),
+            "fields": round(float(np.mean([row["fields"] for row in ok])), 3),
+            "numbers": round(float(np.mean([row["numbers"] for row in ok])), 1),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the compact report prompt with the full one.")
+    parser.add_argument("--features", default=None, help="feature JSON of the target track")
+    parser.add_argument("--reference-features", default=None, help="feature JSON of the reference track")
+    parser.add_argument("--audio", default=None, help="analyze this file as the target track")
+    parser.add_argument("--reference-audio", default=None, help="analyze this file as the reference track")
+    parser.add_argument("--duration", type=float, default=180.0, help="length of the synthetic tracks in seconds")
+    parser.add_argument("--no-reference", action="store_true", help="benchmark without a reference track")
+    parser.add_argument("--budget", type=int, default=None, help="token budget (default LLM_PROMPT_TOKEN_BUDGET)")
+    parser.add_argument("--live", type=int, default=0, help="reports per variant (0 = sizes only)")
+    parser.add_argument("--output", default=None, help="write the results as JSON to this path")
+    args = parser.parse_args()
+
+    from analysis.llm.token_budget import LLM_PROMPT_TOKEN_BUDGET
+    from analysis.reference.reference_comparison import compare_tracks
+    from fastapi.encoders import jsonable_encoder
+
+    if args.features:
+        features = load_features(args.features)
+    elif args.audio:
+        features = analyze_file(args.audio)
+    else:
+        print(f"Analyzing a synthetic {args.duration:.0f} s track...")
+        features = analyze_synthetic(args.duration, seed=0)
+
+    reference = None
+    if args.reference_features:
+        reference = load_features(args.reference_features)
+    elif args.reference_audio:
+        reference = analyze_file(args.reference_audio)
+    elif not args.no_reference and not (args.features or args.audio):
+        print(f"Analyzing a synthetic {args.duration:.0f} s reference...")
+        reference = analyze_synthetic(args.duration, seed=1)
+
+    features = jsonable_encoder(features)
+    reference = jsonable_encoder(reference) if reference is not None else None
+
+    # The API sends the numeric comparison along with a reference, so the benchmark does too
+    comparison = compare_tracks(features, reference) if reference is not None else None
+
+    results = {"prompt": prompt_sizes(features, reference, comparison, args.budget or LLM_PROMPT_TOKEN_BUDGET)}
+    if args.live:
+        results["live"] = run_live(features, reference, comparison, args.live)
+
+    print(f"\n{'='*50}")
+    print(json.dumps(results, indent=2))
+    print(f"{'='*50}\n")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
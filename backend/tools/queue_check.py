@@ -0,0 +1,236 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+
+"""
+
+Protocol check of the analysis job queue brokers
+
+Runs the same scenarios against LocalBroker and RedisBroker (a real server at
+REDIS_URL, or an in-process fakeredis with --fake, which runs the Lua scripts
+through lupa), plus an AnalysisWorker driven through a broker that fails:
+
+    roundtrip           submit -> claim -> complete -> wait returns the result
+    failure             a failed job raises JobFailed at the submitter
+    heartbeat           a renewed lease is not requeued
+    lease_expiry        an expired lease is requeued (attempt 2), then failed after JOB_MAX_ATTEMPTS
+    expired_job         a pending id whose job hash expired is skipped, not claimed (Redis only)
+    worker_survives     the worker keeps claiming after the broker raised, and runs the next job
+
+    python -m tools.queue_check --fake                      # local + fakeredis
+    REDIS_URL=redis://localhost:6379/15 python -m tools.queue_check
+
+Against a real server the keys live under a throwaway prefix and are deleted
+afterwards. Exits with status 1 if any scenario fails.
+
+"""
+
+LEASE_S = 2 # Redis leases have whole-second resolution (server TIME): 1 s would make heartbeats racy
+MAX_ATTEMPTS = 2
+FAILURE_EXIT_CODE = 1
+
+
+# --- SCENARIOS ---
+
+async def roundtrip(broker):
+    from analysis.utils.job_queue import run_job
+
+    async def serve():
+        job = None
+        while job is None:
+            job = await broker.claim("w1")
+            await asyncio.sleep(0.01)
+        assert job.kind == "analyze" and job.audio == b"\x00\x01RIFF" and job.mime == "audio/wav", job
+        assert job.args == {"pressure": 0.5} and job.attempt == 1, job
+        await broker.complete("w1", job.id, {"loudness": -9.5})
+
+    result, _ = await asyncio.gather(run_job(broker, "analyze", b"\x00\x01RIFF", "audio/wav", timeout=5, pressure=0.5), serve())
+    assert result == {"loudness": -9.5}, result
+
+
+async def failure(broker):
+    from analysis.utils.job_queue import JobFailed
+
+    job_id = await broker.submit("analyze", b"x", "audio/wav")
+    job = await broker.claim("w1")
+    await broker.fail("w1", job.id, "ValueError: broken file")
+    try:
+        await broker.wait(job_id, timeout=5)
+    except JobFailed as e:
+        assert "broken file" in str(e), e
+        return
+    raise AssertionError("wait() returned for a failed job")
+
+
+async def heartbeat(broker):
+    job_id = await broker.submit("analyze", b"x", "audio/wav")
+    job = await broker.claim("w1")
+    for _ in range(3):
+        await asyncio.sleep(LEASE_S * 0.6)
+        await broker.heartbeat("w1", [job.id])
+        assert await broker.requeue_expired() == 0, "renewed lease was requeued"
+    await broker.complete("w1", job.id, {"ok": True})
+    assert await broker.wait(job_id, timeout=5) == {"ok": True}
+
+
+async def lease_expiry(broker):
+    from analysis.utils.job_queue import JobFailed
+
+    job_id = await broker.submit("analyze", b"x", "audio/wav")
+    first = await broker.claim("w1")
+    await asyncio.sleep(LEASE_S + 1.1)
+    assert await broker.requeue_expired() == 1
+
+    second = await broker.claim("w2")
+    assert second is not None and second.id == job_id and second.attempt == 2, second
+    # The first worker lost its lease: its late result is ignored
+    await broker.complete("w1", first.id, {"late": True})
+
+    await asyncio.sleep(LEASE_S + 1.1)
+    assert await broker.requeue_expired() == 1
+    assert await broker.claim("w3") is None, "job claimed past JOB_MAX_ATTEMPTS"
+    try:
+        await broker.wait(job_id, timeout=5)
+    except JobFailed as e:
+        assert "lost the job" in str(e), e
+        return
+    raise AssertionError("wait() returned for a job that kept losing its worker")
+
+
+async def expired_job(broker):
+    stale_id = await broker.submit("analyze", b"stale", "audio/wav")
+    live_id = await broker.submit("analyze", b"live", "audio/wav")
+    # What the job hash TTL does to a job nobody claimed in time
+    await broker.redis.delete(f"{broker.prefix}job:{stale_id}")
+
+    job = await broker.claim("w1")
+    assert job is not None and job.id == live_id, job
+    assert await broker.claim("w1") is None
+    assert not await broker.redis.exists(f"{broker.prefix}job:{stale_id}"), "claim recreated the expired job"
+    await broker.complete("w1", job.id, None)
+
+
+class FlakyBroker:
+    """
+    Delegates to a broker, but the first `failures` claims raise like a dropped connection.
+    """
+
+    def __init__(self, broker, failures: int):
+        self.broker = broker
+        self.failures = failures
+
+    async def claim(self, worker_id: str):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("connection reset by peer")
+        return await self.broker.claim(worker_id)
+
+    def __getattr__(self, name):
+        return getattr(self.broker, name)
+
+
+async def worker_survives(broker):
+    import worker as worker_module
+    from analysis.utils.job_queue import run_job
+
+    async def echo(audio, mime, **args):
+        return {"bytes": len(audio), **args}
+
+    worker_module.JOB_HANDLERS["echo"] = echo
+    worker = worker_module.AnalysisWorker(FlakyBroker(broker, failures=3), concurrency=2, worker_id="flaky")
+    worker_task = asyncio.create_task(worker.run())
+    try:
+        result = await run_job(broker, "echo", b"abcd", "audio/wav", timeout=15, n=1)
+        assert result == {"bytes": 4, "n": 1}, result
+        assert not worker_task.done(), "worker stopped"
+    finally:
+        worker.stop()
+        await worker_task
+        del worker_module.JOB_HANDLERS["echo"]
+
+
+SCENARIOS = {
+    "roundtrip": (roundtrip, False),
+    "failure": (failure, False),
+    "heartbeat": (heartbeat, False),
+    "lease_expiry": (lease_expiry, False),
+    "expired_job": (expired_job, True),
+    "worker_survives": (worker_survives, False),
+}
+
+
+# --- BROKERS ---
+
+def make_brokers(fake: bool, run_id: str):
+    from analysis.utils.job_queue import LocalBroker, RedisBroker, REDIS_URL
+
+    brokers = {"local": lambda: LocalBroker(lease_s=LEASE_S, max_attempts=MAX_ATTEMPTS)}
+    if fake:
+        import fakeredis
+        server = fakeredis.FakeServer()
+        brokers["fakeredis"] = lambda: RedisBroker(
+            prefix=f"check:{run_id}:", lease_s=LEASE_S, max_attempts=MAX_ATTEMPTS,
+            client=fakeredis.FakeAsyncRedis(server=server)
+        )
+    else:
+        brokers["redis"] = lambda: RedisBroker(REDIS_URL, prefix=f"check:{run_id}:", lease_s=LEASE_S, max_attempts=MAX_ATTEMPTS)
+    return brokers
+
+
+async def _cleanup(broker):
+    if hasattr(broker, "redis"):
+        keys = [key async for key in broker.redis.scan_iter(match=f"{broker.prefix}*")]
+        if keys:
+            await broker.redis.delete(*keys)
+
+
+async def run_checks(fake: bool, scenarios: list):
+    run_id = f"{os.getpid()}-{int(time.time())}"
+    results = {}
+    for broker_name, make_broker in make_brokers(fake, run_id).items():
+        for name in scenarios:
+            scenario, redis_only = SCENARIOS[name]
+            if redis_only and broker_name == "local":
+                continue
+            # A fresh broker per scenario (same server), so no state leaks between them
+            broker = make_broker()
+            start = time.perf_counter()
+            try:
+                await scenario(broker)
+                error = None
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            finally:
+                await _cleanup(broker)
+                await broker.close()
+            results[(broker_name, name)] = error
+            status = "PASS" if error is None else "FAIL"
+            print(f"{status}  {broker_name:<10} {name:<16} {time.perf_counter() - start:.2f} s" + (f"   {error}" if error else ""))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the job queue brokers against their protocol.")
+    parser.add_argument("--fake", action="store_true", help="use an in-process fakeredis instead of REDIS_URL")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma-separated scenarios (default all: {', '.join(SCENARIOS)})")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    print(f"\n{'='*50}")
+    results = asyncio.run(run_checks(args.fake, scenarios))
+    print(f"{'='*50}\n")
+
+    failed = [key for key, error in results.items() if error is not None]
+    print("All broker checks passed." if not failed else f"{len(failed)} broker check(s) failed.")
+    sys.exit(FAILURE_EXIT_CODE if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,583 @@
+"""
+
+Accuracy-versus-speed validation of the fast analysis paths
+
+Runs the reference implementation of each analysis stage (audio_features.py,
+the same inputs the pipeline feeds it) and its fast variant on a corpus of
+tracks, and compares the metrics clients see:
+
+    loudness_chunked        get_loudness_features_chunked (low-memory mode) vs get_loudness_features
+    spectrum_low_memory     get_frequency_spectrum_energy_low_memory vs get_frequency_spectrum_energy
+    stereo_chunked          get_stereo_imaging_features in chunks (low-memory mode) vs in one pass
+    stereo_window           stereo on the centre APPROX_STEREO_S (scheduler "approx", APPROX_STAGES=stereo) vs the whole track
+    transient_window        transients on APPROX_TRANSIENT_S (scheduler "approx", APPROX_STAGES=transient) vs TRANSIENT_MAX_S
+    tempo_decimated         onsets + beats at LOW_MEMORY_TEMPO_SR (low-memory mode) vs the tempo rate
+                            (skipped while LOW_MEMORY_TEMPO_SR is the tempo rate, its default)
+    spectrogram_chunked     1/3-octave curve from the block-wise spectrogram (low-memory mode) vs one STFT
+    analysis_rate           stereo at the analysis rate vs the native rate (hi-res tracks only)
+    revision_chunks         merged 10 s chunk aggregates (/analyze_revision) vs the whole-track loudness and onsets
+
+Every metric has a tolerance (absolute, relative or both; meeting either one
+passes). Per case the report gives the worst absolute and relative error per
+metric, the speedup (reference time / fast time, best of --repeat runs) and
+the peak memory of each side (tracemalloc, in a separate run so tracing does
+not skew the timings).
+
+    python -m tools.validate_fast_modes                         # synthetic corpus, 180 s tracks
+    python -m tools.validate_fast_modes mix.wav master.flac     # plus local files
+    python -m tools.validate_fast_modes --cases tempo_decimated --repeat 3 --output fast_modes.json
+
+Exits with status 1 if any metric of any case is out of tolerance on any
+track (or a variant fails to run). A fast mode is only turned on by default
+once it passes here on a representative corpus.
+
+"""
+
+import argparse
+import fnmatch
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from scipy.signal import fftconvolve
+
+
+FAILURE_EXIT_CODE = 1
+REL_ERROR_FLOOR = 1e-6 # below this |reference| the relative error is meaningless; only the absolute tolerance applies
+
+
+# --- SYNTHETIC CORPUS ---
+
+def _pink_noise(rng, n: int):
+    spectrum = np.fft.rfft(rng.standard_normal(n))
+    spectrum /= np.sqrt(np.maximum(np.arange(len(spectrum)), 1))
+    noise = np.fft.irfft(spectrum, n)
+    return noise / (np.max(np.abs(noise)) + 1e-12)
+
+
+def _hits(n: int, sr: int, times_s, sound):
+    impulses = np.zeros(n)
+    idx = (np.asarray(times_s) * sr).astype(int)
+    np.add.at(impulses, idx[idx < n], 1.0)
+    return fftconvolve(impulses, sound)[:n]
+
+
+def _drums(n: int, sr: int, bpm: float, rng):
+    beat = 60.0 / bpm
+    duration_s = n / sr
+    t = np.arange(int(0.35 * sr)) / sr
+    kick = np.sin(2 * np.pi * (50 * t + 70 * (1 - np.exp(-t / 0.04)) * 0.04)) * np.exp(-t / 0.12)
+    snare = rng.standard_normal(int(0.2 * sr)) * np.exp(-np.arange(int(0.2 * sr)) / (0.05 * sr))
+    hat = np.diff(rng.standard_normal(int(0.05 * sr) + 1)) * np.exp(-np.arange(int(0.05 * sr)) / (0.01 * sr))
+
+    beats = np.arange(0, duration_s, beat)
+    return (
+        0.9 * _hits(n, sr, beats[::2], kick)
+        + 0.5 * _hits(n, sr, beats[1::2], snare)
+        + 0.15 * _hits(n, sr, np.arange(0, duration_s, beat / 2), hat)
+    )
+
+
+def synthetic_track(kind: str, duration_s: float, sr: int, seed: int = 0):
+    """
+    Stereo float32 test signals with known character.
+
+        pop         steady drums at 120 BPM, bass line, pink-noise bed, moderate width
+        dynamic     quiet first third (-18 dB), then full level; drums at 100 BPM
+        wide        decorrelated ambience with slowly moving width, sparse hits at 80 BPM
+
+    Returns:
+        float32 array of shape (2, samples)
+    """
+    rng = np.random.default_rng(seed)
+    n = int(duration_s * sr)
+    t = np.arange(n) / sr
+
+    if kind == "pop":
+        bass = 0.3 * np.sin(2 * np.pi * np.where((t // 2) % 2 == 0, 55.0, 73.4) * t)
+        drums = _drums(n, sr, 120, rng)
+        bed_l, bed_r = _pink_noise(rng, n), _pink_noise(rng, n)
+        common = 0.6 * bed_l + 0.4 * bed_r
+        left = bass + drums + 0.12 * (0.7 * common + 0.3 * bed_l)
+        right = bass + drums + 0.12 * (0.7 * common + 0.3 * bed_r)
+    elif kind == "dynamic":
+        envelope = np.where(t < duration_s / 3, 10 ** (-18 / 20), 1.0)
+        music = _drums(n, sr, 100, rng) + 0.25 * np.sin(2 * np.pi * 98 * t) + 0.1 * _pink_noise(rng, n)
+        left = right = envelope * music
+        right = np.roll(right, int(0.0004 * sr)) # slight Haas offset
+    elif kind == "wide":
+        width = 0.5 + 0.5 * np.sin(2 * np.pi * t / 40)
+        mid, side = _pink_noise(rng, n), _pink_noise(rng, n)
+        hits = _drums(n, sr, 80, rng)
+        left = 0.3 * (mid + width * side) + 0.6 * hits
+        right = 0.3 * (mid - width * side) + 0.6 * hits
+    else:
+        raise ValueError(f"Unknown synthetic track: {kind}")
+
+    y = np.stack([left, right])
+    return (0.9 * y / (np.max(np.abs(y)) + 1e-12)).astype(np.float32)
+
+
+SYNTHETIC_CORPUS = [
+    ("synthetic_pop_44k", "pop", 44100),
+    ("synthetic_dynamic_48k", "dynamic", 48000),
+    ("synthetic_wide_44k", "wide", 44100),
+    ("synthetic_pop_96k", "pop", 96000),
+]
+
+
+def load_local_file(path: str):
+    from analysis.audio.audio_probe import probe_audio
+    from pipeline.analyze_track_complete import decode_track
+
+    with open(path, "rb") as f:
+        audio_bytes = f.read()
+    y, sr = decode_track(audio_bytes, probe_audio(audio_bytes)["mime_type"])
+    if y is None:
+        raise ValueError(f"Could not decode {path}")
+    if y.ndim == 1:
+        y = np.stack([y, y])
+    return y, sr
+
+
+# --- CASES ---
+
+class Track:
+    """
+    A decoded track with the resampled buffers the stages read, prepared
+    up front so resampling is not part of any timing.
+    """
+
+    def __init__(self, name: str, y_stereo, sr: int):
+        from analysis.audio.sample_rate_policy import AnalysisSignals
+        from analysis.utils.memory_budget import LOW_MEMORY_TEMPO_SR
+
+        self.name = name
+        self.sr = sr
+        self.duration_s = y_stereo.shape[-1] / sr
+        self.signals = AnalysisSignals(y_stereo, sr)
+        self.analysis_sr = self.signals.analysis_sr
+        self.tempo_sr = self.signals.stage_sr("tempo")
+        self.low_memory_tempo_sr = min(self.analysis_sr, LOW_MEMORY_TEMPO_SR)
+        self.transient_sr = self.signals.stage_sr("transient")
+
+        for rate in {self.analysis_sr, self.tempo_sr, self.low_memory_tempo_sr, self.transient_sr}:
+            self.signals.mono(rate)
+        self.signals.stereo()
+        self.native_mono = np.mean(y_stereo, axis=0)
+
+
+def _loudness(track):
+    from analysis.audio.audio_features import get_loudness_features
+    return get_loudness_features(track.signals.stereo(track.sr), track.sr)
+
+
+def _loudness_chunked(track):
+    from analysis.audio.audio_features import get_loudness_features_chunked
+    from analysis.utils.memory_budget import LOW_MEMORY_CHUNK_S
+    return get_loudness_features_chunked(track.signals.stereo(track.sr), track.sr, chunk_s=LOW_MEMORY_CHUNK_S)
+
+
+def _spectrum(track):
+    # Native rate, like the pipeline
+    from analysis.audio.audio_features import get_frequency_spectrum_energy
+    return get_frequency_spectrum_energy(track.native_mono, track.sr)
+
+
+def _spectrum_low_memory(track):
+    from analysis.audio.audio_features import get_frequency_spectrum_energy_low_memory
+    return get_frequency_spectrum_energy_low_memory(track.native_mono, track.sr)
+
+
+def _stereo(track):
+    from analysis.audio.audio_features import get_stereo_imaging_features
+    return get_stereo_imaging_features(track.signals.stereo(), track.analysis_sr)
+
+
+def _stereo_chunked(track):
+    from analysis.audio.audio_features import get_stereo_imaging_features
+    from analysis.utils.memory_budget import LOW_MEMORY_CHUNK_S
+    return get_stereo_imaging_features(track.signals.stereo(), track.analysis_sr, chunk_size=int(LOW_MEMORY_CHUNK_S * track.analysis_sr))
+
+
+def _stereo_window(track):
+    from analysis.audio.audio_features import get_stereo_imaging_features
+    from pipeline.stage_scheduler import APPROX_STEREO_S
+    # Same centre window as the pipeline's "approx" stereo stage
+    y = track.signals.stereo()
+    window = int(APPROX_STEREO_S * track.analysis_sr)
+    offset = max(0, (y.shape[-1] - window) // 2)
+    return get_stereo_imaging_features(y[..., offset:offset + window], track.analysis_sr)
+
+
+def _transient(track):
+    from analysis.audio.audio_features import get_transient_features
+    from analysis.utils.memory_budget import TRANSIENT_MAX_S
+    return get_transient_features(track.signals.mono(track.transient_sr), track.transient_sr, max_duration=TRANSIENT_MAX_S)
+
+
+def _transient_window(track):
+    from analysis.audio.audio_features import get_transient_features
+    from analysis.utils.memory_budget import TRANSIENT_MAX_S
+    from pipeline.stage_scheduler import APPROX_TRANSIENT_S
+    return get_transient_features(track.signals.mono(track.transient_sr), track.transient_sr, max_duration=min(TRANSIENT_MAX_S, APPROX_TRANSIENT_S))
+
+
+def _tempo_at(track, sr: int):
+    import librosa
+    from analysis.audio.audio_features import get_tempo_features
+    y = track.signals.mono(sr)
+    return get_tempo_features(y, sr, onset_env=librosa.onset.onset_strength(y=y, sr=sr))
+
+
+def _octave(track, chunk_s=None):
+    from analysis.audio.sample_rate_policy import AnalysisSignals, SPECTROGRAM_N_FFT
+    from analysis.audio.octave_spectrum import get_octave_spectrum
+    # A fresh AnalysisSignals over the analysis-rate buffer, so no spectrogram is cached between runs
+    signals = AnalysisSignals(track.signals.stereo(), track.analysis_sr, spectrogram_chunk_s=chunk_s)
+    return get_octave_spectrum(signals.power_spectrogram(), track.analysis_sr, SPECTROGRAM_N_FFT)["third_octave"]
+
+
+def _octave_chunked(track):
+    from analysis.utils.memory_budget import LOW_MEMORY_CHUNK_S
+    return _octave(track, LOW_MEMORY_CHUNK_S)
+
+
+def _native_rate(track):
+    from analysis.audio.audio_features import get_stereo_imaging_features
+    return {"stereo": get_stereo_imaging_features(track.signals.stereo(track.sr), track.sr)}
+
+
+def _analysis_rate(track):
+    return {"stereo": _stereo(track)}
+
+
+def _whole_track(track):
+    import librosa
+    from analysis.audio.chunk_aggregates import ONSET_SR
+    metrics = {key: value for key, value in _loudness(track).items() if key != "loudness_evolution"}
+    y_onset = track.signals.mono(ONSET_SR) if ONSET_SR <= track.analysis_sr else track.native_mono
+    onsets = librosa.onset.onset_detect(y=y_onset, sr=ONSET_SR, units="time")
+    metrics["transient_density"] = len(onsets) / track.duration_s
+    return metrics
+
+
+def _revision_chunks(track):
+    from analysis.audio.chunk_aggregates import split_chunks, compute_chunk_aggregate, merge_chunk_aggregates
+    # No cache: every chunk is computed, as for a first upload
+    aggregates = [
+        compute_chunk_aggregate(chunk, track.sr, preroll, postroll, start)
+        for start, chunk, preroll, postroll in split_chunks(track.signals.stereo(track.sr), track.sr)
+    ]
+    return merge_chunk_aggregates(aggregates, track.sr)
+
+
+def _chunked_tracks_only(track):
+    from analysis.utils.memory_budget import LOW_MEMORY_CHUNK_S
+    return track.duration_s > LOW_MEMORY_CHUNK_S
+
+
+# Reference runs are shared between the cases that compare against them
+REFERENCES = {
+    "loudness": _loudness,
+    "spectrum": _spectrum,
+    "stereo": _stereo,
+    "transient": _transient,
+    "tempo": lambda track: _tempo_at(track, track.tempo_sr),
+    "octave": _octave,
+    "native_rate": _native_rate,
+    "whole_track": _whole_track,
+}
+
+STEREO_METRICS = ["stereo_width_score", "ms_side_fraction", "correlation", "lr_balance", "mean_frame_width", "band_widths.*"]
+
+# case -> reference, fast variant, when it applies, {metric pattern: (absolute tolerance, relative tolerance)}
+CASES = {
+    "loudness_chunked": {
+        "reference": "loudness",
+        "fast": _loudness_chunked,
+        "applies": _chunked_tracks_only,
+        "tolerances": {
+            "loudness_lufs": (0.1, None),
+            "true_peak_db": (0.1, None),
+            "peak_db": (0.01, None),
+            "rms_db": (0.05, None),
+            "crest_factor_db": (0.1, None),
+            "dynamic_range_db": (0.5, None),
+        },
+    },
+    "spectrum_low_memory": {
+        "reference": "spectrum",
+        "fast": _spectrum_low_memory,
+        "applies": None,
+        "tolerances": {
+            "energy_bands.*": (0.005, 0.02),
+            "spectral_tilt": (0.2, None),
+        },
+    },
+    "stereo_chunked": {
+        "reference": "stereo",
+        "fast": _stereo_chunked,
+        "applies": _chunked_tracks_only,
+        "tolerances": {metric: (0.01, None) for metric in STEREO_METRICS},
+    },
+    "stereo_window": {
+        "reference": "stereo",
+        "fast": _stereo_window,
+        "applies": None,
+        "tolerances": {metric: (0.05, None) for metric in STEREO_METRICS},
+    },
+    "transient_window": {
+        "reference": "transient",
+        "fast": _transient_window,
+        "applies": None,
+        "tolerances": {
+            "transient_density": (0.1, 0.15),
+            "percussion_energy_pct": (2.0, None),
+        },
+    },
+    "tempo_decimated": {
+        "reference": "tempo",
+        "fast": lambda track: _tempo_at(track, track.low_memory_tempo_sr),
+        "applies": lambda track: track.low_memory_tempo_sr < track.tempo_sr,
+        "tolerances": {
+            "tempo_bpm": (0.5, 0.005),
+            "tempo_std_s": (0.005, None),
+            "num_beats": (1, 0.02),
+        },
+    },
+    "spectrogram_chunked": {
+        "reference": "octave",
+        "fast": _octave_chunked,
+        "applies": _chunked_tracks_only,
+        "tolerances": {
+            "mean_db.*": (0.1, None),
+            "p50_db.*": (0.1, None),
+        },
+    },
+    "analysis_rate": {
+        "reference": "native_rate",
+        "fast": _analysis_rate,
+        "applies": lambda track: track.analysis_sr < track.sr,
+        "tolerances": {f"stereo.{metric}": (0.01, None) for metric in STEREO_METRICS},
+    },
+    "revision_chunks": {
+        "reference": "whole_track",
+        "fast": _revision_chunks,
+        "applies": None,
+        "tolerances": {
+            "loudness_lufs": (0.05, None),
+            "true_peak_db": (0.01, None),
+            "peak_db": (0.01, None),
+            "rms_db": (0.01, None),
+            "crest_factor_db": (0.01, None),
+            "dynamic_range_db": (0.1, None),
+            "transient_density": (0.1, 0.08),
+        },
+    },
+}
+
+
+# --- MEASUREMENT ---
+
+def flatten_metrics(value, prefix: str = ""):
+    """
+    {"a": {"b": 1.0}, "c": [2.0, 3.0]} -> {"a.b": 1.0, "c.0": 2.0, "c.1": 3.0} (numbers only)
+    """
+    if isinstance(value, dict):
+        metrics = {}
+        for key, item in value.items():
+            metrics.update(flatten_metrics(item, f"{prefix}.{key}" if prefix else str(key)))
+        return metrics
+    if isinstance(value, (list, tuple)):
+        metrics = {}
+        for i, item in enumerate(value):
+            metrics.update(flatten_metrics(item, f"{prefix}.{i}"))
+        return metrics
+    if isinstance(value, (bool, str)) or value is None:
+        return {}
+    try:
+        return {prefix: float(value)}
+    except (TypeError, ValueError):
+        return {}
+
+
+def measure(fn, track, repeat: int, memory: bool):
+    """
+    Returns:
+        (result, best wall time in seconds, peak traced memory in MB or None)
+    """
+    times = []
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        result = fn(track)
+        times.append(time.perf_counter() - start)
+
+    peak_mb = None
+    if memory:
+        tracemalloc.start()
+        try:
+            fn(track)
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+        finally:
+            tracemalloc.stop()
+    return result, min(times), peak_mb
+
+
+def compare_metrics(reference: dict, fast: dict, tolerances: dict):
+    """
+    Per-metric errors of the fast result against the reference.
+
+    Returns:
+        {metric: {"reference", "fast", "abs_error", "rel_error", "ok"}}
+    """
+    reference, fast = flatten_metrics(reference), flatten_metrics(fast)
+    rows = {}
+    for metric, ref_value in reference.items():
+        tolerance = next((tol for pattern, tol in tolerances.items() if fnmatch.fnmatchcase(metric, pattern)), None)
+        if tolerance is None:
+            continue
+        abs_tol, rel_tol = tolerance
+        fast_value = fast.get(metric)
+        if fast_value is None or not np.isfinite(fast_value) or not np.isfinite(ref_value):
+            rows[metric] = {"reference": ref_value, "fast": fast_value, "abs_error": None, "rel_error": None, "ok": fast_value == ref_value}
+            continue
+        abs_error = abs(fast_value - ref_value)
+        rel_error = abs_error / abs(ref_value) if abs(ref_value) >= REL_ERROR_FLOOR else None
+        ok = (abs_tol is not None and abs_error <= abs_tol) or (rel_tol is not None and rel_error is not None and rel_error <= rel_tol)
+        rows[metric] = {
+            "reference": round(ref_value, 6),
+            "fast": round(fast_value, 6),
+            "abs_error": round(abs_error, 6),
+            "rel_error": round(rel_error, 6) if rel_error is not None else None,
+            "ok": bool(ok),
+        }
+    return rows
+
+
+def validate_track(track, cases: list, repeat: int, memory: bool):
+    references = {}
+    results = {}
+    for name in cases:
+        case = CASES[name]
+        if case["applies"] is not None and not case["applies"](track):
+            continue
+
+        try:
+            if case["reference"] not in references:
+                references[case["reference"]] = measure(REFERENCES[case["reference"]], track, repeat, memory)
+            reference, reference_s, reference_mb = references[case["reference"]]
+            fast, fast_s, fast_mb = measure(case["fast"], track, repeat, memory)
+        except Exception as e:
+            print(f"{track.name} / {name}: {type(e).__name__}: {e}")
+            results[name] = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            continue
+
+        metrics = compare_metrics(reference, fast, case["tolerances"])
+        results[name] = {
+            "ok": bool(metrics) and all(row["ok"] for row in metrics.values()),
+            "reference_s": round(reference_s, 4),
+            "fast_s": round(fast_s, 4),
+            "speedup": round(reference_s / max(fast_s, 1e-9), 2),
+            "reference_peak_mb": round(reference_mb, 1) if reference_mb is not None else None,
+            "fast_peak_mb": round(fast_mb, 1) if fast_mb is not None else None,
+            "memory_saving_pct": round(100 * (1 - fast_mb / reference_mb), 1) if memory and reference_mb else None,
+            "metrics": metrics,
+        }
+    return results
+
+
+def summarize(all_results: dict):
+    """
+    Per case over all tracks: worst errors per metric, median speedup and memory saving.
+    """
+    summary = {}
+    for name in CASES:
+        runs = {track: results[name] for track, results in all_results.items() if name in results}
+        if not runs:
+            continue
+        measured = [run for run in runs.values() if "error" not in run]
+        worst = {}
+        for run in measured:
+            for metric, row in run["metrics"].items():
+                entry = worst.setdefault(metric, {"max_abs_error": 0.0, "max_rel_error": 0.0, "failures": 0})
+                entry["max_abs_error"] = max(entry["max_abs_error"], row["abs_error"] or 0.0)
+                entry["max_rel_error"] = max(entry["max_rel_error"], row["rel_error"] or 0.0)
+                entry["failures"] += 0 if row["ok"] else 1
+        savings = [run["memory_saving_pct"] for run in measured if run["memory_saving_pct"] is not None]
+        summary[name] = {
+            "ok": all(run["ok"] for run in runs.values()),
+            "tracks": len(runs),
+            "errors": len(runs) - len(measured),
+            "median_speedup": round(float(np.median([run["speedup"] for run in measured])), 2) if measured else None,
+            "median_memory_saving_pct": round(float(np.median(savings)), 1) if savings else None,
+            "metrics": worst,
+        }
+    return summary
+
+
+def print_summary(summary: dict):
+    print(f"\n{'='*50}")
+    for name, case in summary.items():
+        status = "PASS" if case["ok"] else "FAIL"
+        memory = f", {case['median_memory_saving_pct']:.1f} % less peak memory" if case["median_memory_saving_pct"] is not None else ""
+        print(f"{status}  {name}: {case['tracks']} track(s), speedup x{case['median_speedup']}{memory}")
+        for metric, row in case["metrics"].items():
+            flag = "  !" if row["failures"] else "   "
+            print(f"{flag}   {metric:<32} max abs {row['max_abs_error']:.4g}   max rel {row['max_rel_error']:.3%}")
+        if case["errors"]:
+            print(f"  !   {case['errors']} track(s) failed to run")
+    print(f"{'='*50}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate the fast analysis paths against the reference implementations.")
+    parser.add_argument("files", nargs="*", help="local audio files to add to the corpus")
+    parser.add_argument("--duration", type=float, default=180.0, help="length of the synthetic tracks in seconds")
+    parser.add_argument("--no-synthetic", action="store_true", help="only use the given files")
+    parser.add_argument("--cases", default=",".join(CASES), help=f"comma-separated cases (default all: {', '.join(CASES)})")
+    parser.add_argument("--repeat", type=int, default=1, help="timed runs per implementation (best is kept)")
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced memory runs")
+    parser.add_argument("--output", default=None, help="write per-track results and the summary as JSON to this path")
+    args = parser.parse_args()
+
+    cases = [name.strip() for name in args.cases.split(",") if name.strip()]
+    unknown = [name for name in cases if name not in CASES]
+    if unknown:
+        parser.error(f"unknown case(s): {', '.join(unknown)}")
+
+    from analysis.utils.numba_warmup import configure_numba_cache, warm_up
+    configure_numba_cache()
+    # Compile librosa's numba kernels first so JIT time does not land in the first timing
+    warm_up()
+
+    corpus = []
+    if not args.no_synthetic:
+        corpus += [(name, lambda kind=kind, sr=sr: (synthetic_track(kind, args.duration, sr), sr)) for name, kind, sr in SYNTHETIC_CORPUS]
+    corpus += [(os.path.basename(path), lambda path=path: load_local_file(path)) for path in args.files]
+    if not corpus:
+        parser.error("no tracks: give files or drop --no-synthetic")
+
+    all_results = {}
+    for name, load in corpus:
+        print(f"Validating {name}...")
+        y, sr = load()
+        all_results[name] = validate_track(Track(name, y, sr), cases, args.repeat, not args.no_memory)
+
+    summary = summarize(all_results)
+    print_summary(summary)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"summary": summary, "tracks": all_results}, f, indent=2)
+
+    passed = all(case["ok"] for case in summary.values())
+    print("All fast modes within tolerance." if passed else "Some fast modes are out of tolerance.")
+    sys.exit(0 if passed else FAILURE_EXIT_CODE)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import uuid
+
+# Must run before librosa/numba are imported
+from analysis.utils.numba_warmup import configure_numba_cache, warm_up
+configure_numba_cache()
+
+from analysis.utils.job_queue import create_broker, JOB_LEASE_S
+from analysis.utils.process_pool_executor import (
+    run_in_processpool,
+    run_revision_in_processpool,
+    prewarm_pool,
+    shutdown_pool,
+    MAX_WORKERS
+)
+
+
+"""
+
+Analysis worker: pulls jobs from the queue and runs them on this machine's process pool
+
+    ANALYSIS_BACKEND=redis REDIS_URL=redis://queue:6379/0 python worker.py --concurrency 4
+
+Concurrency is the number of jobs in flight on this worker (defaults to the
+pool size, ANALYSIS_WORKERS). The API nodes run with ANALYSIS_BACKEND=redis
+and only decode headers, queue jobs and call the LLM. With ANALYSIS_BACKEND=local
+the API runs one AnalysisWorker in-process on the same protocol.
+
+Caches written during analysis (CHUNK_CACHE_DIR, WAVEFORM_DIR) live on the
+worker's disk; point them at shared storage when workers run on several machines.
+
+"""
+
+POLL_S = 0.25 # idle wait between claims when the queue is empty
+CLAIM_BACKOFF_MAX_S = 5.0 # longest wait between claims while the broker keeps failing
+
+# Job kind -> coroutine (audio bytes, mime, **args)
+JOB_HANDLERS = {
+    "analyze": run_in_processpool,
+    "revision": run_revision_in_processpool,
+}
+
+
+class AnalysisWorker:
+
+    def __init__(self, broker, concurrency: int = MAX_WORKERS, worker_id: str = None):
+        self.broker = broker
+        self.concurrency = concurrency
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.active = {} # job id -> task
+        self.completed = 0
+        self.failed = 0
+        self._stop = asyncio.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    async def run(self):
+        """
+        Claim and run jobs until stop() is called, then finish the running ones.
+        """
+        slots = asyncio.Semaphore(self.concurrency)
+        heartbeat = asyncio.create_task(self._heartbeat_loop())
+        failures = 0
+        try:
+            while not self._stop.is_set():
+                await slots.acquire()
+                try:
+                    job = await self.broker.claim(self.worker_id)
+                    failures = 0
+                except Exception as e:
+                    # Broker unreachable or a bad job record: keep the worker alive and retry with backoff
+                    job = None
+                    failures += 1
+                    print(f"Claim failed ({failures} in a row): {type(e).__name__}: {e}")
+                if job is None:
+                    slots.release()
+                    try:
+                        await asyncio.wait_for(self._stop.wait(), min(CLAIM_BACKOFF_MAX_S, POLL_S * 2 ** failures))
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                task = asyncio.create_task(self._process(job))
+                self.active[job.id] = task
+                task.add_done_callback(lambda _, job_id=job.id: (self.active.pop(job_id, None), slots.release()))
+
+            if self.active:
+                await asyncio.gather(*self.active.values(), return_exceptions=True)
+        finally:
+            heartbeat.cancel()
+
+    async def _process(self, job):
+        print(f"Worker {self.worker_id}: job {job.id} ({job.kind}, attempt {job.attempt})")
+        try:
+            result = await JOB_HANDLERS[job.kind](job.audio, job.mime, **job.args)
+        except Exception as e:
+            self.failed += 1
+            print(f"Job {job.id} failed: {e}")
+            await self._report(self.broker.fail(self.worker_id, job.id, f"{type(e).__name__}: {e}"), job)
+            return
+        self.completed += 1
+        await self._report(self.broker.complete(self.worker_id, job.id, result), job)
+
+    async def _report(self, outcome, job):
+        # If the broker is unreachable the lease runs out and the job is retried elsewhere
+        try:
+            await outcome
+        except Exception as e:
+            print(f"Could not report job {job.id}: {type(e).__name__}: {e}")
+
+    async def _heartbeat_loop(self):
+        # Renew the leases of running jobs; every worker also returns expired leases to the queue
+        while True:
+            try:
+                await self.broker.heartbeat(self.worker_id, list(self.active), {
+                    "concurrency": self.concurrency,
+                    "active": len(self.active),
+                    "completed": self.completed,
+                    "failed": self.failed,
+                })
+                requeued = await self.broker.requeue_expired()
+                if requeued:
+                    print(f"Requeued {requeued} job(s) with expired leases")
+            except Exception as e:
+                print(f"Heartbeat failed: {e}")
+            await asyncio.sleep(JOB_LEASE_S / 3)
+
+
+async def serve(backend: str, concurrency: int):
+    await asyncio.to_thread(warm_up)
+    await prewarm_pool()
+
+    broker = create_broker(backend)
+    worker = AnalysisWorker(broker, concurrency)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+
+    print(f"Worker {worker.worker_id} ready ({concurrency} concurrent jobs)")
+    try:
+        await worker.run()
+    finally:
+        await broker.close()
+        shutdown_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run analysis jobs from the queue.")
+    parser.add_argument("--backend", default=os.getenv("ANALYSIS_BACKEND", "redis"), help="broker (redis; local only makes sense in-process)")
+    parser.add_argument("--concurrency", type=int, default=MAX_WORKERS, help="jobs in flight on this worker")
+    args = parser.parse_args()
+    asyncio.run(serve(args.backend, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()